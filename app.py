@@ -4,17 +4,36 @@ Hybrid Office Tracker - Web Application
 Flask backend for office location coordination
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session, flash, send_file, abort, g
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from datetime import datetime, timedelta, date
-import psycopg2
-import psycopg2.extras
 import os
+import sys
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 import pytz
 import yaml
+from jobs import (job_handler, init_jobs_table, enqueue_job, artifact_path, publish_artifact,
+                  fetch_artifact, discard_artifact)
+from exports import EXPORT_FORMATS, FILE_ONLY_FORMATS, iter_export, write_export_file, parquet_available
+from web_cache import FragmentCache, init_web_cache
+from attendance_index import AttendanceIndex, HISTORY_DAYS
+from recommender import recommend_days, candidate_days
+from desks import DeskMap, init_desk_tables, seed_desks
+from ics_feed import build_ics
+from bulk_import import import_users, take_invites, UNUSABLE_PASSWORD
+from invites import hash_token, new_invite
+from storage import open_store
+from repositories import Repositories, Conflict, normalize_email
+from profiler import ProfilingCursor, SQLiteProfilingCursor, init_profiler, init_profiler_table
+from webhooks import init_webhook_tables, is_valid_url
+from rate_limit import init_rate_limiter, init_rate_limit_table
+from collections import Counter
+from email_notifications import EmailNotifier
+import time
+import secrets
+import uuid
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
@@ -23,8 +42,62 @@ app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-producti
 with open('config.yaml', 'r') as f:
     config = yaml.safe_load(f)
 
-# Database URL (PostgreSQL)
+# Database URL: postgresql://... or sqlite:///path (embedded). Required: falling
+# back to a local file would lose data on hosts with ephemeral disks
 DATABASE_URL = os.environ.get('DATABASE_URL')
+if not DATABASE_URL:
+    sys.exit('Set DATABASE_URL (postgresql://... or sqlite:///data/office_tracker.db)')
+
+# Connections are reused per process; hot queries are prepared once per Postgres connection.
+# Set PREPARED_STATEMENTS=0 when connecting through a transaction-mode pooler.
+db_config = config.get('database', {})
+store = open_store(
+    DATABASE_URL, db_config,
+    cursor_factory=ProfilingCursor,
+    sqlite_cursor_factory=SQLiteProfilingCursor,
+    prepare=os.environ.get('PREPARED_STATEMENTS', str(db_config.get('prepared_statements', True))).lower()
+    not in ('0', 'false', 'no')
+)
+
+# Team that existing users and new registrations fall back to
+DEFAULT_TEAM_NAME = config.get('app', {}).get('default_team', 'Default Team')
+
+# Days an invite link stays valid
+INVITE_DAYS = config.get('app', {}).get('invite_days', 7)
+
+# Webhooks may only target public hosts unless this is switched on for local testing
+WEBHOOK_ALLOW_PRIVATE_HOSTS = config.get('webhooks', {}).get('allow_private_hosts', False)
+
+# Largest page the change feed will return
+CHANGE_FEED_MAX_LIMIT = 5000
+
+# Longest start..end window the attendance and recommendation APIs accept
+# (the recommender scores users x days x offices in memory)
+MAX_DATE_WINDOW_DAYS = 92
+
+# CSV exports spanning more days than this are handed to the job worker
+EXPORT_ASYNC_DAYS = config.get('jobs', {}).get('export_async_days', 31)
+
+# Response compression, fingerprinted static assets and rendered-fragment cache
+http_config = config.get('http', {})
+init_web_cache(app, min_size=http_config.get('compress_min_bytes', 1024))
+fragment_cache = FragmentCache(max_entries=http_config.get('fragment_cache_size', 512),
+                               ttl=http_config.get('fragment_cache_ttl', 300))
+
+# Per-process bitset index of who is where on which day
+attendance = AttendanceIndex()
+NON_OFFICE_LOCATIONS = config.get('attendance', {}).get('non_office_locations', ['Work From Home', 'Day Off'])
+
+# Generated .ics feeds, keyed by user/version/day
+ICS_PAST_DAYS = 30
+ICS_FUTURE_DAYS = 90
+ics_cache = FragmentCache(max_entries=http_config.get('ics_cache_size', 5000), ttl=24 * 3600)
+
+# Per-process desk occupancy map
+desk_map = DeskMap()
+
+# Weeks of history used to learn each person's weekday habits
+RECOMMENDER_HISTORY_DAYS = config.get('attendance', {}).get('recommender_history_days', 90)
 
 # Scheduler
 scheduler = BackgroundScheduler()
@@ -33,17 +106,41 @@ timezone = pytz.timezone(config['schedule']['timezone'])
 
 # Database helper functions
 def get_db():
-    """Get database connection"""
-    conn = psycopg2.connect(DATABASE_URL)
-    conn.cursor_factory = psycopg2.extras.DictCursor
-    return conn
+    """Get a database connection (closing it returns it to the pool)"""
+    return store.connect()
+
+
+# Token buckets per route and IP/user on login, registration and location updates
+rate_limiter = init_rate_limiter(app, get_db, config.get('rate_limits', {}))
+
+
+# Opt-in request profiling: ?_profile=1 as an admin, or a random sample of requests
+profiling_config = config.get('profiling', {})
+init_profiler(app, get_db,
+              sample_rate=profiling_config.get('sample_rate', 0.0),
+              interval=profiling_config.get('interval_ms', 5) / 1000,
+              keep=profiling_config.get('keep', 50))
 
 
 def init_db():
     """Initialize database tables"""
+    if store.dialect == 'sqlite':
+        # The embedded schema is a single script (storage.py)
+        store.create_schema()
+        return
+    
     conn = get_db()
     cursor = conn.cursor()
     
+    # Teams table (tenants)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS teams (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
     # Users table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -53,6 +150,7 @@ def init_db():
             password_hash VARCHAR(255) NOT NULL,
             is_admin BOOLEAN DEFAULT FALSE,
             is_active BOOLEAN DEFAULT TRUE,
+            team_id INTEGER REFERENCES teams(id),
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
@@ -64,9 +162,11 @@ def init_db():
             name VARCHAR(255) NOT NULL UNIQUE,
             emoji VARCHAR(10) NOT NULL,
             color VARCHAR(20) NOT NULL,
-            is_active BOOLEAN DEFAULT TRUE
+            is_active BOOLEAN DEFAULT TRUE,
+            capacity INTEGER
         )
     ''')
+    cursor.execute('ALTER TABLE locations ADD COLUMN IF NOT EXISTS capacity INTEGER')
     
     # Responses table
     cursor.execute('''
@@ -75,13 +175,52 @@ def init_db():
             user_id INTEGER NOT NULL,
             location_id INTEGER NOT NULL,
             date DATE NOT NULL,
+            team_id INTEGER,
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES users(id),
             FOREIGN KEY (location_id) REFERENCES locations(id),
+            FOREIGN KEY (team_id) REFERENCES teams(id),
             UNIQUE(user_id, date)
         )
     ''')
     
+    # Add team columns to tables created before teams existed
+    cursor.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS team_id INTEGER REFERENCES teams(id)')
+    cursor.execute('ALTER TABLE responses ADD COLUMN IF NOT EXISTS team_id INTEGER REFERENCES teams(id)')
+    
+    # Calendar subscription: secret feed token, and a version bumped whenever
+    # the user's responses change so feeds are only rebuilt when needed
+    cursor.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS calendar_token VARCHAR(64) UNIQUE')
+    cursor.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS calendar_version BIGINT NOT NULL DEFAULT 0')
+    
+    # Morning digest goes to admins and team leads who haven't unsubscribed
+    cursor.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS is_team_lead BOOLEAN NOT NULL DEFAULT FALSE')
+    cursor.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS morning_digest BOOLEAN NOT NULL DEFAULT TRUE')
+    
+    # Pending invite of a user who hasn't chosen a password yet (hash only)
+    cursor.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS invite_token_hash VARCHAR(64) UNIQUE')
+    cursor.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS invite_expires_at TIMESTAMP')
+    
+    # Change feed: every insert/update of a response takes the next sequence value
+    cursor.execute('CREATE SEQUENCE IF NOT EXISTS responses_change_seq')
+    cursor.execute('''
+        ALTER TABLE responses
+        ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT nextval('responses_change_seq')
+    ''')
+    # ...and records its transaction. Sequence values are taken before commit, so
+    # the feed pages on (change_txid, change_seq) and only reads changes older than
+    # every running transaction: nothing can commit behind a consumer's cursor
+    cursor.execute('''
+        ALTER TABLE responses
+        ADD COLUMN IF NOT EXISTS change_txid BIGINT NOT NULL DEFAULT txid_current()
+    ''')
+    
+    # Change feed token for sync jobs (SHA-256 of it; the token is shown once)
+    cursor.execute('ALTER TABLE teams ADD COLUMN IF NOT EXISTS feed_token_hash VARCHAR(64) UNIQUE')
+    
+    # Bumped when members or locations change, so cached day summaries are rebuilt
+    cursor.execute('ALTER TABLE teams ADD COLUMN IF NOT EXISTS roster_version BIGINT NOT NULL DEFAULT 0')
+    
     # Notifications log
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS notifications (
@@ -92,10 +231,35 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users(id)
         )
     ''')
+    # Batch runs (user_id NULL) record how long they took and how many they reached
+    cursor.execute('ALTER TABLE notifications ADD COLUMN IF NOT EXISTS duration_ms REAL')
+    cursor.execute('ALTER TABLE notifications ADD COLUMN IF NOT EXISTS recipients INTEGER')
     
     # Create indexes
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_responses_date ON responses(date)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_responses_user_date ON responses(user_id, date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_responses_team_date ON responses(team_id, date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_team ON users(team_id, is_active)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_responses_team_change ON responses(team_id, change_seq)')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_responses_team_feed
+        ON responses(team_id, change_txid, change_seq)
+    ''')
+    
+    # Floors, desks and desk bookings
+    init_desk_tables(cursor)
+    
+    # Background jobs
+    init_jobs_table(cursor)
+    
+    # Request profiles
+    init_profiler_table(cursor)
+    
+    # Outbound webhooks
+    init_webhook_tables(cursor)
+    
+    # Rate limit buckets
+    init_rate_limit_table(cursor)
     
     conn.commit()
     conn.close()
@@ -104,25 +268,11 @@ def init_db():
 def cleanup_duplicate_locations():
     """Remove duplicate locations, keep only the first occurrence"""
     conn = get_db()
-    cursor = conn.cursor()
+    repos = Repositories(conn.cursor())
     
     try:
-        # Get all location names with their first ID
-        cursor.execute('''
-            SELECT name, MIN(id) as keep_id
-            FROM locations
-            GROUP BY name
-            HAVING COUNT(*) > 1
-        ''')
-        duplicates = cursor.fetchall()
-        
-        for dup in duplicates:
-            # Delete all duplicates except the first one
-            cursor.execute('''
-                DELETE FROM locations 
-                WHERE name = %s AND id != %s
-            ''', (dup['name'], dup['keep_id']))
-            print(f"✅ Cleaned up duplicates for: {dup['name']}")
+        for name in repos.locations.remove_duplicates():
+            print(f"✅ Cleaned up duplicates for: {name}")
         
         conn.commit()
     except Exception as e:
@@ -135,8 +285,9 @@ def seed_initial_data():
     """Seed initial office locations and admin user"""
     conn = get_db()
     cursor = conn.cursor()
+    repos = Repositories(cursor)
     
-    # Insert default locations (OR IGNORE if already exist)
+    # Insert default locations (skipped if they already exist)
     locations = [
         ('HSR Office', '🏢', '#4CAF50'),
         ('MDP Office', '🏛️', '#2196F3'),
@@ -146,21 +297,31 @@ def seed_initial_data():
     ]
     
     for name, emoji, color in locations:
-        cursor.execute('''
-            INSERT INTO locations (name, emoji, color) 
-            VALUES (%s, %s, %s)
-            ON CONFLICT (name) DO NOTHING
-        ''', (name, emoji, color))
-    
-    # Check if admin user exists (by email)
-    cursor.execute('SELECT COUNT(*) as count FROM users WHERE email = %s', ('admin@company.com',))
-    if cursor.fetchone()['count'] == 0:
-        # Create default admin user
-        admin_password = generate_password_hash('admin123')
-        cursor.execute('''
-            INSERT INTO users (email, name, password_hash, is_admin)
-            VALUES (%s, %s, %s, %s)
-        ''', ('admin@company.com', 'Admin User', admin_password, True))
+        repos.locations.ensure(name, emoji, color)
+    
+    # Seat limits (optional) come from config.yaml
+    for office in config.get('offices', []):
+        if 'capacity' in office:
+            repos.locations.set_capacity(office['name'], office['capacity'])
+    
+    # Floors and desks (optional) come from config.yaml
+    seed_desks(cursor, config.get('offices', []))
+    
+    # Default team for single-team installs and pre-existing data
+    default_team_id = repos.teams.ensure(DEFAULT_TEAM_NAME)
+    
+    # Backfill rows created before teams existed
+    repos.users.assign_team(default_team_id)
+    repos.responses.assign_teams()
+    
+    # Emails are matched lowercased; accounts that differ only in case need a manual merge
+    for email in repos.users.lowercase_emails():
+        print(f"⚠️  {email} differs only in case from another account and can't sign in until merged")
+    
+    # Create the default admin user if it doesn't exist
+    if not repos.users.email_exists('admin@company.com'):
+        repos.users.create('admin@company.com', 'Admin User', generate_password_hash('admin123'),
+                           default_team_id, is_admin=True)
     
     conn.commit()
     conn.close()
@@ -172,10 +333,21 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login', next=request.url))
+        if 'team_id' not in session:
+            # Sessions issued before teams existed
+            session['team_id'] = lookup_team_id(session['user_id'])
         return f(*args, **kwargs)
     return decorated_function
 
 
+def lookup_team_id(user_id):
+    """Get the team a user belongs to"""
+    conn = get_db()
+    user = Repositories(conn.cursor()).users.role(user_id)
+    conn.close()
+    return user['team_id'] if user else None
+
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -183,14 +355,33 @@ def admin_required(f):
             return redirect(url_for('login'))
         
         conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('SELECT is_admin FROM users WHERE id = %s', (session['user_id'],))
-        user = cursor.fetchone()
+        user = Repositories(conn.cursor()).users.role(session['user_id'])
         conn.close()
         
         if not user or not user['is_admin']:
             flash('Access denied. Admin privileges required.', 'error')
             return redirect(url_for('dashboard'))
+        session['team_id'] = user['team_id']
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+
+def feed_access_required(f):
+    """A signed-in admin, or a sync job sending its team's feed token (Authorization: Bearer ...)"""
+    admin_view = admin_required(f)
+    
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        auth = request.headers.get('Authorization', '')
+        if not auth.startswith('Bearer '):
+            return admin_view(*args, **kwargs)
+        conn = get_db()
+        team = Repositories(conn.cursor()).teams.by_feed_token(hash_token(auth[len('Bearer '):].strip()))
+        conn.close()
+        if not team:
+            return jsonify({'error': 'Invalid or revoked token'}), 401
+        g.api_team_id = team['id']
         return f(*args, **kwargs)
     return decorated_function
 
@@ -208,19 +399,18 @@ def index():
 def login():
     """User login"""
     if request.method == 'POST':
-        email = request.form.get('email')
+        email = normalize_email(request.form.get('email'))
         password = request.form.get('password')
         
         conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE email = %s AND is_active = TRUE', (email,))
-        user = cursor.fetchone()
+        user = Repositories(conn.cursor()).users.active_by_email(email)
         conn.close()
         
         if user and check_password_hash(user['password_hash'], password):
             session['user_id'] = user['id']
             session['user_name'] = user['name']
             session['is_admin'] = user['is_admin']
+            session['team_id'] = user['team_id']
             
             next_page = request.args.get('next')
             return redirect(next_page if next_page else url_for('dashboard'))
@@ -264,19 +454,16 @@ def change_password():
         
         # Verify current password
         conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('SELECT password_hash FROM users WHERE id = %s', (session['user_id'],))
-        user = cursor.fetchone()
+        repos = Repositories(conn.cursor())
+        password_hash = repos.users.password_hash(session['user_id'])
         
-        if not user or not check_password_hash(user['password_hash'], current_password):
+        if not password_hash or not check_password_hash(password_hash, current_password):
             conn.close()
             flash('Current password is incorrect', 'error')
             return render_template('change_password.html')
         
         # Update password
-        new_password_hash = generate_password_hash(new_password)
-        cursor.execute('UPDATE users SET password_hash = %s WHERE id = %s', 
-                      (new_password_hash, session['user_id']))
+        repos.users.set_password(session['user_id'], generate_password_hash(new_password))
         conn.commit()
         conn.close()
         
@@ -286,11 +473,55 @@ def change_password():
     return render_template('change_password.html')
 
 
+@app.route('/invite/<token>', methods=['GET', 'POST'])
+def accept_invite(token):
+    """Choose a password through a single-use invite link, then sign in"""
+    token_hash = hash_token(token)
+    conn = get_db()
+    repos = Repositories(conn.cursor())
+    user = repos.users.by_invite(token_hash, datetime.utcnow())
+    if not user:
+        conn.close()
+        flash('This invite link is invalid, used or expired. Ask your admin for a new one.', 'error')
+        return redirect(url_for('login'))
+    
+    if request.method == 'POST':
+        password = request.form.get('password') or ''
+        confirm_password = request.form.get('confirm_password')
+        
+        if password != confirm_password:
+            conn.close()
+            flash('Passwords do not match', 'error')
+            return render_template('accept_invite.html', user=user)
+        
+        if len(password) < 6:
+            conn.close()
+            flash('Password must be at least 6 characters long', 'error')
+            return render_template('accept_invite.html', user=user)
+        
+        accepted = repos.users.accept_invite(user['id'], token_hash, generate_password_hash(password))
+        conn.commit()
+        conn.close()
+        if not accepted:
+            flash('This invite link was already used', 'error')
+            return redirect(url_for('login'))
+        
+        session['user_id'] = user['id']
+        session['user_name'] = user['name']
+        session['is_admin'] = user['is_admin']
+        session['team_id'] = user['team_id']
+        flash('Welcome! Your password is set.', 'success')
+        return redirect(url_for('dashboard'))
+    
+    conn.close()
+    return render_template('accept_invite.html', user=user)
+
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     """User registration"""
     if request.method == 'POST':
-        email = request.form.get('email')
+        email = normalize_email(request.form.get('email'))
         name = request.form.get('name')
         password = request.form.get('password')
         confirm_password = request.form.get('confirm_password')
@@ -299,22 +530,24 @@ def register():
             flash('Passwords do not match', 'error')
             return render_template('register.html')
         
+        if len(password or '') < 6:
+            flash('Password must be at least 6 characters long', 'error')
+            return render_template('register.html')
+        
         conn = get_db()
-        cursor = conn.cursor()
+        repos = Repositories(conn.cursor())
         
         # Check if email already exists
-        cursor.execute('SELECT id FROM users WHERE email = %s', (email,))
-        if cursor.fetchone():
+        if repos.users.email_exists(email):
             flash('Email already registered', 'error')
             conn.close()
             return render_template('register.html')
         
+        # Self-registration only ever joins the default team; other teams invite their members
+        team = repos.teams.by_name(DEFAULT_TEAM_NAME)
+        
         # Create new user
-        password_hash = generate_password_hash(password)
-        cursor.execute('''
-            INSERT INTO users (email, name, password_hash)
-            VALUES (%s, %s, %s)
-        ''', (email, name, password_hash))
+        repos.users.create(email, name, generate_password_hash(password), team['id'])
         
         conn.commit()
         conn.close()
@@ -330,55 +563,29 @@ def register():
 def dashboard():
     """Main dashboard"""
     conn = get_db()
-    cursor = conn.cursor()
+    repos = Repositories(conn.cursor())
     
     # Get today's date
     today = date.today()
     tomorrow = today + timedelta(days=1)
     
-    # Get user's response for today
-    cursor.execute('''
-        SELECT l.name, l.emoji, l.color
-        FROM responses r
-        JOIN locations l ON r.location_id = l.id
-        WHERE r.user_id = %s AND r.date = %s
-    ''', (session['user_id'], today))
-    today_location = cursor.fetchone()
-    
-    # Get user's response for tomorrow
-    cursor.execute('''
-        SELECT l.id, l.name, l.emoji, l.color
-        FROM responses r
-        JOIN locations l ON r.location_id = l.id
-        WHERE r.user_id = %s AND r.date = %s
-    ''', (session['user_id'], tomorrow))
-    tomorrow_location = cursor.fetchone()
+    # Get user's response for today and tomorrow
+    today_location = repos.responses.for_user_day(session['user_id'], today)
+    tomorrow_location = repos.responses.for_user_day(session['user_id'], tomorrow)
     
     # Get all active locations
-    cursor.execute('SELECT * FROM locations WHERE is_active = TRUE')
-    locations = cursor.fetchall()
+    locations = repos.locations.active()
     
     # Get today's summary
-    cursor.execute('''
-        SELECT l.name, l.emoji, l.color, COUNT(*) as count
-        FROM responses r
-        JOIN locations l ON r.location_id = l.id
-        WHERE r.date = %s
-        GROUP BY l.id
-        ORDER BY count DESC
-    ''', (today,))
-    today_summary = cursor.fetchall()
+    today_summary = repos.responses.day_summary(session['team_id'], today)
     
     # Get team members at each location today
-    cursor.execute('''
-        SELECT u.name as user_name, l.name as location_name, l.emoji, l.color
-        FROM responses r
-        JOIN users u ON r.user_id = u.id
-        JOIN locations l ON r.location_id = l.id
-        WHERE r.date = %s AND u.is_active = TRUE
-        ORDER BY l.name, u.name
-    ''', (today,))
-    team_locations = cursor.fetchall()
+    team_locations = repos.responses.day_members(session['team_id'], today)
+    
+    # Suggested days for the whole team to be in together over the next two weeks
+    suggestions = recommend_for_group(repos, session['team_id'],
+                                      repos.users.active_ids(session['team_id']),
+                                      tomorrow, tomorrow + timedelta(days=13), top=3)
     
     conn.close()
     
@@ -389,7 +596,8 @@ def dashboard():
                          tomorrow_location=tomorrow_location,
                          locations=locations,
                          today_summary=today_summary,
-                         team_locations=team_locations)
+                         team_locations=team_locations,
+                         suggestions=suggestions)
 
 
 @app.route('/set-location', methods=['POST'])
@@ -402,21 +610,60 @@ def set_location():
     if not location_id or not target_date:
         return jsonify({'success': False, 'message': 'Missing parameters'}), 400
     
+    try:
+        target_date = datetime.strptime(target_date, '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+    
+    desk_id = request.form.get('desk_id', type=int)
+    
     conn = get_db()
-    cursor = conn.cursor()
+    repos = Repositories(conn.cursor())
+    
+    # Optional desk booking, checked against the in-memory occupancy map
+    message, category = 'Location updated successfully!', 'success'
+    if desk_id or request.form.get('auto_desk'):
+        desk_map.refresh(repos)
+        if not desk_id:
+            # Locations without desks (Work From Home, Day Off) need no search
+            if desk_map.has_desks(location_id):
+                desk = desk_map.find_free_desk(location_id, target_date,
+                                               teammate_desk_ids(repos, location_id, target_date))
+                desk_id = desk['id'] if desk else None
+                if not desk:
+                    message, category = 'Location updated, but no desk was free there.', 'info'
+        elif (desk_map.location_of(desk_id) != location_id or
+              not desk_map.is_free(desk_id, target_date, session['user_id'])):
+            conn.close()
+            flash('That desk is not available. Please pick another one.', 'error')
+            return redirect(url_for('dashboard'))
     
     # Insert or update response
-    cursor.execute('''
-        INSERT INTO responses (user_id, location_id, date)
-        VALUES (%s, %s, %s)
-        ON CONFLICT(user_id, date)
-        DO UPDATE SET location_id = %s, timestamp = CURRENT_TIMESTAMP
-    ''', (session['user_id'], location_id, target_date, location_id))
+    try:
+        change_seq = repos.responses.upsert(session['user_id'], location_id, target_date,
+                                            session['team_id'], desk_id)
+    except Conflict:
+        # Someone booked the desk through another worker a moment ago; until their
+        # booking shows up in the feed, stop offering it
+        conn.rollback()
+        conn.close()
+        desk_map.mark_taken(desk_id, target_date)
+        flash('That desk was just taken. Please pick another one.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    # Invalidate this user's calendar feed
+    repos.users.set_calendar_version(session['user_id'], change_seq)
+    
+    # Webhook event commits (or rolls back) with the response
+    repos.webhooks.emit_location_event(session['user_id'], target_date)
     
     conn.commit()
     conn.close()
     
-    flash('Location updated successfully!', 'success')
+    attendance.record(session['team_id'], session['user_id'], location_id, target_date)
+    desk_map.record(session['user_id'], target_date, desk_id)
+    
+    flash(message, category)
     return redirect(url_for('dashboard'))
 
 
@@ -431,49 +678,40 @@ def summary(date_str):
         return redirect(url_for('dashboard'))
     
     conn = get_db()
-    cursor = conn.cursor()
+    repos = Repositories(conn.cursor())
+    
+    # Past days render the same for the whole team: reuse the rendered fragment
+    # until a response for that day changes (change_seq moves), the team's members
+    # or the locations change (roster_version moves) or the TTL expires
+    cache_key = None
+    if target_date < date.today():
+        roster_version, version = repos.responses.day_version(session['team_id'], target_date)
+        cache_key = (session['team_id'], target_date, roster_version, version)
+        summary_html = fragment_cache.get(cache_key)
+        if summary_html is not None:
+            conn.close()
+            return render_template('summary.html', summary_html=summary_html)
     
     # Get summary
-    cursor.execute('''
-        SELECT l.name, l.emoji, l.color, COUNT(*) as count
-        FROM responses r
-        JOIN locations l ON r.location_id = l.id
-        WHERE r.date = %s
-        GROUP BY l.id
-        ORDER BY count DESC
-    ''', (target_date,))
-    summary_data = cursor.fetchall()
+    summary_data = repos.responses.day_summary(session['team_id'], target_date)
     
     # Get detailed list
-    cursor.execute('''
-        SELECT u.name as user_name, l.name as location_name, l.emoji, l.color
-        FROM responses r
-        JOIN users u ON r.user_id = u.id
-        JOIN locations l ON r.location_id = l.id
-        WHERE r.date = %s AND u.is_active = TRUE
-        ORDER BY l.name, u.name
-    ''', (target_date,))
-    detailed_list = cursor.fetchall()
+    detailed_list = repos.responses.day_members(session['team_id'], target_date)
     
     # Get users who haven't responded
-    cursor.execute('''
-        SELECT u.name
-        FROM users u
-        WHERE u.is_active = TRUE
-        AND u.id NOT IN (
-            SELECT user_id FROM responses WHERE date = %s
-        )
-        ORDER BY u.name
-    ''', (target_date,))
-    no_response = cursor.fetchall()
+    no_response = repos.responses.day_missing(session['team_id'], target_date)
     
     conn.close()
     
-    return render_template('summary.html',
-                         date=target_date,
-                         summary=summary_data,
-                         detailed_list=detailed_list,
-                         no_response=no_response)
+    summary_html = render_template('_summary_content.html',
+                                   date=target_date,
+                                   summary=summary_data,
+                                   detailed_list=detailed_list,
+                                   no_response=no_response)
+    if cache_key:
+        fragment_cache.set(cache_key, summary_html)
+    
+    return render_template('summary.html', summary_html=summary_html)
 
 
 @app.route('/calendar')
@@ -481,61 +719,143 @@ def summary(date_str):
 def calendar():
     """Calendar view of user's responses"""
     conn = get_db()
-    cursor = conn.cursor()
+    repos = Repositories(conn.cursor())
     
     # Get user's responses for the last 30 days and next 30 days
     start_date = date.today() - timedelta(days=30)
     end_date = date.today() + timedelta(days=30)
     
-    cursor.execute('''
-        SELECT r.date, l.name, l.emoji, l.color
-        FROM responses r
-        JOIN locations l ON r.location_id = l.id
-        WHERE r.user_id = %s AND r.date BETWEEN %s AND %s
-        ORDER BY r.date
-    ''', (session['user_id'], start_date, end_date))
+    user_responses = repos.responses.calendar(session['user_id'], start_date, end_date)
     
-    user_responses = cursor.fetchall()
+    # Subscription token is created the first time the user opens their calendar
+    user = repos.users.calendar_settings(session['user_id'])
+    token = user['calendar_token']
+    if not token:
+        token = secrets.token_urlsafe(24)
+        repos.users.set_calendar_token(session['user_id'], token)
+        conn.commit()
     conn.close()
     
     return render_template('calendar.html',
                          responses=user_responses,
                          start_date=start_date,
-                         end_date=end_date)
+                         end_date=end_date,
+                         feed_url=url_for('calendar_feed', token=token, _external=True),
+                         digest_eligible=user['is_admin'] or user['is_team_lead'],
+                         morning_digest=user['morning_digest'])
 
 
-@app.route('/admin')
-@admin_required
-def admin_panel():
-    """Admin panel with optional calendar view"""
+@app.route('/calendar/<token>.ics')
+def calendar_feed(token):
+    """iCalendar subscription feed (authenticated by the secret token in the URL)"""
     conn = get_db()
-    cursor = conn.cursor()
+    repos = Repositories(conn.cursor())
+    user = repos.users.by_calendar_token(token)
+    if not user:
+        conn.close()
+        abort(404)
     
-    # Get all users
-    cursor.execute('''
-        SELECT id, email, name, is_admin, is_active, created_at
-        FROM users
-        ORDER BY name
-    ''')
-    users = cursor.fetchall()
+    # The feed window moves daily, so the day is part of the version
+    today = date.today()
+    etag = f"{user['id']}-{user['calendar_version']}-{today.isoformat()}"
+    if request.if_none_match.contains_weak(etag):
+        conn.close()
+        return Response(status=304, headers={'ETag': f'"{etag}"', 'Cache-Control': 'private, max-age=300'})
+    
+    body = ics_cache.get(etag)
+    if body is None:
+        rows = repos.responses.calendar(user['id'], today - timedelta(days=ICS_PAST_DAYS),
+                                        today + timedelta(days=ICS_FUTURE_DAYS))
+        body = build_ics(f"{user['name']} - Office Plans", rows, datetime.utcnow())
+        ics_cache.set(etag, body)
+    conn.close()
     
-    # Get all locations
-    cursor.execute('SELECT * FROM locations ORDER BY name')
-    locations = cursor.fetchall()
+    response = Response(body, mimetype='text/calendar')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response
+
+
+@app.route('/calendar/feed/reset', methods=['POST'])
+@login_required
+def reset_calendar_feed():
+    """Issue a new subscription URL, revoking the old one"""
+    conn = get_db()
+    Repositories(conn.cursor()).users.set_calendar_token(session['user_id'], secrets.token_urlsafe(24))
+    conn.commit()
+    conn.close()
     
-    # Get statistics
-    cursor.execute('SELECT COUNT(*) as total FROM users WHERE is_active = TRUE')
-    stats = {'active_users': cursor.fetchone()['total']}
+    flash('Your calendar subscription link was reset. Re-subscribe with the new link.', 'success')
+    return redirect(url_for('calendar'))
+
+
+@app.route('/admin/feed-token', methods=['POST'])
+@admin_required
+def reset_feed_token():
+    """Issue the team's change feed token for sync jobs, revoking the previous one"""
+    token = secrets.token_urlsafe(32)
+    conn = get_db()
+    Repositories(conn.cursor()).teams.set_feed_token(session['team_id'], hash_token(token))
+    conn.commit()
+    conn.close()
     
-    cursor.execute('SELECT COUNT(*) as total FROM responses WHERE date = %s', (date.today(),))
-    stats['responses_today'] = cursor.fetchone()['total']
+    flash(f'New change feed token (shown only once, the old one no longer works): {token}', 'success')
+    return redirect(url_for('admin_panel'))
+
+
+@app.route('/digest/subscription', methods=['POST'])
+@login_required
+def toggle_digest_subscription():
+    """Subscribe to or unsubscribe from the morning digest email"""
+    conn = get_db()
+    subscribed = Repositories(conn.cursor()).users.toggle_morning_digest(session['user_id'])
+    conn.commit()
+    conn.close()
     
+    flash('You will get the morning digest.' if subscribed else 'You unsubscribed from the morning digest.',
+          'success')
+    return redirect(url_for('calendar'))
+
+
+def is_default_team_admin(repos):
+    """Admins of the default team run the deployment itself, not just one tenant"""
+    team = repos.teams.by_name(DEFAULT_TEAM_NAME)
+    return bool(session.get('is_admin')) and team is not None and team['id'] == session.get('team_id')
+
+
+def admin_context(repos):
+    """Everything admin.html shows besides the calendar, shared by both admin views"""
+    team_id = session['team_id']
+    stats = {'active_users': repos.users.count_active(team_id),
+             'responses_today': repos.responses.count_for_day(team_id, date.today()),
+             'last_digest': repos.notifications.last_run('morning_digest_run')}
+    manages_teams = is_default_team_admin(repos)
+    return {
+        'users': repos.users.team(team_id),
+        'locations': repos.locations.all(),
+        'stats': stats,
+        'jobs': repos.jobs.recent(team_id),
+        'profiles': repos.profiles.recent(team_id, include_unscoped=manages_teams),
+        'webhooks': repos.webhooks.team(team_id),
+        'webhooks_available': repos.webhooks.available,
+        'feed_token_set': repos.teams.feed_token_set(team_id),
+        'manages_teams': manages_teams,
+        'parquet_available': parquet_available(),
+        'today': date.today(),
+        'timedelta': timedelta,
+    }
+
+
+@app.route('/admin')
+@admin_required
+def admin_panel():
+    """Admin panel with optional calendar view"""
+    conn = get_db()
+    context = admin_context(Repositories(conn.cursor()))
     conn.close()
     
-    return render_template('admin.html', users=users, locations=locations, stats=stats, 
-                         today=date.today(), timedelta=timedelta, 
-                         selected_date=None, calendar_data=None, 
-                         calendar_summary=None, users_without_location=None)
+    return render_template('admin.html', selected_date=None, calendar_data=None,
+                         calendar_summary=None, users_without_location=None, **context)
 
 
 @app.route('/admin/calendar-view')
@@ -551,87 +871,75 @@ def admin_calendar_view():
         return redirect(url_for('admin_panel'))
     
     conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get all users
-    cursor.execute('''
-        SELECT id, email, name, is_admin, is_active, created_at
-        FROM users
-        ORDER BY name
-    ''')
-    users = cursor.fetchall()
-    
-    # Get all locations
-    cursor.execute('SELECT * FROM locations ORDER BY name')
-    locations = cursor.fetchall()
-    
-    # Get statistics
-    cursor.execute('SELECT COUNT(*) as total FROM users WHERE is_active = TRUE')
-    stats = {'active_users': cursor.fetchone()['total']}
-    
-    cursor.execute('SELECT COUNT(*) as total FROM responses WHERE date = %s', (date.today(),))
-    stats['responses_today'] = cursor.fetchone()['total']
+    repos = Repositories(conn.cursor())
+    context = admin_context(repos)
     
     # Get calendar data for selected date
-    cursor.execute('''
-        SELECT 
-            r.date,
-            u.name as user_name,
-            u.email as user_email,
-            l.name as location_name,
-            l.emoji as location_emoji,
-            l.color as location_color
-        FROM responses r
-        JOIN users u ON r.user_id = u.id
-        JOIN locations l ON r.location_id = l.id
-        WHERE r.date = %s AND u.is_active = TRUE
-        ORDER BY l.name, u.name
-    ''', (selected_date,))
-    
-    calendar_data = cursor.fetchall()
+    calendar_data = repos.responses.day_roster(session['team_id'], selected_date)
     
     # Get summary by location
-    cursor.execute('''
-        SELECT 
-            l.name as name,
-            l.emoji as emoji,
-            l.color as color,
-            COUNT(*) as count
-        FROM responses r
-        JOIN locations l ON r.location_id = l.id
-        JOIN users u ON r.user_id = u.id
-        WHERE r.date = %s AND u.is_active = TRUE
-        GROUP BY l.id
-        ORDER BY count DESC, l.name
-    ''', (selected_date,))
-    
-    calendar_summary = cursor.fetchall()
+    calendar_summary = repos.responses.day_location_counts(session['team_id'], selected_date)
     
     # Get users who haven't set location for this date
-    cursor.execute('''
-        SELECT u.id, u.name, u.email
-        FROM users u
-        WHERE u.is_active = TRUE
-        AND u.id NOT IN (
-            SELECT user_id FROM responses WHERE date = %s
-        )
-        ORDER BY u.name
-    ''', (selected_date,))
-    
-    users_without_location = cursor.fetchall()
+    users_without_location = repos.users.without_response(session['team_id'], selected_date)
     
     conn.close()
     
     return render_template('admin.html', 
-                         users=users, 
-                         locations=locations, 
-                         stats=stats, 
-                         today=date.today(), 
-                         timedelta=timedelta,
                          selected_date=selected_date,
                          calendar_data=calendar_data,
                          calendar_summary=calendar_summary,
-                         users_without_location=users_without_location)
+                         users_without_location=users_without_location,
+                         **context)
+
+
+def get_team_profile(profile_id):
+    """Fetch a request profile visible to the current team, or 404"""
+    conn = get_db()
+    repos = Repositories(conn.cursor())
+    profile = repos.profiles.get(profile_id, session['team_id'], include_unscoped=is_default_team_admin(repos))
+    conn.close()
+    if not profile:
+        abort(404)
+    return profile
+
+
+@app.route('/admin/profiles/<int:profile_id>')
+@admin_required
+def view_profile(profile_id):
+    """Where a profiled request spent its time: hot functions and SQL"""
+    profile = get_team_profile(profile_id)
+    
+    # Self samples (leaf frame) and total samples (anywhere on the stack) per function
+    self_samples, total_samples = Counter(), Counter()
+    for line in profile['folded'].splitlines():
+        stack, count = line.rsplit(' ', 1)
+        frames = stack.split(';')
+        self_samples[frames[-1]] += int(count)
+        for frame in set(frames):
+            total_samples[frame] += int(count)
+    functions = [{'name': name, 'self': count, 'total': total_samples[name]}
+                 for name, count in self_samples.most_common(25)]
+    
+    statements = {}
+    for sql, ms in profile['statements']:
+        entry = statements.setdefault(sql, {'sql': sql, 'count': 0, 'ms': 0.0})
+        entry['count'] += 1
+        entry['ms'] += ms
+    statements = sorted(statements.values(), key=lambda s: s['ms'], reverse=True)
+    
+    return render_template('profile.html', profile=profile, functions=functions,
+                           statements=statements)
+
+
+@app.route('/admin/profiles/<int:profile_id>.folded')
+@admin_required
+def download_profile(profile_id):
+    """Folded stacks for flamegraph.pl or speedscope"""
+    profile = get_team_profile(profile_id)
+    return Response(profile['folded'] + '\n', mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename=profile-{profile_id}.folded'
+    })
 
 
 @app.route('/admin/users/toggle/<int:user_id>', methods=['POST'])
@@ -639,9 +947,7 @@ def admin_calendar_view():
 def toggle_user(user_id):
     """Toggle user active status"""
     conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('UPDATE users SET is_active = NOT is_active WHERE id = %s', (user_id,))
+    Repositories(conn.cursor()).users.toggle_active(user_id, session['team_id'])
     conn.commit()
     conn.close()
     
@@ -649,13 +955,158 @@ def toggle_user(user_id):
     return redirect(url_for('admin_panel'))
 
 
+@app.route('/admin/users/lead/<int:user_id>', methods=['POST'])
+@admin_required
+def toggle_team_lead(user_id):
+    """Make a user a team lead (they receive the morning digest) or not"""
+    conn = get_db()
+    Repositories(conn.cursor()).users.toggle_team_lead(user_id, session['team_id'])
+    conn.commit()
+    conn.close()
+    
+    flash('Team lead updated', 'success')
+    return redirect(url_for('admin_panel'))
+
+
+@app.route('/admin/users/invite/<int:user_id>', methods=['POST'])
+@admin_required
+def resend_invite(user_id):
+    """Issue a fresh invite link for a user who hasn't chosen a password yet"""
+    token, token_hash, expires_at = new_invite(INVITE_DAYS)
+    conn = get_db()
+    user = Repositories(conn.cursor()).users.set_invite(user_id, session['team_id'], token_hash, expires_at)
+    conn.commit()
+    conn.close()
+    
+    if not user:
+        flash('That user has already set a password', 'error')
+    else:
+        flash(f"New invite link for {user['email']} (shown only once, the old one no longer works): "
+              f"{url_for('accept_invite', token=token, _external=True)}", 'success')
+    return redirect(url_for('admin_panel'))
+
+
+@app.route('/admin/users/import', methods=['POST'])
+@admin_required
+def queue_user_import():
+    """Upload a users CSV and queue it for the job worker"""
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Please choose a CSV file to import', 'error')
+        return redirect(url_for('admin_panel'))
+    
+    filename = f"upload-{uuid.uuid4().hex}.csv"
+    upload.save(artifact_path(filename))
+    
+    conn = get_db()
+    # The worker reads it, and it may contain passwords: no copy stays on the web host
+    publish_artifact(conn, filename, keep_local=False)
+    job_id = enqueue_job(conn, 'bulk_import_users', {'upload': filename},
+                         team_id=session['team_id'], user_id=session['user_id'])
+    conn.commit()
+    conn.close()
+    return job_accepted(job_id)
+
+
+@app.route('/admin/teams', methods=['POST'])
+@admin_required
+def create_team():
+    """Create a new team (tenant) together with its first admin, who gets an invite link"""
+    conn = get_db()
+    repos = Repositories(conn.cursor())
+    if not is_default_team_admin(repos):
+        conn.close()
+        flash('Only admins of the default team can create teams', 'error')
+        return redirect(url_for('admin_panel'))
+    
+    name = (request.form.get('name') or '').strip()
+    admin_name = (request.form.get('admin_name') or '').strip()
+    admin_email = normalize_email(request.form.get('admin_email'))
+    if not name or not admin_name or not admin_email:
+        conn.close()
+        flash('Team name, admin name and admin email are required', 'error')
+        return redirect(url_for('admin_panel'))
+    
+    if repos.users.email_exists(admin_email):
+        conn.close()
+        flash(f'{admin_email} already has an account; pick someone new to run the team', 'error')
+        return redirect(url_for('admin_panel'))
+    if not repos.teams.create(name):
+        conn.rollback()
+        conn.close()
+        flash(f'Team "{name}" already exists', 'error')
+        return redirect(url_for('admin_panel'))
+    
+    # No password matches until the admin chooses their own through the invite
+    token, token_hash, expires_at = new_invite(INVITE_DAYS)
+    repos.users.create(admin_email, admin_name, UNUSABLE_PASSWORD,
+                       repos.teams.by_name(name)['id'], is_admin=True,
+                       invite_token_hash=token_hash, invite_expires_at=expires_at)
+    conn.commit()
+    conn.close()
+    
+    flash(f'Team "{name}" created. Send {admin_email} their invite link (shown only once): '
+          f"{url_for('accept_invite', token=token, _external=True)}", 'success')
+    return redirect(url_for('admin_panel'))
+
+
+@app.route('/admin/webhooks', methods=['POST'])
+@admin_required
+def create_webhook():
+    """Subscribe a URL to this team's location changes"""
+    url = (request.form.get('url') or '').strip()
+    if not is_valid_url(url, WEBHOOK_ALLOW_PRIVATE_HOSTS):
+        flash('Webhook URL must be an http:// or https:// address of a public host', 'error')
+        return redirect(url_for('admin_panel'))
+    
+    conn = get_db()
+    repos = Repositories(conn.cursor())
+    if not repos.webhooks.available:
+        conn.close()
+        flash('Webhooks need the PostgreSQL backend (DATABASE_URL=postgresql://...)', 'error')
+        return redirect(url_for('admin_panel'))
+    repos.webhooks.create(session['team_id'], url, secrets.token_hex(32))
+    conn.commit()
+    conn.close()
+    
+    flash('Webhook added. Verify deliveries with the signing secret shown below.', 'success')
+    return redirect(url_for('admin_panel'))
+
+
+@app.route('/admin/webhooks/toggle/<int:webhook_id>', methods=['POST'])
+@admin_required
+def toggle_webhook(webhook_id):
+    """Pause or resume a webhook; a resumed webhook skips what it missed while paused"""
+    conn = get_db()
+    repos = Repositories(conn.cursor())
+    if repos.webhooks.available:
+        repos.webhooks.toggle(webhook_id, session['team_id'])
+        conn.commit()
+    conn.close()
+    
+    flash('Webhook updated', 'success')
+    return redirect(url_for('admin_panel'))
+
+
+@app.route('/admin/webhooks/delete/<int:webhook_id>', methods=['POST'])
+@admin_required
+def delete_webhook(webhook_id):
+    """Remove a webhook and its dead letters"""
+    conn = get_db()
+    repos = Repositories(conn.cursor())
+    if repos.webhooks.available:
+        repos.webhooks.delete(webhook_id, session['team_id'])
+        conn.commit()
+    conn.close()
+    
+    flash('Webhook removed', 'success')
+    return redirect(url_for('admin_panel'))
+
+
 @app.route('/admin/export-calendar')
 @admin_required
 def export_calendar():
     """Export calendar data for admin"""
-    from io import StringIO
-    import csv
-    
     start_date = request.args.get('start_date', date.today() - timedelta(days=30))
     end_date = request.args.get('end_date', date.today())
     export_format = request.args.get('format', 'csv')
@@ -666,71 +1117,221 @@ def export_calendar():
     if isinstance(end_date, str):
         end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
     
+    # Fail now rather than queue a job that can only fail
+    if export_format == 'parquet' and not parquet_available():
+        abort(400, description='Parquet export needs pyarrow (pip install pyarrow==14.0.2)')
+    
+    # Large file exports go to the job worker instead of tying up a web worker
+    if export_format in EXPORT_FORMATS and (export_format in FILE_ONLY_FORMATS or
+                                            request.args.get('async') or
+                                            (end_date - start_date).days > EXPORT_ASYNC_DAYS):
+        conn = get_db()
+        job_id = enqueue_job(conn, 'export_calendar',
+                             params={'format': export_format,
+                                     'start_date': start_date.isoformat(),
+                                     'end_date': end_date.isoformat()},
+                             team_id=session['team_id'], user_id=session['user_id'])
+        conn.commit()
+        conn.close()
+        return job_accepted(job_id)
+    
+    if export_format in EXPORT_FORMATS:
+        return Response(stream_export(session['team_id'], start_date, end_date, export_format),
+                        mimetype=EXPORT_FORMATS[export_format][0],
+                        headers={'Content-Disposition': f'attachment; filename=office-locations-'
+                                 f'{start_date}-to-{end_date}{EXPORT_FORMATS[export_format][1]}'})
+    
     conn = get_db()
-    cursor = conn.cursor()
     
     # Get all responses in date range with user and location info
-    cursor.execute('''
-        SELECT 
-            r.date,
-            u.name as user_name,
-            u.email as user_email,
-            l.name as location_name,
-            l.emoji as location_emoji
-        FROM responses r
-        JOIN users u ON r.user_id = u.id
-        JOIN locations l ON r.location_id = l.id
-        WHERE r.date BETWEEN %s AND %s
-        ORDER BY r.date DESC, u.name
-    ''', (start_date, end_date))
-    
-    data = cursor.fetchall()
-    conn.close()
-    
-    if export_format == 'csv':
-        # Generate CSV
-        si = StringIO()
-        writer = csv.writer(si)
-        
-        # Write header
-        writer.writerow(['Date', 'Day', 'Employee Name', 'Email', 'Location'])
-        
-        # Write data
-        for row in data:
-            row_date = datetime.strptime(row['date'], '%Y-%m-%d').date() if isinstance(row['date'], str) else row['date']
-            day_name = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'][row_date.weekday()]
-            writer.writerow([
-                row_date.strftime('%Y-%m-%d'),  # Ensure consistent date format
-                day_name,
-                row['user_name'],
-                row['user_email'],
-                f"{row['location_emoji']} {row['location_name']}"
-            ])
-        
-        # Create response
-        output = si.getvalue()
-        si.close()
+    data = Repositories(conn.cursor()).responses.export(session['team_id'], start_date, end_date)
+    conn.close()
+    
+    # HTML format
+    # Group by date for better visualization
+    data_by_date = {}
+    for row in data:
+        # Ensure row_date is a date object for template compatibility
+        row_date = datetime.strptime(row['date'], '%Y-%m-%d').date() if isinstance(row['date'], str) else row['date']
+        if row_date not in data_by_date:
+            data_by_date[row_date] = []
+        data_by_date[row_date].append(row)
+    
+    return render_template('export_calendar.html', 
+                         data_by_date=data_by_date, 
+                         start_date=start_date, 
+                         end_date=end_date)
+
+
+def stream_export(team_id, start_date, end_date, export_format):
+    """Stream an export straight from a server-side cursor to the client"""
+    conn = get_db()
+    try:
+        rows = Repositories(conn.cursor()).responses.export(team_id, start_date, end_date,
+                                                            stream='export_stream')
+        yield from iter_export(rows, export_format)
+        rows.close()
+    finally:
+        conn.close()
+
+
+@app.route('/admin/reminders/send', methods=['POST'])
+@admin_required
+def queue_reminders():
+    """Queue an evening reminder batch for the job worker"""
+    conn = get_db()
+    job_id = enqueue_job(conn, 'evening_reminders',
+                         team_id=session['team_id'], user_id=session['user_id'])
+    conn.commit()
+    conn.close()
+    return job_accepted(job_id)
+
+
+@app.route('/admin/digest/send', methods=['POST'])
+@admin_required
+def queue_digest():
+    """Queue today's morning digest for this team"""
+    conn = get_db()
+    job_id = enqueue_job(conn, 'morning_digest', {'date': date.today().isoformat()},
+                         team_id=session['team_id'], user_id=session['user_id'])
+    conn.commit()
+    conn.close()
+    return job_accepted(job_id)
+
+
+def job_accepted(job_id):
+    """Respond to a queued job: 202 + job id for API clients, flash for browsers"""
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({
+            'job_id': job_id,
+            'status_url': url_for('job_status', job_id=job_id)
+        }), 202
+    flash(f'Job #{job_id} queued. It will appear under Background Jobs when ready.', 'success')
+    return redirect(url_for('admin_panel'))
+
+
+def get_team_job(job_id):
+    """Fetch a job belonging to the current team, or 404"""
+    conn = get_db()
+    job = Repositories(conn.cursor()).jobs.get(job_id, session['team_id'])
+    conn.close()
+    if not job:
+        abort(404)
+    return job
+
+
+@app.route('/jobs/<int:job_id>')
+@admin_required
+def job_status(job_id):
+    """Status and progress of a background job"""
+    job = get_team_job(job_id)
+    return jsonify({
+        'id': job['id'],
+        'type': job['type'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'error': job['error'].splitlines()[0] if job['error'] else None,
+        'created_at': job['created_at'].isoformat() if job['created_at'] else None,
+        'finished_at': job['finished_at'].isoformat() if job['finished_at'] else None,
+        'download_url': url_for('job_download', job_id=job['id']) if job['artifact'] else None,
+        'result': job['result']
+    })
+
+
+@app.route('/jobs/<int:job_id>/download')
+@admin_required
+def job_download(job_id):
+    """Serve a finished job's file from the artifact store"""
+    job = get_team_job(job_id)
+    if job['status'] != 'done' or not job['artifact']:
+        abort(404)
+    conn = get_db()
+    if job['type'] == 'bulk_import_users':
+        # Invite links are handed out once: the token file goes with the first download
+        taken = Repositories(conn.cursor()).jobs.take_artifact(job['id'])
+        conn.commit()
+        if not taken:
+            conn.close()
+            abort(404)
+        body = take_invites(fetch_artifact(conn, job['artifact']),
+                            lambda token: url_for('accept_invite', token=token, _external=True))
+        discard_artifact(conn, job['artifact'])
+        conn.commit()
+        conn.close()
+        return Response(body, mimetype='text/csv', headers={
+            'Content-Disposition': f"attachment; filename=job-{job['id']}-invite-links.csv"
+        })
+    path = fetch_artifact(conn, job['artifact'])
+    conn.close()
+    return send_file(path, as_attachment=True)
+
+
+# Job handlers (run by worker.py)
+@job_handler('export_calendar')
+def run_export_job(job, progress):
+    """Write a calendar export to the artifact store"""
+    params = job['params']
+    start_date = datetime.strptime(params['start_date'], '%Y-%m-%d').date()
+    end_date = datetime.strptime(params['end_date'], '%Y-%m-%d').date()
+    export_format = params.get('format', 'csv')
+    filename = (f"job-{job['id']}-office-locations-{start_date}-to-{end_date}"
+                f"{EXPORT_FORMATS[export_format][1]}")
+    
+    conn = get_db()
+    try:
+        repos = Repositories(conn.cursor())
+        total = repos.responses.count_between(job['team_id'], start_date, end_date) or 1
         
-        from flask import make_response
-        response = make_response(output)
-        response.headers['Content-Type'] = 'text/csv'
-        response.headers['Content-Disposition'] = f'attachment; filename=office-locations-{start_date}-to-{end_date}.csv'
-        return response
-    
-    else:  # HTML format
-        # Group by date for better visualization
-        data_by_date = {}
-        for row in data:
-            # Ensure row_date is a date object for template compatibility
-            row_date = datetime.strptime(row['date'], '%Y-%m-%d').date() if isinstance(row['date'], str) else row['date']
-            if row_date not in data_by_date:
-                data_by_date[row_date] = []
-            data_by_date[row_date].append(row)
+        # Server-side cursor streams rows instead of loading the range into memory
+        rows = repos.responses.export(job['team_id'], start_date, end_date, stream=f"export_job_{job['id']}")
         
-        return render_template('export_calendar.html', 
-                             data_by_date=data_by_date, 
-                             start_date=start_date, 
-                             end_date=end_date)
+        write_export_file(rows, artifact_path(filename), export_format,
+                          on_row=lambda n: progress(n * 100 / total))
+        rows.close()
+        publish_artifact(conn, filename, keep_local=False)
+        conn.commit()
+    finally:
+        conn.close()
+    
+    return filename
+
+
+@job_handler('evening_reminders')
+def run_reminders_job(job, progress):
+    """Send evening reminders as a background batch"""
+    send_evening_reminders(team_id=job['team_id'], force=True)
+
+
+@job_handler('morning_digest')
+def run_digest_job(job, progress):
+    """Send the morning digest (all teams when scheduled, one team from the admin panel)"""
+    day = datetime.strptime(job['params']['date'], '%Y-%m-%d').date()
+    return {'result': send_morning_digest(day, team_id=job['team_id'], progress=progress)}
+
+
+@job_handler('bulk_import_users')
+def run_user_import_job(job, progress):
+    """Provision users from an uploaded CSV; the artifact is the invite list"""
+    upload = job['params']['upload']
+    invites = f"job-{job['id']}-invites.csv"
+    
+    conn = get_db()
+    try:
+        stats = import_users(conn, fetch_artifact(conn, upload), job['team_id'], artifact_path(invites),
+                             invite_days=INVITE_DAYS, progress=progress)
+        if stats['invites']:
+            publish_artifact(conn, invites, keep_local=False)
+        conn.commit()
+    finally:
+        # The upload may contain passwords: don't keep it around
+        conn.rollback()
+        discard_artifact(conn, upload)
+        conn.commit()
+        conn.close()
+    
+    print(f"👥 Imported {stats['rows']} users ({stats['created']} new) "
+          f"at {stats['rows_per_second']} rows/s")
+    return {'artifact': invites if stats['invites'] else None, 'result': stats}
 
 
 # API endpoints
@@ -739,9 +1340,7 @@ def export_calendar():
 def api_locations():
     """Get all active locations"""
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM locations WHERE is_active = TRUE')
-    locations = [dict(row) for row in cursor.fetchall()]
+    locations = [dict(row) for row in Repositories(conn.cursor()).locations.active_details()]
     conn.close()
     return jsonify(locations)
 
@@ -751,22 +1350,242 @@ def api_locations():
 def api_summary(date_str):
     """Get summary for a specific date"""
     conn = get_db()
-    cursor = conn.cursor()
+    summary = [dict(row) for row in
+               Repositories(conn.cursor()).responses.day_location_names(session['team_id'], date_str)]
+    conn.close()
     
-    cursor.execute('''
-        SELECT l.name, l.emoji, l.color, COUNT(*) as count,
-               STRING_AGG(u.name, ', ') as users
-        FROM responses r
-        JOIN users u ON r.user_id = u.id
-        JOIN locations l ON r.location_id = l.id
-        WHERE r.date = %s AND u.is_active = TRUE
-        GROUP BY l.id
-    ''', (date_str,))
+    return jsonify(summary)
+
+
+def parse_feed_cursor(value):
+    """'<change_txid>-<change_seq>' -> (txid, seq); '0' or nothing is the start of the feed"""
+    if not value or value == '0':
+        return 0, 0
+    txid, _, seq = value.partition('-')
+    return int(txid), int(seq)
+
+
+def feed_cursor(row):
+    return f"{row['change_txid']}-{row['change_seq']}"
+
+
+@app.route('/api/changes')
+@feed_access_required
+def api_changes():
+    """Responses created or changed after a cursor, oldest first"""
+    cursor_value = request.args.get('cursor', '0')
+    try:
+        after_txid, after_seq = parse_feed_cursor(cursor_value)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    limit = min(max(request.args.get('limit', 500, type=int), 1), CHANGE_FEED_MAX_LIMIT)
+    team_id = g.get('api_team_id') or session['team_id']
     
-    summary = [dict(row) for row in cursor.fetchall()]
+    conn = get_db()
+    # Fetch one extra row to know whether another page follows
+    rows = Repositories(conn.cursor()).responses.changes(team_id, after_txid, after_seq, limit + 1)
     conn.close()
     
-    return jsonify(summary)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    return jsonify({
+        'changes': [{
+            'cursor': feed_cursor(row),
+            'date': row['date'].isoformat(),
+            'updated_at': row['timestamp'].isoformat() if row['timestamp'] else None,
+            'user_id': row['user_id'],
+            'user_email': row['user_email'],
+            'location_id': row['location_id'],
+            'location_name': row['location_name']
+        } for row in rows],
+        'next_cursor': feed_cursor(rows[-1]) if rows else cursor_value,
+        'has_more': has_more
+    })
+
+
+def teammate_desk_ids(repos, location_id, day):
+    """Desks booked by my teammates at a location on a day"""
+    return repos.responses.teammate_desks(session['team_id'], day, location_id, session['user_id'])
+
+
+@app.route('/api/desks')
+@login_required
+def api_desks():
+    """Desks at a location with their availability for a date"""
+    location_id = request.args.get('location_id', type=int)
+    try:
+        day = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'date (YYYY-MM-DD) is required'}), 400
+    
+    conn = get_db()
+    repos = Repositories(conn.cursor())
+    desk_map.refresh(repos)
+    suggestion = desk_map.find_free_desk(location_id, day, teammate_desk_ids(repos, location_id, day))
+    conn.close()
+    
+    total, free = desk_map.availability(location_id, day)
+    return jsonify({
+        'location_id': location_id,
+        'date': day.isoformat(),
+        'total': total,
+        'free': free,
+        'suggested_desk': suggestion,
+        'desks': desk_map.desks(location_id, day) if request.args.get('include_desks') else None
+    })
+
+
+def parse_date_window(default_days=30):
+    """Read a start/end (or YYYY-MM month) window from the query string"""
+    month = request.args.get('month')
+    if month:
+        start = datetime.strptime(month, '%Y-%m').date()
+        next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return start, next_month - timedelta(days=1)
+    start = request.args.get('start')
+    end = request.args.get('end')
+    start = datetime.strptime(start, '%Y-%m-%d').date() if start else date.today()
+    end = datetime.strptime(end, '%Y-%m-%d').date() if end else start + timedelta(days=default_days)
+    if end < start or (end - start).days >= MAX_DATE_WINDOW_DAYS:
+        raise ValueError(f'the window must run forwards and span at most {MAX_DATE_WINDOW_DAYS} days')
+    return start, end
+
+
+def office_location_ids(repos):
+    """Ids of locations that count as being in an office together"""
+    return set(repos.locations.office_capacities(NON_OFFICE_LOCATIONS))
+
+
+def recommend_for_group(repos, team_id, user_ids, start, end, top=5):
+    """Best (day, office) options for a group of teammates"""
+    capacities = repos.locations.office_capacities(NON_OFFICE_LOCATIONS)
+    location_ids = sorted(capacities)
+    days = candidate_days(start, end, skip_weekends=config['schedule'].get('skip_weekends', True))
+    if not days or not location_ids:
+        return []
+    
+    # Weekday habits, aggregated in SQL so only users x weekdays x locations rows come back
+    history = repos.responses.weekday_history(
+        team_id, user_ids, date.today() - timedelta(days=RECOMMENDER_HISTORY_DAYS), date.today())
+    plans = repos.responses.group_plans(team_id, user_ids, start, end)
+    
+    # Offices are shared between teams, so seats taken by anyone else count
+    booked = repos.responses.outside_bookings(start, end, location_ids, user_ids)
+    
+    results = recommend_days(history, plans, booked, capacities, user_ids, location_ids, days, top=top)
+    
+    locations = repos.locations.by_ids(location_ids)
+    for result in results:
+        location = locations[result['location_id']]
+        result.update(location_name=location['name'], emoji=location['emoji'], color=location['color'])
+    return results
+
+
+@app.route('/api/recommendations')
+@login_required
+def api_recommendations():
+    """Best days and offices for a group (default: my whole team) to meet up"""
+    try:
+        user_ids = {int(u) for u in request.args.get('users', '').split(',') if u.strip()}
+        start, end = parse_date_window(default_days=13)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid users or date parameters: {e}'}), 400
+    top = min(max(request.args.get('top', 5, type=int), 1), 50)
+    
+    conn = get_db()
+    repos = Repositories(conn.cursor())
+    if user_ids:
+        user_ids.add(session['user_id'])
+        members = repos.users.active_members(session['team_id'], user_ids)
+        if len(members) != len(user_ids):
+            conn.close()
+            return jsonify({'error': 'Users must be active members of your team'}), 400
+    else:
+        members = repos.users.active_ids(session['team_id'])
+    
+    results = recommend_for_group(repos, session['team_id'], members, start, end, top=top)
+    conn.close()
+    
+    for result in results:
+        result['date'] = result['date'].isoformat()
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'group_size': len(members),
+        'recommendations': results
+    })
+
+
+@app.route('/api/attendance/common-days')
+@login_required
+def api_common_days():
+    """Days when I and the given teammates are all at one location"""
+    location_id = request.args.get('location_id', type=int)
+    try:
+        user_ids = {int(u) for u in request.args.get('users', '').split(',') if u.strip()}
+        start, end = parse_date_window()
+    except ValueError as e:
+        return jsonify({'error': f'Invalid users or date parameters: {e}'}), 400
+    if not location_id:
+        return jsonify({'error': 'location_id is required'}), 400
+    if not attendance.covers(start):
+        return jsonify({'error': f'Attendance history only goes back {HISTORY_DAYS} days'}), 400
+    user_ids.add(session['user_id'])
+    
+    conn = get_db()
+    repos = Repositories(conn.cursor())
+    members = repos.users.members(session['team_id'], user_ids)
+    attendance.refresh(repos, session['team_id'])
+    conn.close()
+    
+    if len(members) != len(user_ids):
+        return jsonify({'error': 'Users must belong to your team'}), 400
+    
+    days = attendance.common_days(session['team_id'], user_ids, location_id, start, end)
+    return jsonify({
+        'location_id': location_id,
+        'users': [{'id': m['id'], 'name': m['name']} for m in members],
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'days': [d.isoformat() for d in days],
+        'count': len(days)
+    })
+
+
+@app.route('/api/attendance/overlaps')
+@login_required
+def api_overlaps():
+    """Teammates who will be in the same office as me, most shared days first"""
+    try:
+        start, end = parse_date_window()
+    except ValueError as e:
+        return jsonify({'error': f'Invalid date parameters: {e}'}), 400
+    if not attendance.covers(start):
+        return jsonify({'error': f'Attendance history only goes back {HISTORY_DAYS} days'}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 200)
+    
+    conn = get_db()
+    repos = Repositories(conn.cursor())
+    offices = office_location_ids(repos)
+    attendance.refresh(repos, session['team_id'])
+    overlaps = attendance.overlaps(session['team_id'], session['user_id'], start, end,
+                                   location_ids=offices, limit=limit)
+    names = {}
+    if overlaps:
+        names = repos.users.active_names([user_id for user_id, _, _ in overlaps])
+    conn.close()
+    
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'teammates': [{
+            'user_id': user_id,
+            'name': names[user_id],
+            'days_together': count,
+            'days': [d.isoformat() for d in days]
+        } for user_id, count, days in overlaps if user_id in names]
+    })
 
 
 @app.route('/health')
@@ -782,6 +1601,7 @@ def health():
         return jsonify({
             'status': 'healthy',
             'database': 'connected',
+            'backend': store.dialect,
             'timestamp': datetime.now(timezone).isoformat()
         }), 200
     except Exception as e:
@@ -793,40 +1613,106 @@ def health():
 
 
 # Scheduled tasks
-def send_evening_reminders():
+def send_evening_reminders(team_id=None, force=False):
     """Send evening reminders (placeholder for email integration)"""
-    if not should_run_today():
+    if not force and not should_run_today():
         return
     
     conn = get_db()
-    cursor = conn.cursor()
+    repos = Repositories(conn.cursor())
     
     tomorrow = date.today() + timedelta(days=1)
     
-    # Get users who haven't set location for tomorrow
-    cursor.execute('''
-        SELECT u.id, u.email, u.name
-        FROM users u
-        WHERE u.is_active = TRUE
-        AND u.id NOT IN (
-            SELECT user_id FROM responses WHERE date = %s
-        )
-    ''', (tomorrow,))
+    team_ids = [team_id] if team_id else repos.teams.ids()
     
-    users_to_remind = cursor.fetchall()
+    reminded = 0
+    for team_id in team_ids:
+        # Get team members who haven't set location for tomorrow
+        users_to_remind = repos.users.without_response(team_id, tomorrow)
+        
+        for user in users_to_remind:
+            # Log reminder (in production, send actual email)
+            repos.notifications.log(user['id'], 'evening_reminder')
+            print(f"📧 Would send reminder to {user['name']} ({user['email']})")
+        
+        # Commit per team so one large team doesn't hold a long transaction
+        conn.commit()
+        reminded += len(users_to_remind)
     
-    for user in users_to_remind:
-        # Log reminder (in production, send actual email)
-        cursor.execute('''
-            INSERT INTO notifications (user_id, type)
-            VALUES (%s, 'evening_reminder')
-        ''', (user['id'],))
-        print(f"📧 Would send reminder to {user['name']} ({user['email']})")
+    conn.close()
     
+    print(f"✅ Evening reminders processed: {reminded} users across {len(team_ids)} teams")
+
+
+def send_morning_digest(day, team_id=None, progress=None):
+    """
+    Email each team's office summary for `day` to its subscribed admins and leads.
+    The counts and roster are computed once for all teams, each team's body is
+    rendered once, and delivery shares a few pooled SMTP sessions.
+    """
+    started = time.perf_counter()
+    conn = get_db()
+    repos = Repositories(conn.cursor())
+    
+    audiences = {}
+    for user in repos.users.digest_recipients(team_id):
+        audiences.setdefault(user['team_id'], {'name': user['team_name'], 'recipients': []})
+        audiences[user['team_id']]['recipients'].append(user)
+    team_ids = list(audiences)
+    
+    # One pass over the day's responses for every team with a recipient
+    summaries, rosters, responded = {}, {}, Counter()
+    for row in repos.responses.rosters(team_ids, day):
+        counts = summaries.setdefault(row['team_id'], {})
+        location = counts.setdefault(row['name'], {'name': row['name'], 'emoji': row['emoji'],
+                                                   'color': row['color'], 'count': 0})
+        location['count'] += 1
+        rosters.setdefault(row['team_id'], {}).setdefault(row['name'], []).append(row['user_name'])
+        responded[row['team_id']] += 1
+    
+    members = repos.users.active_counts(team_ids)
+    
+    notifier = EmailNotifier()
+    delivered_ids = []
+    with notifier.smtp_pool() as smtp:
+        for n, (audience_team_id, audience) in enumerate(audiences.items(), start=1):
+            summary = sorted(summaries.get(audience_team_id, {}).values(), key=lambda l: -l['count'])
+            subject, body = notifier.render_morning_summary(
+                summary, rosters.get(audience_team_id), audience['name'],
+                not_set=members.get(audience_team_id, 0) - responded[audience_team_id])
+            ids_by_email = {user['email']: user['id'] for user in audience['recipients']}
+            delivered = smtp.send([(user['email'], user['name']) for user in audience['recipients']],
+                                  subject, body)
+            delivered_ids.extend(ids_by_email[email] for email in delivered)
+            if progress:
+                progress(n * 100 / len(audiences))
+    
+    recipients = sum(len(audience['recipients']) for audience in audiences.values())
+    duration_ms = (time.perf_counter() - started) * 1000
+    repos.notifications.log_many(delivered_ids, 'morning_digest')
+    repos.notifications.log_run('morning_digest_run', duration_ms, len(delivered_ids))
     conn.commit()
     conn.close()
     
-    print(f"✅ Evening reminders processed: {len(users_to_remind)} users")
+    print(f"✅ Morning digest: {len(delivered_ids)}/{recipients} recipients across "
+          f"{len(audiences)} teams in {duration_ms:.0f} ms")
+    return {'teams': len(audiences), 'recipients': recipients, 'delivered': len(delivered_ids),
+            'duration_ms': round(duration_ms, 1)}
+
+
+def queue_morning_digest():
+    """Scheduled: queue today's digest once, however many web processes fire the trigger"""
+    if not should_run_today():
+        return
+    
+    today = date.today().isoformat()
+    conn = get_db()
+    repos = Repositories(conn.cursor())
+    repos.jobs.lock('morning_digest')
+    if not repos.jobs.scheduled_exists('morning_digest', today):
+        enqueue_job(conn, 'morning_digest', {'date': today})
+    conn.commit()
+    conn.close()
 
 
 def should_run_today():
@@ -853,6 +1739,17 @@ def setup_scheduler():
     )
     
     print(f"✅ Scheduled evening reminders at {config['schedule']['evening_reminder']} {timezone}")
+    
+    digest_time = config['schedule'].get('morning_digest')
+    if digest_time:
+        hour, minute = digest_time.split(':')
+        scheduler.add_job(
+            queue_morning_digest,
+            trigger=CronTrigger(hour=int(hour), minute=int(minute), timezone=timezone),
+            id='morning_digest',
+            replace_existing=True
+        )
+        print(f"✅ Scheduled morning digest at {digest_time} {timezone}")
 
 
 # Initialize database and scheduler (for production/gunicorn)
@@ -860,8 +1757,9 @@ try:
     init_db()
     cleanup_duplicate_locations()  # Clean up any duplicates
     seed_initial_data()
-    setup_scheduler()
-    scheduler.start()
+    if not os.environ.get('DISABLE_SCHEDULER'):
+        setup_scheduler()
+        scheduler.start()
     print("✅ App initialized (database + scheduler)")
 except Exception as e:
     print(f"⚠️  Initialization warning: {e}")
@@ -0,0 +1,137 @@
+"""
+In-memory attendance index
+For every (user, location) pair we keep one Python int used as a bitset over
+days (bit n = base + n days). "Who is in together" questions become bitwise
+AND + popcount instead of SQL joins. Only HISTORY_DAYS back from today are
+indexed, which keeps 10k users x 2 years at a few MB.
+
+Each process keeps its own copy and catches up from the responses change feed
+(paged on (change_txid, change_seq) like /api/changes, so nothing committed out
+of sequence order is skipped), so updates made through other gunicorn workers
+are picked up on the next query without any cross-process messaging.
+"""
+
+import threading
+import time
+from datetime import date, timedelta
+
+# Days of history kept in the index (future plans are always kept)
+HISTORY_DAYS = 730
+
+# Rebuild a team from scratch this often, so the index slides forward with today
+FULL_RELOAD_SECONDS = 600
+
+
+class TeamAttendance:
+    """Bitsets for one team: user_id -> {location_id: bitset}"""
+
+    def __init__(self):
+        self.bits = {}
+        self.feed_cursor = (0, 0)   # (change_txid, change_seq) applied so far
+        self.loaded_at = time.monotonic()
+        self.base = date.today() - timedelta(days=HISTORY_DAYS)
+
+    def window_mask(self, start, end):
+        """Bitmask covering start..end inclusive"""
+        lo = max((start - self.base).days, 0)
+        hi = (end - self.base).days
+        if hi < lo:
+            return 0
+        return ((1 << (hi - lo + 1)) - 1) << lo
+
+    def mask_days(self, bits):
+        """Dates whose bits are set, oldest first"""
+        days = []
+        while bits:
+            low = bits & -bits
+            days.append(self.base + timedelta(days=low.bit_length() - 1))
+            bits ^= low
+        return days
+
+    def apply(self, user_id, location_id, day):
+        if day < self.base:
+            return
+        bit = 1 << (day - self.base).days
+        user_bits = self.bits.setdefault(user_id, {})
+        # A user is in exactly one place per day: clear the day everywhere first
+        for loc_id, loc_bits in user_bits.items():
+            if loc_bits & bit:
+                user_bits[loc_id] = loc_bits & ~bit
+        user_bits[location_id] = user_bits.get(location_id, 0) | bit
+
+
+class AttendanceIndex:
+    def __init__(self):
+        self._teams = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def covers(start):
+        """Whether a window starting on `start` lies inside the indexed history"""
+        return start >= date.today() - timedelta(days=HISTORY_DAYS)
+
+    def refresh(self, repos, team_id):
+        """Load a team on first use, then apply changes since the last refresh"""
+        with self._lock:
+            team = self._teams.get(team_id)
+        if team is None or time.monotonic() - team.loaded_at > FULL_RELOAD_SECONDS:
+            # Built without the lock and swapped in: meanwhile other requests
+            # keep answering from the old copy instead of queueing behind the load
+            team = TeamAttendance()
+            team.feed_cursor = repos.responses.feed_position()
+            for row in repos.responses.team_days(team_id, team.base):
+                team.apply(row['user_id'], row['location_id'], row['date'])
+            with self._lock:
+                self._teams[team_id] = team
+
+        rows = repos.responses.changed_since(*team.feed_cursor, team.base, team_id=team_id)
+        with self._lock:
+            for row in rows:
+                # Another request may have applied this page already
+                feed_cursor = (row['change_txid'], row['change_seq'])
+                if feed_cursor > team.feed_cursor:
+                    team.apply(row['user_id'], row['location_id'], row['date'])
+                    team.feed_cursor = feed_cursor
+
+    def record(self, team_id, user_id, location_id, day):
+        """Apply a change made by this process without waiting for the next refresh"""
+        with self._lock:
+            team = self._teams.get(team_id)
+            if team is None:
+                return
+            # The feed cursor stays put: the change is read again, harmlessly, later
+            team.apply(user_id, location_id, day)
+
+    def common_days(self, team_id, user_ids, location_id, start, end):
+        """Days in start..end when every user is at location_id"""
+        with self._lock:
+            team = self._teams.get(team_id) or TeamAttendance()
+            bits = team.window_mask(start, end)
+            for user_id in user_ids:
+                bits &= team.bits.get(user_id, {}).get(location_id, 0)
+                if not bits:
+                    break
+            return team.mask_days(bits)
+
+    def overlaps(self, team_id, user_id, start, end, location_ids=None, limit=20):
+        """Teammates who share a location day with user_id: [(user_id, count, days)], most first"""
+        with self._lock:
+            team = self._teams.get(team_id) or TeamAttendance()
+            mask = team.window_mask(start, end)
+            results = []
+            mine = {}
+            for loc_id, bits in team.bits.get(user_id, {}).items():
+                if (location_ids is None or loc_id in location_ids) and bits & mask:
+                    mine[loc_id] = bits & mask
+
+            for other_id, other_bits in team.bits.items():
+                if other_id == user_id or not mine:
+                    continue
+                shared = 0
+                for loc_id, bits in mine.items():
+                    shared |= bits & other_bits.get(loc_id, 0)
+                if shared:
+                    results.append((other_id, shared.bit_count(), shared))
+            results.sort(key=lambda r: (-r[1], r[0]))
+            return [(other_id, count, team.mask_days(shared))
+                    for other_id, count, shared in results[:limit]]
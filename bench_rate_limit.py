@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Rate limiter benchmark
+Measures what the limiter adds to a request: the latency of one bucket
+check, POST /set-location with the limiter on and off, and check throughput
+when many threads hammer the same bucket (one client flooding a route from
+every worker).
+
+    RATE_LIMIT_BENCH_DATABASE_URL=postgresql://localhost/office_bench python bench_rate_limit.py [requests]
+
+Never point it at a real database: it rewrites the first admin's plan for
+tomorrow about a thousand times, queueing a webhook event each time.
+"""
+
+import os
+import statistics
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+DATABASE_URL = os.environ.get('RATE_LIMIT_BENCH_DATABASE_URL')
+if not DATABASE_URL:
+    sys.exit('Set RATE_LIMIT_BENCH_DATABASE_URL to a scratch database')
+os.environ['DATABASE_URL'] = DATABASE_URL
+os.environ['DISABLE_SCHEDULER'] = '1'
+
+import app  # noqa: E402
+
+# High enough that nothing is rejected while measuring
+UNLIMITED = (1e9, 1e9)
+
+
+def timed(f, n):
+    """Per-call milliseconds"""
+    samples = []
+    for _ in range(n):
+        started = time.perf_counter()
+        f()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return (f"mean {statistics.mean(samples):.3f} ms, p50 {samples[len(samples) // 2]:.3f} ms, "
+            f"p99 {samples[int(len(samples) * 0.99)]:.3f} ms")
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    limiter = app.rate_limiter
+    for rules in limiter.routes.values():
+        for scope in rules:
+            rules[scope] = UNLIMITED
+
+    # One bucket check on its own
+    buckets = [('bench:ip:127.0.0.1', *UNLIMITED), ('bench:user:1', *UNLIMITED)]
+    timed(lambda: limiter.hit(buckets), 50)
+    print(f"🪣 Bucket check (2 buckets, 1 round trip): {summary(timed(lambda: limiter.hit(buckets), requests))}")
+
+    # A full write request with and without the limiter
+    conn = app.get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT email FROM users WHERE is_admin = TRUE AND is_active = TRUE ORDER BY id LIMIT 1')
+    email = cursor.fetchone()['email']
+    cursor.execute('SELECT id FROM locations WHERE is_active = TRUE ORDER BY id LIMIT 1')
+    location_id = cursor.fetchone()['id']
+    conn.close()
+
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        conn = app.get_db()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, name, is_admin, team_id FROM users WHERE email = %s', (email,))
+        user = cursor.fetchone()
+        conn.close()
+        sess.update(user_id=user['id'], user_name=user['name'], is_admin=user['is_admin'], team_id=user['team_id'])
+    form = {'location_id': location_id, 'date': (date.today() + timedelta(days=1)).isoformat()}
+
+    def set_location():
+        client.post('/set-location', data=form).close()
+
+    def clear_flashes():
+        # Redirects aren't followed, so unread flash messages would pile up in the cookie
+        with client.session_transaction() as sess:
+            sess.pop('_flashes', None)
+
+    # Alternate on/off request by request so table growth and caching affect both equally
+    for _ in range(20):
+        clear_flashes()
+        set_location()
+    results = {False: [], True: []}
+    for i in range(2 * requests):
+        clear_flashes()
+        limiter.enabled = bool(i % 2)
+        results[limiter.enabled].extend(timed(set_location, 1))
+    limiter.enabled = True
+    off, on = statistics.mean(results[False]), statistics.mean(results[True])
+    print(f"📝 POST /set-location: {off:.3f} ms without limiter, {on:.3f} ms with "
+          f"(+{on - off:.3f} ms, {100 * (on - off) / off:.1f}%)")
+
+    # Contention: every thread takes tokens from the same bucket
+    hot = [('bench:ip:flood', *UNLIMITED)]
+    threads, per_thread = 8, max(requests // 8, 50)
+
+    def flood():
+        for _ in range(per_thread):
+            limiter.hit(hot)
+
+    workers = [threading.Thread(target=flood) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    print(f"🔥 {threads} threads on one bucket: {threads * per_thread / elapsed:.0f} checks/s")
+
+
+if __name__ == '__main__':
+    main()
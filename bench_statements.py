@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Prepared statement benchmark
+Replays the dashboard's query set against DATABASE_URL and compares a fresh
+connection with plain SQL per request (the old behaviour), pooled connections
+with plain SQL, and pooled connections with prepared statements. Also reports
+how much Postgres planning time the prepared path saves per request. With a
+sqlite:/// DATABASE_URL it times the same query set on the embedded backend.
+
+    python bench_statements.py [requests]
+"""
+
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+os.environ.setdefault('DISABLE_SCHEDULER', '1')
+
+import psycopg2  # noqa: E402
+import psycopg2.extras  # noqa: E402
+
+import app  # noqa: E402
+import repositories as repo  # noqa: E402
+from db import ConnectionPool, run  # noqa: E402
+from repositories import Repositories  # noqa: E402
+
+
+def dashboard_queries(cursor, user_id, team_id, user_ids):
+    """(statement, params) pairs a dashboard request runs, in order"""
+    today = date.today()
+    tomorrow = today + timedelta(days=1)
+    end = tomorrow + timedelta(days=13)
+    location_ids = sorted(app.office_location_ids(Repositories(cursor))) or [0]
+    return [
+        (repo.USER_DAY_LOCATION, (user_id, today)),
+        (repo.USER_DAY_LOCATION, (user_id, tomorrow)),
+        (repo.ACTIVE_LOCATIONS, ()),
+        (repo.TEAM_DAY_SUMMARY, (team_id, today)),
+        (repo.TEAM_DAY_MEMBERS, (team_id, today)),
+        (repo.TEAM_MEMBER_IDS, (team_id,)),
+        (repo.OFFICE_CAPACITIES, (app.NON_OFFICE_LOCATIONS,)),
+        (repo.WEEKDAY_HISTORY, (team_id, user_ids, today - timedelta(days=app.RECOMMENDER_HISTORY_DAYS), today)),
+        (repo.GROUP_PLANS, (team_id, user_ids, tomorrow, end)),
+        (repo.OUTSIDE_BOOKINGS, (tomorrow, end, location_ids, user_ids)),
+        (repo.LOCATIONS_BY_ID, (location_ids,)),
+    ]
+
+
+def replay(get_conn, queries, requests):
+    """Mean milliseconds per request"""
+    started = time.perf_counter()
+    for _ in range(requests):
+        conn = get_conn()
+        cursor = conn.cursor()
+        for stmt, params in queries:
+            run(cursor, stmt, params).fetchall()
+        conn.close()
+    return (time.perf_counter() - started) * 1000 / requests
+
+
+def planning_ms(cursor, sql, params=()):
+    cursor.execute(f'EXPLAIN (SUMMARY, FORMAT JSON) {sql}', params)
+    return cursor.fetchone()[0][0]['Planning Time']
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    conn = app.get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, team_id FROM users WHERE is_active = TRUE ORDER BY id LIMIT 1')
+    user = cursor.fetchone()
+    user_ids = Repositories(cursor).users.active_ids(user['team_id'])
+    queries = dashboard_queries(cursor, user['id'], user['team_id'], user_ids)
+    conn.close()
+
+    if app.store.dialect == 'sqlite':
+        # Embedded: no connect cost or planning round trip to compare, just the query set
+        replay(app.get_db, queries, 10)
+        print(f"📊 Dashboard query set: {len(queries)} statements, {requests} requests")
+        print(f"   {'embedded SQLite':<22} {replay(app.get_db, queries, requests):7.3f} ms/request")
+        return
+
+    def fresh_connection():
+        conn = psycopg2.connect(app.DATABASE_URL)
+        conn.cursor_factory = psycopg2.extras.DictCursor
+        return conn
+
+    plain_pool = ConnectionPool(app.DATABASE_URL, prepare=False)
+    prepared_pool = ConnectionPool(app.DATABASE_URL, prepare=True)
+
+    # Warm up (connections, caches, and past the first custom plans)
+    for get_conn in (plain_pool.get, prepared_pool.get):
+        replay(get_conn, queries, 10)
+
+    print(f"📊 Dashboard query set: {len(queries)} statements, {requests} requests")
+    results = [
+        ('connect + plain SQL', replay(fresh_connection, queries, requests)),
+        ('pooled + plain SQL', replay(plain_pool.get, queries, requests)),
+        ('pooled + prepared', replay(prepared_pool.get, queries, requests)),
+    ]
+    for label, ms in results:
+        print(f"   {label:<22} {ms:7.3f} ms/request")
+
+    # Planning time Postgres reports for the same statements, both ways
+    conn = prepared_pool.get()
+    cursor = conn.cursor()
+    plain = prepared = 0.0
+    for stmt, params in queries:
+        run(cursor, stmt, params)
+        plain += planning_ms(cursor, stmt.sql, params)
+        prepared += planning_ms(cursor, stmt.execute_sql, params)
+    conn.close()
+    print(f"🧠 Planning per request: {plain:.3f} ms plain, {prepared:.3f} ms prepared "
+          f"({plain - prepared:.3f} ms saved)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""
+Bulk user provisioning from CSV
+Rows are validated as they stream in, password hashes are computed across all
+cores, rows are COPY'd into a staging table and merged into users with a
+single INSERT ... ON CONFLICT (email).
+SQLite has no COPY: there the staging table is filled with executemany, which
+reuses one prepared insert for every row.
+
+Everyone lands in the importing admin's team as a regular user. Users without
+a password get the unusable hash UNUSABLE_PASSWORD (nothing to compute) plus a
+single-use invite link (see invites.py) to choose their own.
+"""
+
+import csv
+import io
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+from invites import new_invite
+from repositories import Repositories, normalize_email
+
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+# Report at most this many bad rows back to the admin
+MAX_ERRORS = 100
+
+# Stored instead of a hash until the user accepts their invite: check_password_hash
+# rejects anything without a method$salt$hash layout, so no password matches it
+UNUSABLE_PASSWORD = '!'
+
+
+def _hash(password):
+    return generate_password_hash(password)
+
+
+def validate_rows(lines):
+    """
+    Stream (rows, errors) out of CSV text lines with columns
+    email, name and optionally password; other columns are ignored.
+    Yields ('row', dict) or ('error', message).
+    """
+    reader = csv.DictReader(lines)
+    fields = {f.strip().lower() for f in reader.fieldnames or []}
+    if not {'email', 'name'} <= fields:
+        yield 'error', 'CSV must have at least "email" and "name" columns'
+        return
+
+    seen = set()
+    for row in reader:
+        row = {(k or '').strip().lower(): (v or '').strip() for k, v in row.items()}
+        line = reader.line_num
+        email = normalize_email(row.get('email'))
+        if not EMAIL_RE.match(email):
+            yield 'error', f'Line {line}: invalid email "{email}"'
+            continue
+        if not row.get('name'):
+            yield 'error', f'Line {line}: name is required'
+            continue
+        if email in seen:
+            yield 'error', f'Line {line}: duplicate email "{email}"'
+            continue
+        password = row.get('password', '')
+        if password and len(password) < 6:
+            yield 'error', f'Line {line}: password must be at least 6 characters'
+            continue
+        seen.add(email)
+        yield 'row', {
+            'email': email,
+            'name': row['name'],
+            'password': password,
+        }
+
+
+def _merge_postgres(cursor, staged):
+    """COPY into a staging table and merge; returns (merged rows, emails inserted)"""
+    cursor.execute('''
+        CREATE TEMP TABLE import_users (
+            email VARCHAR(255),
+            name VARCHAR(255),
+            password_hash VARCHAR(255),
+            team_id INTEGER,
+            invite_token_hash VARCHAR(64),
+            invite_expires_at TIMESTAMP
+        ) ON COMMIT DROP
+    ''')
+    buf = io.StringIO()
+    csv.writer(buf).writerows(staged)
+    buf.seek(0)
+    cursor.copy_expert('COPY import_users (email, name, password_hash, team_id, invite_token_hash, invite_expires_at) '
+                       'FROM STDIN WITH (FORMAT csv)', buf)
+
+    # Existing users keep their password and team; only their name is refreshed,
+    # and users who belong to a different team are left alone
+    cursor.execute('''
+        INSERT INTO users (email, name, password_hash, team_id, invite_token_hash, invite_expires_at)
+        SELECT email, name, password_hash, team_id, invite_token_hash, invite_expires_at FROM import_users
+        ON CONFLICT (email) DO UPDATE
+        SET name = EXCLUDED.name
+        WHERE users.team_id = EXCLUDED.team_id
+        RETURNING email, (xmax = 0) as inserted
+    ''')
+    merged = cursor.fetchall()
+    return merged, {row['email'] for row in merged if row['inserted']}
+
+
+def _merge_sqlite(cursor, staged):
+    """The same merge on SQLite, which has neither COPY nor xmax"""
+    cursor.execute('''
+        CREATE TEMP TABLE import_users (
+            email TEXT,
+            name TEXT,
+            password_hash TEXT,
+            team_id INTEGER,
+            invite_token_hash TEXT,
+            invite_expires_at TIMESTAMP
+        )
+    ''')
+    cursor.executemany('INSERT INTO import_users VALUES (%s, %s, %s, %s, %s, %s)', staged)
+    cursor.execute('SELECT email FROM users WHERE email IN (SELECT email FROM import_users)')
+    existing = {row['email'] for row in cursor.fetchall()}
+
+    # WHERE TRUE keeps the parser from reading ON CONFLICT as a join constraint
+    cursor.execute('''
+        INSERT INTO users (email, name, password_hash, team_id, invite_token_hash, invite_expires_at)
+        SELECT email, name, password_hash, team_id, invite_token_hash, invite_expires_at FROM import_users WHERE TRUE
+        ON CONFLICT (email) DO UPDATE
+        SET name = EXCLUDED.name
+        WHERE users.team_id = EXCLUDED.team_id
+        RETURNING email
+    ''')
+    merged = cursor.fetchall()
+    cursor.execute('DROP TABLE import_users')
+    return merged, {row['email'] for row in merged} - existing
+
+
+def import_users(conn, csv_path, team_id, invites_path, invite_days=7, progress=None, workers=None):
+    """Run a bulk import into team_id; returns a stats dict including rows/second"""
+    started = time.perf_counter()
+    rows, errors = [], []
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        for kind, value in validate_rows(f):
+            if kind == 'row':
+                rows.append(value)
+            elif len(errors) < MAX_ERRORS:
+                errors.append(value)
+
+    # Users without a password get an invite instead
+    for row in rows:
+        if not row['password']:
+            row['invite'], row['invite_hash'], row['invite_expires'] = new_invite(invite_days)
+
+    if progress:
+        progress(5)
+
+    # Hashing dominates the cost: spread it over every core, for the passwords
+    # the CSV actually gives
+    with_password = [row for row in rows if row['password']]
+    workers = workers or os.cpu_count() or 1
+    if with_password:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            hashed = pool.map(_hash, [row['password'] for row in with_password], chunksize=64)
+            for i, (row, pwhash) in enumerate(zip(with_password, hashed), start=1):
+                row['password_hash'] = pwhash
+                if progress and i % 500 == 0:
+                    progress(5 + 80 * i / len(with_password))
+    hashed_at = time.perf_counter()
+
+    cursor = conn.cursor()
+    if conn.dialect == 'sqlite':
+        # One writer at a time: hold the write lock from the existing-email lookup to the merge
+        cursor.execute('BEGIN IMMEDIATE')
+
+    staged = [(row['email'], row['name'], row.get('password_hash', UNUSABLE_PASSWORD), team_id,
+               row.get('invite_hash'), row.get('invite_expires'))
+              for row in rows]
+    if conn.dialect == 'sqlite':
+        merged, inserted = _merge_sqlite(cursor, staged)
+    else:
+        merged, inserted = _merge_postgres(cursor, staged)
+    if merged:
+        # New members and refreshed names show in the team's cached day summaries
+        Repositories(cursor).teams.bump_roster_version(team_id)
+    conn.commit()
+
+    # The only copy of the raw tokens, until the admin downloads them as links
+    invited = [row for row in rows if row.get('invite') and row['email'] in inserted]
+    if invited:
+        with open(invites_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Email', 'Name', 'Invite Token'])
+            for row in invited:
+                writer.writerow([row['email'], row['name'], row['invite']])
+
+    elapsed = time.perf_counter() - started
+    return {
+        'rows': len(rows),
+        'created': len(inserted),
+        'updated': len(merged) - len(inserted),
+        'skipped': len(rows) - len(merged),
+        'invites': len(invited),
+        'errors': errors,
+        'hash_workers': workers,
+        'hash_seconds': round(hashed_at - started, 2),
+        'seconds': round(elapsed, 2),
+        'rows_per_second': round(len(rows) / elapsed, 1) if elapsed else None,
+    }
+
+
+def take_invites(invites_path, link):
+    """CSV of invite links built from an import's token file, which is then deleted"""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['Email', 'Name', 'Invite Link'])
+    with open(invites_path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for email, name, token in reader:
+            writer.writerow([email, name, link(token)])
+    os.remove(invites_path)
+    return out.getvalue()
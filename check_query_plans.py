@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Query plan regression check
+Seeds a realistic dataset into a scratch Postgres database, drives the
+routes, the evening reminder and morning digest batches and the webhook
+dispatcher through the app while recording every SQL statement they issue,
+then runs EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) on each one and fails if a
+plan has regressed:
+
+  - a sequential scan on responses
+  - more shared buffers touched than the statement's budget
+
+    QUERY_PLAN_DATABASE_URL=postgresql://localhost/office_plans python check_query_plans.py
+
+Exits non-zero on any violation, so it can gate CI. Never point it at a real
+database: it adds teams, users and a year of responses.
+"""
+
+import contextlib
+import io
+import os
+import sys
+from datetime import date, timedelta
+
+DATABASE_URL = os.environ.get('QUERY_PLAN_DATABASE_URL')
+if not DATABASE_URL:
+    sys.exit('Set QUERY_PLAN_DATABASE_URL to a scratch database')
+os.environ['DATABASE_URL'] = DATABASE_URL
+os.environ['DISABLE_SCHEDULER'] = '1'
+
+import psycopg2.extras  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import app  # noqa: E402
+import jobs  # noqa: E402
+import webhooks  # noqa: E402
+
+# Dataset size
+TEAMS = 5
+USERS_PER_TEAM = 200
+HISTORY_DAYS = 365
+FUTURE_DAYS = 14
+DESKS = 300
+
+# Tables that must never be read with a sequential scan
+NO_SEQ_SCAN = {'responses'}
+
+# Shared buffers (8 kB pages) a statement may touch on the seeded dataset.
+# A day of one team's responses is a few dozen; the whole table is ~1800.
+DEFAULT_BUFFER_BUDGET = 200
+# Statements that legitimately read more (a fragment of their SQL -> budget)
+BUFFER_BUDGETS = {
+    # Recommender habits: every teammate over RECOMMENDER_HISTORY_DAYS
+    'EXTRACT(ISODOW FROM date)': 1000,
+    # Calendar export over a month (EXPORT_QUERY)
+    'ORDER BY r.date DESC, u.name': 1000,
+    # Change feed page of up to 500 rows
+    'ORDER BY r.change_txid, r.change_seq LIMIT': 1000,
+    # Attendance index loading a team's two years of history
+    'SELECT user_id, location_id, date FROM responses WHERE team_id': 1000,
+}
+
+ADMIN_EMAIL = 'plans-admin@example.com'
+ADMIN_PASSWORD = 'plans123'
+
+# Statements recorded while driving the app: normalised SQL -> (label, sql, params).
+# The harness's own lookups run with no label and aren't recorded.
+recorded = {}
+current_label = [None]
+
+
+class RecordingCursor(psycopg2.extras.DictCursor):
+    def execute(self, query, vars=None):
+        if isinstance(query, bytes):
+            # Already bound by psycopg2 (execute_values)
+            query = query.decode()
+        key = ' '.join(query.split())
+        if current_label[0] and key.split(' ', 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+            recorded.setdefault(key, (current_label[0], query, vars))
+        return super().execute(query, vars)
+
+
+def seed(cursor):
+    """Teams, users, desks and a year of responses, unless already seeded"""
+    cursor.execute('SELECT 1 FROM users WHERE email = %s', (ADMIN_EMAIL,))
+    if cursor.fetchone():
+        return False
+
+    print(f"🌱 Seeding {TEAMS} teams x {USERS_PER_TEAM} users, {HISTORY_DAYS} days of history")
+    password_hash = generate_password_hash(ADMIN_PASSWORD)
+    cursor.execute('''
+        INSERT INTO teams (name)
+        SELECT 'Plans Team ' || n FROM generate_series(1, %s) n
+        ON CONFLICT (name) DO NOTHING
+    ''', (TEAMS,))
+    cursor.execute('''
+        INSERT INTO users (email, name, password_hash, team_id, is_admin)
+        SELECT 'plans-user-' || t.id || '-' || n || '@example.com', 'Plans User ' || t.id || '-' || n, %s, t.id, FALSE
+        FROM teams t
+        CROSS JOIN generate_series(1, %s) n
+        WHERE t.name LIKE 'Plans Team %%'
+    ''', (password_hash, USERS_PER_TEAM))
+    cursor.execute('''
+        INSERT INTO users (email, name, password_hash, team_id, is_admin)
+        SELECT %s, 'Plans Admin', %s, id, TRUE FROM teams WHERE name = 'Plans Team 1'
+    ''', (ADMIN_EMAIL, password_hash))
+
+    cursor.execute('SELECT array_agg(id ORDER BY id) as ids FROM locations')
+    location_ids = cursor.fetchone()['ids']
+    cursor.execute('''
+        INSERT INTO responses (user_id, location_id, date, team_id)
+        SELECT u.id, (%s::int[])[1 + floor(random() * %s)::int], d::date, u.team_id
+        FROM users u
+        CROSS JOIN generate_series(CURRENT_DATE - %s, CURRENT_DATE + %s, interval '1 day') d
+        WHERE EXTRACT(ISODOW FROM d) < 6 AND random() < 0.85
+    ''', (location_ids, len(location_ids), HISTORY_DAYS, FUTURE_DAYS))
+
+    # Desks in the first office, booked by whoever is in on upcoming days
+    cursor.execute('''
+        INSERT INTO floors (location_id, name) VALUES (%s, 'Plans Floor')
+        ON CONFLICT (location_id, name) DO UPDATE SET name = EXCLUDED.name
+        RETURNING id
+    ''', (location_ids[0],))
+    floor_id = cursor.fetchone()['id']
+    cursor.execute('''
+        INSERT INTO desks (floor_id, location_id, label, x, y)
+        SELECT %s, %s, 'P-' || n, n %% 20, n / 20 FROM generate_series(1, %s) n
+        ON CONFLICT (floor_id, label) DO NOTHING
+    ''', (floor_id, location_ids[0], DESKS))
+    cursor.execute('''
+        UPDATE responses r SET desk_id = d.id
+        FROM (
+            SELECT id, date, row_number() OVER (PARTITION BY date ORDER BY user_id) as n
+            FROM responses WHERE location_id = %s AND date >= CURRENT_DATE
+        ) b
+        JOIN (
+            SELECT id, row_number() OVER (ORDER BY id) as n FROM desks WHERE floor_id = %s
+        ) d ON d.n = b.n
+        WHERE r.id = b.id
+    ''', (location_ids[0], floor_id))
+    cursor.execute('ANALYZE')
+    return True
+
+
+def drive_app():
+    """Exercise the routes, job handlers and email batches as real users would"""
+    client = app.app.test_client()
+    today = date.today()
+    tomorrow = today + timedelta(days=1)
+    month_ago = today - timedelta(days=30)
+
+    def step(label, method, url, **kwargs):
+        current_label[0] = label
+        response = getattr(client, method)(url, **kwargs)
+        if response.status_code >= 400:
+            print(f"⚠️  {method.upper()} {url} returned {response.status_code}", file=sys.stderr)
+        response.close()
+        current_label[0] = None
+        return response
+
+    step('login', 'post', '/login', data={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+
+    conn = app.get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id FROM users WHERE email = %s', (ADMIN_EMAIL,))
+    admin_id = cursor.fetchone()['id']
+    cursor.execute('SELECT id FROM users WHERE team_id = (SELECT team_id FROM users WHERE id = %s) '
+                   'AND id != %s ORDER BY id LIMIT 2', (admin_id, admin_id))
+    teammates = ','.join(str(row['id']) for row in cursor.fetchall())
+    cursor.execute('SELECT location_id FROM floors ORDER BY id LIMIT 1')
+    office_id = cursor.fetchone()['location_id']
+    conn.close()
+
+    step('register', 'get', '/register')
+    # An unreachable local endpoint: set_location writes outbox rows and the dispatcher takes the failure path
+    app.WEBHOOK_ALLOW_PRIVATE_HOSTS = True
+    step('create_webhook', 'post', '/admin/webhooks', data={'url': 'http://127.0.0.1:9/plan-check'})
+    step('set_location', 'post', '/set-location',
+         data={'location_id': office_id, 'date': tomorrow.isoformat(), 'auto_desk': '1'})
+    step('dashboard', 'get', '/dashboard')
+    step('summary (past)', 'get', f'/summary/{today - timedelta(days=1)}')
+    step('summary (today)', 'get', f'/summary/{today}')
+    step('calendar', 'get', '/calendar')
+
+    conn = app.get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT calendar_token FROM users WHERE id = %s', (admin_id,))
+    token = cursor.fetchone()['calendar_token']
+    conn.close()
+    step('calendar_feed', 'get', f'/calendar/{token}.ics')
+
+    step('admin', 'get', '/admin')
+    step('admin_calendar_view', 'get', f'/admin/calendar-view?date={today}')
+    step('export_calendar', 'get', f'/admin/export-calendar?start_date={month_ago}&end_date={today}&format=csv')
+    step('export_calendar (queued)', 'get',
+         f'/admin/export-calendar?start_date={month_ago}&end_date={today}&format=csv&async=1')
+    step('queue_reminders', 'post', '/admin/reminders/send')
+    step('queue_digest', 'post', '/admin/digest/send')
+    step('api_locations', 'get', '/api/locations')
+    step('api_summary', 'get', f'/api/summary/{today}')
+    step('api_changes', 'get', '/api/changes?cursor=0&limit=500')
+    step('api_desks', 'get', f'/api/desks?location_id={office_id}&date={tomorrow}')
+    step('api_recommendations', 'get', '/api/recommendations')
+    step('api_common_days', 'get',
+         f"/api/attendance/common-days?users={teammates}&location_id={office_id}&month={today:%Y-%m}")
+    step('api_overlaps', 'get', f'/api/attendance/overlaps?start={month_ago}&end={today}')
+
+    # Queued jobs, run the way the worker runs them
+    while True:
+        current_label[0] = 'worker'
+        conn = app.get_db()
+        job = jobs.claim_job(conn, 'plan-check')
+        conn.close()
+        current_label[0] = None
+        if not job:
+            break
+        current_label[0] = f"job {job['type']}"
+        jobs.run_job(app.get_db, job)
+        step('job_status', 'get', f"/jobs/{job['id']}")
+
+    current_label[0] = 'send_evening_reminders'
+    app.send_evening_reminders(force=True)
+    current_label[0] = 'send_morning_digest'
+    app.send_morning_digest(today)
+    current_label[0] = 'webhook dispatcher'
+    dispatcher = webhooks.Dispatcher(app.get_db, linger=0, timeout=1, concurrency=1, allow_private_hosts=True)
+    dispatcher.dispatch_once()
+    dispatcher.prune()
+    current_label[0] = None
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def budget_for(sql):
+    for fragment, budget in BUFFER_BUDGETS.items():
+        if fragment in sql:
+            return budget
+    return DEFAULT_BUFFER_BUDGET
+
+
+def check_plans():
+    """EXPLAIN every recorded statement; returns the number of violations"""
+    conn = app.get_db()
+    conn.cursor_factory = psycopg2.extras.DictCursor
+    cursor = conn.cursor()
+    violations = 0
+
+    print(f"\n🔎 {len(recorded)} distinct statements\n")
+    print(f"{'':2} {'buffers':>8} {'ms':>8}  {'issued by':<26} statement")
+    for key, (label, sql, params) in recorded.items():
+        try:
+            cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}', params)
+            result = cursor.fetchone()[0][0]
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"❌ {'-':>8} {'-':>8}  {label:<26} {key[:70]}\n      could not explain: {e}")
+            violations += 1
+            continue
+        finally:
+            # Writes were only for measuring
+            conn.rollback()
+
+        plan = result['Plan']
+        buffers = plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0)
+        problems = []
+        seq_scans = {node['Relation Name'] for node in plan_nodes(plan)
+                     if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') in NO_SEQ_SCAN}
+        if seq_scans:
+            problems.append(f"sequential scan on {', '.join(sorted(seq_scans))}")
+        budget = budget_for(key)
+        if buffers > budget:
+            problems.append(f"{buffers} buffers > budget {budget}")
+
+        mark = '❌' if problems else '✅'
+        print(f"{mark} {buffers:>8} {result['Execution Time']:>8.2f}  {label:<26} {key[:70]}")
+        for problem in problems:
+            print(f"      {problem}")
+        violations += bool(problems)
+
+    conn.close()
+    return violations
+
+
+def main():
+    conn = app.get_db()
+    seeded = seed(conn.cursor())
+    conn.commit()
+    conn.close()
+    if not seeded:
+        print("🌱 Reusing the dataset already in the database")
+
+    # Plain SQL so the recorded text can be EXPLAINed as-is
+    app.store.pool.prepare = False
+    cursor_factory = app.store.pool.cursor_factory
+    app.store.pool.cursor_factory = RecordingCursor
+    try:
+        # The app's own progress output (one line per reminder) would drown the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            drive_app()
+    finally:
+        app.store.pool.cursor_factory = cursor_factory
+
+    violations = check_plans()
+    if violations:
+        print(f"\n❌ {violations} statement(s) regressed")
+        sys.exit(1)
+    print("\n✅ All query plans within budget")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Database connections and prepared statements
+Connections are kept open and reused within each process. Hot queries are
+declared once in a registry; a connection PREPAREs a statement the first time
+it runs it and EXECUTEs it by name afterwards, so Postgres parses and plans
+it once per connection instead of on every request.
+
+Behind a pooler in transaction mode (e.g. PgBouncer pool_mode=transaction)
+consecutive statements can land on different server connections and
+session-level PREPARE is unsafe. Turn prepared statements off there and the
+same registry simply sends the SQL text.
+
+A statement can carry a SQLite variant for the few queries whose syntax
+differs (arrays, date parts, sequences); SQLite connections (storage.py) run
+that text directly, since sqlite3 keeps its own per-connection statement cache.
+"""
+
+import os
+import re
+import threading
+import time
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.extras
+
+# Registered statements: name -> Statement
+STATEMENTS = {}
+
+
+class Statement:
+    """A named query with %s placeholders, prepared on demand"""
+
+    def __init__(self, name, sql, sqlite=None):
+        self.name = name
+        self.sql = sql
+        self.sqlite_sql = sqlite or sql
+        counter = iter(range(1, sql.count('%s') + 1))
+        body = re.sub(r'%%|%s', lambda m: '%' if m.group() == '%%' else f'${next(counter)}', sql)
+        self.prepare_sql = f'PREPARE {name} AS {body}'
+        params = sql.count('%s')
+        self.execute_sql = f"EXECUTE {name} ({', '.join(['%s'] * params)})" if params else f'EXECUTE {name}'
+
+
+def statement(name, sql, sqlite=None):
+    """Declare a hot query once at import time (with its SQLite text if it differs)"""
+    if name in STATEMENTS:
+        raise ValueError(f'Statement {name!r} is already registered')
+    STATEMENTS[name] = Statement(name, sql, sqlite)
+    return STATEMENTS[name]
+
+
+def run(cursor, stmt, params=()):
+    """Execute a registered statement on a cursor, prepared if the connection allows it"""
+    conn = cursor.connection
+    if getattr(conn, 'dialect', None) == 'sqlite':
+        cursor.execute(stmt.sqlite_sql, params)
+        return cursor
+    pool = getattr(conn, 'pool', None)
+    if pool is None or not pool.prepare:
+        cursor.execute(stmt.sql, params)
+        return cursor
+
+    # Outside a transaction we can safely retry as plain SQL if the
+    # statement vanished (a transaction-mode pooler handed us another backend)
+    idle = conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    try:
+        if stmt.name not in conn.prepared:
+            cursor.execute(stmt.prepare_sql)
+            conn.prepared.add(stmt.name)
+        cursor.execute(stmt.execute_sql, params)
+    except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.DuplicatePreparedStatement):
+        conn.prepared.clear()
+        pool.prepare = False
+        print('⚠️  Prepared statements are not sticking to this connection '
+              '(transaction pooler?); falling back to plain queries')
+        if not idle:
+            raise
+        conn.rollback()
+        cursor.execute(stmt.sql, params)
+    return cursor
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """A connection that returns to its pool on close() and remembers what it has prepared"""
+
+    dialect = 'postgresql'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.prepared = set()
+        self.in_use = False
+        self.released_at = None
+
+    def close(self):
+        if self.pool is not None and self.pool.release(self):
+            return
+        super().close()
+
+
+class ConnectionPool:
+    """Per-process pool of idle connections; callers keep using get_db()/close()"""
+
+    def __init__(self, dsn, max_idle=5, max_idle_seconds=300, prepare=True,
+                 cursor_factory=psycopg2.extras.DictCursor):
+        self.dsn = dsn
+        self.cursor_factory = cursor_factory
+        self.max_idle = max_idle
+        self.max_idle_seconds = max_idle_seconds
+        self.prepare = prepare
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get(self):
+        conn = None
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked (gunicorn --preload): never share sockets with the parent
+                self._idle = []
+                self._pid = os.getpid()
+            while self._idle and conn is None:
+                conn = self._idle.pop()
+                if conn.closed or time.monotonic() - conn.released_at > self.max_idle_seconds:
+                    psycopg2.extensions.connection.close(conn)
+                    conn = None
+
+        if conn is None:
+            conn = psycopg2.connect(self.dsn, connection_factory=PooledConnection)
+            conn.pool = self
+        conn.cursor_factory = self.cursor_factory
+        conn.in_use = True
+        return conn
+
+    def release(self, conn):
+        """Reset a connection and keep it idle; False means really close it"""
+        if not conn.in_use:
+            return not conn.closed
+        conn.in_use = False
+        if conn.closed or self._pid != os.getpid():
+            return False
+        try:
+            # Don't carry an open transaction (or LISTEN/autocommit state) into the next request
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                return False
+        except psycopg2.Error:
+            return False
+        with self._lock:
+            if len(self._idle) >= self.max_idle:
+                return False
+            conn.released_at = time.monotonic()
+            self._idle.append(conn)
+        return True
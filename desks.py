@@ -0,0 +1,242 @@
+"""
+Desk-level booking
+Floors and desks live under each office location. Availability for a
+(location, date) is an in-memory occupancy bitset over that location's desks,
+so "is this desk free" and "find me a free desk" never scan the bookings
+table. Each process catches up with bookings made elsewhere from the responses
+change feed, paged on (change_txid, change_seq) like /api/changes so a booking
+that commits out of sequence order isn't skipped; the unique (desk_id, date)
+index stays the final word when two people race for the same desk.
+"""
+
+import math
+import threading
+import time
+from datetime import date
+
+# Reload desks and bookings from scratch this often (picks up config changes)
+FULL_RELOAD_SECONDS = 600
+
+
+def init_desk_tables(cursor):
+    """Create floors/desks tables and the booking column on responses"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS floors (
+            id SERIAL PRIMARY KEY,
+            location_id INTEGER NOT NULL REFERENCES locations(id),
+            name VARCHAR(100) NOT NULL,
+            UNIQUE(location_id, name)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS desks (
+            id SERIAL PRIMARY KEY,
+            floor_id INTEGER NOT NULL REFERENCES floors(id),
+            location_id INTEGER NOT NULL REFERENCES locations(id),
+            label VARCHAR(50) NOT NULL,
+            x REAL NOT NULL DEFAULT 0,
+            y REAL NOT NULL DEFAULT 0,
+            is_active BOOLEAN DEFAULT TRUE,
+            UNIQUE(floor_id, label)
+        )
+    ''')
+    cursor.execute('ALTER TABLE responses ADD COLUMN IF NOT EXISTS desk_id INTEGER REFERENCES desks(id)')
+    # One person per desk per day, enforced by the database
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_responses_desk_date
+        ON responses(desk_id, date) WHERE desk_id IS NOT NULL
+    ''')
+    # Desks are shared across teams, so the occupancy map follows the global feed
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_responses_change_seq ON responses(change_seq)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_responses_feed ON responses(change_txid, change_seq)')
+
+
+def seed_desks(cursor, offices):
+    """Create floors and a grid of desks from the `floors` entries in config.yaml"""
+    for office in offices:
+        floors = office.get('floors')
+        if not floors:
+            continue
+        cursor.execute('SELECT id FROM locations WHERE name = %s', (office['name'],))
+        location = cursor.fetchone()
+        if not location:
+            continue
+        for floor_number, floor in enumerate(floors, start=1):
+            cursor.execute('''
+                INSERT INTO floors (location_id, name) VALUES (%s, %s)
+                ON CONFLICT (location_id, name) DO UPDATE SET name = EXCLUDED.name
+                RETURNING id
+            ''', (location['id'], floor['name']))
+            floor_id = cursor.fetchone()['id']
+            columns = floor.get('columns', 10)
+            for n in range(floor['desks']):
+                cursor.execute('''
+                    INSERT INTO desks (floor_id, location_id, label, x, y)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (floor_id, label) DO NOTHING
+                ''', (floor_id, location['id'], f"{floor_number}-{n + 1:03d}", n % columns, n // columns))
+
+
+class LocationDesks:
+    """Desks of one location, each given a fixed bit slot"""
+
+    def __init__(self):
+        self.desks = []      # slot -> desk dict
+        self.slot_of = {}    # desk_id -> slot
+        self.all_mask = 0
+
+    def add(self, desk):
+        slot = len(self.desks)
+        self.desks.append(desk)
+        self.slot_of[desk['id']] = slot
+        self.all_mask |= 1 << slot
+
+
+class DeskMap:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locations = {}
+        self._desk_location = {}
+        self._occupied = {}   # (location_id, day) -> bitset of taken slots
+        self._held = {}       # (user_id, day) -> (location_id, slot)
+        self._feed_cursor = (0, 0)   # (change_txid, change_seq) applied so far
+        self._loaded_at = None
+
+    def _apply(self, user_id, day, desk_id):
+        previous = self._held.pop((user_id, day), None)
+        if previous:
+            location_id, slot = previous
+            self._occupied[(location_id, day)] = self._occupied.get((location_id, day), 0) & ~(1 << slot)
+        location_id = self._desk_location.get(desk_id)
+        if location_id is not None:
+            slot = self._locations[location_id].slot_of[desk_id]
+            self._occupied[(location_id, day)] = self._occupied.get((location_id, day), 0) | (1 << slot)
+            self._held[(user_id, day)] = (location_id, slot)
+
+    def refresh(self, repos):
+        """Load desks and upcoming bookings on first use, then follow the change feed"""
+        cursor = repos.cursor
+        with self._lock:
+            today = date.today()
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > FULL_RELOAD_SECONDS:
+                feed_cursor = repos.responses.feed_position()
+                cursor.execute('''
+                    SELECT d.id, d.location_id, d.label, d.x, d.y, d.floor_id, f.name as floor_name
+                    FROM desks d
+                    JOIN floors f ON d.floor_id = f.id
+                    WHERE d.is_active = TRUE
+                    ORDER BY d.location_id, f.name, d.label
+                ''')
+                self._locations = {}
+                self._desk_location = {}
+                for desk in cursor.fetchall():
+                    desk = dict(desk)
+                    self._locations.setdefault(desk['location_id'], LocationDesks()).add(desk)
+                    self._desk_location[desk['id']] = desk['location_id']
+
+                self._occupied = {}
+                self._held = {}
+                cursor.execute('''
+                    SELECT user_id, date, desk_id
+                    FROM responses
+                    WHERE date >= %s AND desk_id IS NOT NULL
+                ''', (today,))
+                for row in cursor.fetchall():
+                    self._apply(row['user_id'], row['date'], row['desk_id'])
+                self._feed_cursor = feed_cursor
+                self._loaded_at = time.monotonic()
+                return
+
+            # Changes include rows whose desk was released (desk_id now NULL)
+            for row in repos.responses.changed_since(*self._feed_cursor, today):
+                self._apply(row['user_id'], row['date'], row['desk_id'])
+                self._feed_cursor = (row['change_txid'], row['change_seq'])
+
+    def record(self, user_id, day, desk_id):
+        """Apply a booking made by this process right away"""
+        with self._lock:
+            self._apply(user_id, day, desk_id)
+
+    def mark_taken(self, desk_id, day):
+        """A booking we haven't seen yet holds this desk (the next reload names the holder)"""
+        with self._lock:
+            location_id = self._desk_location.get(desk_id)
+            if location_id is not None:
+                slot = self._locations[location_id].slot_of[desk_id]
+                self._occupied[(location_id, day)] = self._occupied.get((location_id, day), 0) | (1 << slot)
+
+    def has_desks(self, location_id):
+        with self._lock:
+            return location_id in self._locations
+
+    def location_of(self, desk_id):
+        with self._lock:
+            return self._desk_location.get(desk_id)
+
+    def is_free(self, desk_id, day, user_id=None):
+        """True if nobody (other than user_id) holds the desk that day"""
+        with self._lock:
+            location_id = self._desk_location.get(desk_id)
+            if location_id is None:
+                return False
+            slot = self._locations[location_id].slot_of[desk_id]
+            if user_id is not None and self._held.get((user_id, day)) == (location_id, slot):
+                return True
+            return not (self._occupied.get((location_id, day), 0) >> slot) & 1
+
+    def availability(self, location_id, day):
+        """(total desks, free desks) for a location and day"""
+        with self._lock:
+            desks = self._locations.get(location_id)
+            if not desks:
+                return 0, 0
+            free = desks.all_mask & ~self._occupied.get((location_id, day), 0)
+            return len(desks.desks), free.bit_count()
+
+    def desks(self, location_id, day):
+        """All desks of a location with a free flag"""
+        with self._lock:
+            desks = self._locations.get(location_id)
+            if not desks:
+                return []
+            taken = self._occupied.get((location_id, day), 0)
+            return [dict(desk, free=not (taken >> slot) & 1) for slot, desk in enumerate(desks.desks)]
+
+    def find_free_desk(self, location_id, day, near_desk_ids=()):
+        """
+        A free desk at the location, as close as possible to the given desks
+        (teammates' bookings). Without anyone to sit near, the first free desk.
+        """
+        with self._lock:
+            desks = self._locations.get(location_id)
+            if not desks:
+                return None
+            free = desks.all_mask & ~self._occupied.get((location_id, day), 0)
+            if not free:
+                return None
+
+            near = [desks.desks[desks.slot_of[d]] for d in near_desk_ids if d in desks.slot_of]
+            if not near:
+                first = (free & -free).bit_length() - 1
+                return dict(desks.desks[first])
+
+            # Sit on the floor where most teammates are, near their centre
+            floors = {}
+            for desk in near:
+                floors.setdefault(desk['floor_id'], []).append(desk)
+            floor_id, group = max(floors.items(), key=lambda item: len(item[1]))
+            cx = sum(d['x'] for d in group) / len(group)
+            cy = sum(d['y'] for d in group) / len(group)
+
+            best, best_distance = None, None
+            bits = free
+            while bits:
+                low = bits & -bits
+                desk = desks.desks[low.bit_length() - 1]
+                bits ^= low
+                distance = math.hypot(desk['x'] - cx, desk['y'] - cy)
+                if desk['floor_id'] != floor_id:
+                    distance += 1e6  # any desk on the team's floor beats another floor
+                if best is None or distance < best_distance:
+                    best, best_distance = desk, distance
+            return dict(best)
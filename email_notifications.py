@@ -4,8 +4,12 @@ Optional feature - can be enabled in config.yaml
 """
 
 import smtplib
+import html
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from email.utils import formataddr
 import os
 import yaml
 
@@ -23,6 +27,9 @@ class EmailNotifier:
             self.from_email = config['email']['from_email']
             self.from_name = config['email'].get('from_name', 'Office Tracker')
             self.password = os.environ.get('EMAIL_PASSWORD', '')
+        # Bulk sends (morning digest) share a few long-lived SMTP sessions
+        self.smtp_connections = config.get('email', {}).get('smtp_connections', 4)
+        self.messages_per_connection = config.get('email', {}).get('messages_per_connection', 100)
     
     def send_evening_reminder(self, user_email, user_name):
         """Send evening reminder to user to set their location"""
@@ -79,11 +86,25 @@ class EmailNotifier:
             print(f"📧 [DEMO] Would send morning summary to {admin_email}")
             return True
         
+        subject, html_body = self.render_morning_summary(summary_data)
+        return self._send_email(admin_email, subject, html_body)
+    
+    def render_morning_summary(self, summary_data, roster=None, team_name=None, not_set=0):
+        """Subject and HTML body of the morning summary, shared by every recipient"""
         subject = "📊 Today's Office Locations Summary"
+        if team_name:
+            subject += f" - {' '.join(team_name.split())}"
         
         # Build summary HTML
         locations_html = ""
         for location in summary_data:
+            people = (roster or {}).get(location['name'], [])
+            names_html = ""
+            if people:
+                names_html = f"""
+                <p style="font-size: 14px; color: #666; margin: 10px 0 0 0;">
+                    {html.escape(', '.join(people))}
+                </p>"""
             locations_html += f"""
             <div style="margin-bottom: 20px; padding: 15px; background-color: white; 
                         border-left: 4px solid {location['color']}; border-radius: 5px;">
@@ -93,10 +114,17 @@ class EmailNotifier:
                 </h3>
                 <p style="font-size: 18px; font-weight: bold; margin: 0;">
                     {location['count']} people
-                </p>
+                </p>{names_html}
             </div>
             """
         
+        not_set_html = ""
+        if not_set:
+            not_set_html = f"""
+                <p style="font-size: 14px; color: #666;">
+                    {not_set} teammates haven't set their location yet.
+                </p>"""
+        
         html_body = f"""
         <html>
         <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
@@ -108,6 +136,7 @@ class EmailNotifier:
                 <h2>Today's Office Locations</h2>
                 
                 {locations_html}
+                {not_set_html}
                 
                 <div style="text-align: center; margin-top: 30px;">
                     <a href="http://localhost:5000/dashboard" 
@@ -126,22 +155,34 @@ class EmailNotifier:
         </html>
         """
         
-        return self._send_email(admin_email, subject, html_body)
+        return subject, html_body
+    
+    def smtp_pool(self):
+        """Pooled SMTP sessions for sending one body to many recipients"""
+        return SMTPPool(self)
+    
+    def _build_message(self, to_email, subject, html_body):
+        msg = MIMEMultipart('alternative')
+        msg['From'] = f"{self.from_name} <{self.from_email}>"
+        msg['To'] = to_email
+        msg['Subject'] = subject
+        
+        html_part = MIMEText(html_body, 'html')
+        msg.attach(html_part)
+        return msg
+    
+    def _connect(self):
+        server = smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=30)
+        server.starttls()
+        server.login(self.from_email, self.password)
+        return server
     
     def _send_email(self, to_email, subject, html_body):
         """Internal method to send email"""
         try:
-            msg = MIMEMultipart('alternative')
-            msg['From'] = f"{self.from_name} <{self.from_email}>"
-            msg['To'] = to_email
-            msg['Subject'] = subject
+            msg = self._build_message(to_email, subject, html_body)
             
-            html_part = MIMEText(html_body, 'html')
-            msg.attach(html_part)
-            
-            with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.from_email, self.password)
+            with self._connect() as server:
                 server.send_message(msg)
             
             print(f"✅ Email sent to {to_email}")
@@ -152,6 +193,80 @@ class EmailNotifier:
             return False
 
 
+class SMTPPool:
+    """
+    A few SMTP sessions kept open for a whole batch, each reused for up to
+    messages_per_connection messages, with one sending thread per session.
+    """
+    
+    # Replaced with each recipient's address in the pre-built message
+    TO_PLACEHOLDER = 'digest-recipient@placeholder.invalid'
+    
+    def __init__(self, notifier):
+        self.notifier = notifier
+        self.size = max(1, notifier.smtp_connections) if notifier.enabled else 1
+        self._sessions = queue.Queue()
+        self._executor = None
+    
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.size)
+        for _ in range(self.size):
+            self._sessions.put({'server': None, 'sent': 0})
+        return self
+    
+    def __exit__(self, *exc):
+        self._executor.shutdown()
+        while not self._sessions.empty():
+            self._close(self._sessions.get())
+    
+    def send(self, recipients, subject, html_body):
+        """Send one rendered body to [(email, name)]; returns the emails that were accepted"""
+        if not recipients:
+            return []
+        if not self.notifier.enabled:
+            print(f"📧 [DEMO] Would send \"{subject}\" to {len(recipients)} recipients")
+            return [email for email, _ in recipients]
+        
+        # Serialise the MIME message once; only the To header differs per recipient
+        template = self.notifier._build_message(self.TO_PLACEHOLDER, subject, html_body).as_string()
+        sent = self._executor.map(lambda r: self._send_one(template, *r), recipients)
+        return [email for email, ok in zip((r[0] for r in recipients), sent) if ok]
+    
+    def _send_one(self, template, email, name):
+        message = template.replace(self.TO_PLACEHOLDER, formataddr((name, email)), 1)
+        session = self._sessions.get()
+        try:
+            for attempt in (1, 2):
+                try:
+                    if session['server'] is None or session['sent'] >= self.notifier.messages_per_connection:
+                        self._close(session)
+                        session['server'] = self.notifier._connect()
+                    session['server'].sendmail(self.notifier.from_email, [email], message.encode('utf-8'))
+                    session['sent'] += 1
+                    return True
+                except smtplib.SMTPServerDisconnected:
+                    # Server dropped an idle or exhausted session: reconnect once
+                    session['server'] = None
+                    if attempt == 2:
+                        raise
+        except Exception as e:
+            print(f"❌ Failed to send email to {email}: {e}")
+            self._close(session)
+            return False
+        finally:
+            self._sessions.put(session)
+    
+    @staticmethod
+    def _close(session):
+        if session['server'] is not None:
+            try:
+                session['server'].quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        session['server'] = None
+        session['sent'] = 0
+
+
 # Example usage
 if __name__ == "__main__":
     notifier = EmailNotifier()
@@ -0,0 +1,175 @@
+"""
+Calendar export writers
+CSV, gzip CSV and JSON Lines are produced as streams of chunks so they can be
+sent straight to the client or a file; Parquet (optional, needs pyarrow) is
+written in row groups with dictionary-encoded user and location columns.
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from functools import lru_cache
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# format -> (content type, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', '.csv'),
+    'csv.gz': ('application/gzip', '.csv.gz'),
+    'ndjson': ('application/x-ndjson', '.ndjson'),
+    'ndjson.gz': ('application/gzip', '.ndjson.gz'),
+    'parquet': ('application/vnd.apache.parquet', '.parquet'),
+}
+
+# Formats that can only be built as a file (Parquet needs its footer written last)
+FILE_ONLY_FORMATS = {'parquet'}
+
+CSV_HEADER = ['Date', 'Day', 'Employee Name', 'Email', 'Location']
+
+# Flush text output in chunks of roughly this many characters
+CHUNK_SIZE = 64 * 1024
+
+# Rows per Parquet row group
+ROW_GROUP_SIZE = 50000
+
+
+def _row_date(row):
+    """Export row date as a date object"""
+    return datetime.strptime(row['date'], '%Y-%m-%d').date() if isinstance(row['date'], str) else row['date']
+
+
+def iter_csv(rows, on_row=None):
+    """Yield CSV text chunks for export rows"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(CSV_HEADER)
+
+    for written, row in enumerate(rows, start=1):
+        row_date = _row_date(row)
+        writer.writerow([
+            row_date.strftime('%Y-%m-%d'),  # Ensure consistent date format
+            DAY_NAMES[row_date.weekday()],
+            row['user_name'],
+            row['user_email'],
+            f"{row['location_emoji']} {row['location_name']}"
+        ])
+        if on_row:
+            on_row(written)
+        if buf.tell() >= CHUNK_SIZE:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    yield buf.getvalue()
+
+
+def iter_ndjson(rows, on_row=None):
+    """Yield JSON Lines text chunks for export rows"""
+    lines = []
+    size = 0
+
+    for written, row in enumerate(rows, start=1):
+        row_date = _row_date(row)
+        line = json.dumps({
+            'date': row_date.strftime('%Y-%m-%d'),
+            'day': DAY_NAMES[row_date.weekday()],
+            'name': row['user_name'],
+            'email': row['user_email'],
+            'location': row['location_name'],
+            'emoji': row['location_emoji'],
+        }, ensure_ascii=False)
+        lines.append(line)
+        size += len(line) + 1
+        if on_row:
+            on_row(written)
+        if size >= CHUNK_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+            size = 0
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip-compress a stream of text chunks on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_export(rows, export_format, on_row=None):
+    """Yield the bytes of a streamable export format"""
+    base = export_format[:-3] if export_format.endswith('.gz') else export_format
+    chunks = iter_ndjson(rows, on_row) if base == 'ndjson' else iter_csv(rows, on_row)
+
+    if export_format.endswith('.gz'):
+        return gzip_chunks(chunks)
+    return (chunk.encode('utf-8') for chunk in chunks)
+
+
+@lru_cache(maxsize=None)
+def parquet_available():
+    """True when pyarrow imports (a pyarrow built for another numpy fails only on import)"""
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def write_parquet(cursor, path, on_row=None, row_group_size=ROW_GROUP_SIZE):
+    """Write export rows from a (server-side) cursor to a Parquet file"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('Parquet export requires pyarrow (pip install pyarrow)')
+
+    # Names and locations repeat on every row: store them as dictionaries
+    text = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema([
+        ('date', pa.date32()),
+        ('day', text),
+        ('user_name', text),
+        ('user_email', text),
+        ('location_name', text),
+        ('location_emoji', text),
+    ])
+
+    written = 0
+    with pq.ParquetWriter(path, schema, compression='zstd', use_dictionary=True) as writer:
+        while True:
+            batch = cursor.fetchmany(row_group_size)
+            if not batch:
+                break
+            dates = [_row_date(row) for row in batch]
+            columns = [
+                pa.array(dates, type=pa.date32()),
+                pa.array([DAY_NAMES[d.weekday()] for d in dates]).dictionary_encode(),
+                pa.array([row['user_name'] for row in batch]).dictionary_encode(),
+                pa.array([row['user_email'] for row in batch]).dictionary_encode(),
+                pa.array([row['location_name'] for row in batch]).dictionary_encode(),
+                pa.array([row['location_emoji'] for row in batch]).dictionary_encode(),
+            ]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            written += len(batch)
+            if on_row:
+                on_row(written)
+
+    return written
+
+
+def write_export_file(cursor, path, export_format, on_row=None):
+    """Write any export format from a cursor to a file"""
+    if export_format == 'parquet':
+        return write_parquet(cursor, path, on_row=on_row)
+
+    with open(path, 'wb') as f:
+        for chunk in iter_export(cursor, export_format, on_row=on_row):
+            f.write(chunk)
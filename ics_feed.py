@@ -0,0 +1,62 @@
+"""
+iCalendar (.ics) feed of a user's office plans
+Each response becomes an all-day event so Outlook / Google Calendar show
+where the user will be working.
+"""
+
+from datetime import timedelta
+
+
+def _escape(text):
+    """Escape a TEXT value (RFC 5545 3.3.11)"""
+    return (text.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def _fold(line):
+    """Fold content lines longer than 75 octets"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    while len(encoded) > 75:
+        cut = 75 if not parts else 74  # continuation lines start with a space
+        # Don't split a multi-byte character
+        while cut > 0 and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+    parts.append(encoded.decode('utf-8'))
+    return '\r\n '.join(parts)
+
+
+def build_ics(calendar_name, rows, generated_at, domain='office-tracker'):
+    """Build the feed from rows with user_id, date, name, emoji and desk_label"""
+    stamp = generated_at.strftime('%Y%m%dT%H%M%SZ')
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Hybrid Office Tracker//Office Plans//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_escape(calendar_name)}',
+        # Hint for clients that honour it; conditional requests keep polling cheap anyway
+        'REFRESH-INTERVAL;VALUE=DURATION:PT1H',
+        'X-PUBLISHED-TTL:PT1H',
+    ]
+    for row in rows:
+        summary = f"{row['emoji']} {row['name']}"
+        if row.get('desk_label'):
+            summary += f" (desk {row['desk_label']})"
+        lines += [
+            'BEGIN:VEVENT',
+            f"UID:{row['user_id']}-{row['date'].strftime('%Y%m%d')}@{domain}",
+            f'DTSTAMP:{stamp}',
+            f"DTSTART;VALUE=DATE:{row['date'].strftime('%Y%m%d')}",
+            f"DTEND;VALUE=DATE:{(row['date'] + timedelta(days=1)).strftime('%Y%m%d')}",
+            f'SUMMARY:{_escape(summary)}',
+            'TRANSP:TRANSPARENT',
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    return ('\r\n'.join(_fold(line) for line in lines) + '\r\n').encode('utf-8')
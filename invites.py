@@ -0,0 +1,20 @@
+"""
+Single-use invite links for users who haven't chosen a password yet
+Only a SHA-256 of each token is stored; the raw token exists once, in the
+link handed to the admin, and stops working when used or when it expires.
+"""
+
+import hashlib
+import secrets
+from datetime import datetime, timedelta
+
+
+def hash_token(token):
+    """Tokens that grant access are stored as their SHA-256"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def new_invite(days):
+    """(token, token hash, expiry in UTC) for a fresh invite"""
+    token = secrets.token_urlsafe(32)
+    return token, hash_token(token), datetime.utcnow() + timedelta(days=days)
@@ -0,0 +1,302 @@
+"""
+Background job queue backed by PostgreSQL
+Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED so any number of
+worker processes can pull from the same table without double-processing.
+On the embedded SQLite backend writers are serialised, so a plain
+UPDATE ... RETURNING claims a job atomically; workers poll instead of LISTENing.
+
+A running job's worker refreshes heartbeat_at while the handler runs. Jobs
+whose heartbeat goes stale (the worker was killed or its host died) are put
+back in the queue, or failed once they have used up their attempts.
+
+Job files (uploads, exports, invite lists) are written to ARTIFACT_DIR. When the
+web and worker services don't share a disk, ARTIFACT_STORE=database also keeps a
+copy in the job_artifacts table, and each side copies down what the other wrote.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+
+# Where finished job files (exports etc.) are written
+ARTIFACT_DIR = os.environ.get('ARTIFACT_DIR', os.path.join('data', 'artifacts'))
+
+# 'disk' (ARTIFACT_DIR is shared by web and workers) or 'database'
+ARTIFACT_STORE = os.environ.get('ARTIFACT_STORE', 'disk')
+
+# Registered job handlers: job type -> callable(job, progress).
+# A handler returns an artifact filename, a dict with 'artifact' and/or
+# 'result' (JSON-serialisable summary), or None.
+JOB_HANDLERS = {}
+
+# Postgres workers skip rows another worker is claiming; SQLite has one writer at a time
+CLAIM_LOCK = {'postgresql': 'FOR UPDATE SKIP LOCKED', 'sqlite': ''}
+
+# A running job whose heartbeat is older than this many seconds is presumed dead
+STALE_BEFORE = {
+    'postgresql': "CURRENT_TIMESTAMP - %s * INTERVAL '1 second'",
+    'sqlite': "datetime('now', '-' || %s || ' seconds')",
+}
+
+
+def job_handler(job_type):
+    """Register a function as the handler for a job type"""
+    def decorator(f):
+        JOB_HANDLERS[job_type] = f
+        return f
+    return decorator
+
+
+def init_jobs_table(cursor):
+    """Create the jobs table and its claim index"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id SERIAL PRIMARY KEY,
+            team_id INTEGER REFERENCES teams(id),
+            user_id INTEGER REFERENCES users(id),
+            type VARCHAR(50) NOT NULL,
+            params JSONB NOT NULL DEFAULT '{}',
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            progress INTEGER NOT NULL DEFAULT 0,
+            artifact VARCHAR(255),
+            error TEXT,
+            worker VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('ALTER TABLE jobs ADD COLUMN IF NOT EXISTS result JSONB')
+    # Liveness of running jobs, and how many times each has been claimed
+    cursor.execute('ALTER TABLE jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP')
+    cursor.execute('ALTER TABLE jobs ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0')
+    # Partial index keeps the claim query cheap no matter how much history piles up
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_jobs_queued
+        ON jobs(created_at) WHERE status = 'queued'
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_team ON jobs(team_id, created_at)')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_jobs_running
+        ON jobs(heartbeat_at) WHERE status = 'running'
+    ''')
+    # Shared copies of job files for ARTIFACT_STORE=database
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_artifacts (
+            filename VARCHAR(255) PRIMARY KEY,
+            body BYTEA NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def enqueue_job(conn, job_type, params=None, team_id=None, user_id=None):
+    """Queue a job and return its id (caller commits)"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO jobs (team_id, user_id, type, params)
+        VALUES (%s, %s, %s, %s)
+        RETURNING id
+    ''', (team_id, user_id, job_type, json.dumps(params or {})))
+    job_id = cursor.fetchone()['id']
+    # Wake idle workers instead of waiting for their next poll
+    if conn.dialect == 'postgresql':
+        cursor.execute('NOTIFY jobs_queued')
+    return job_id
+
+
+def requeue_stale_jobs(conn, lease_seconds, max_attempts):
+    """Put jobs of dead workers back in the queue (or fail them after max_attempts)"""
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        UPDATE jobs
+        SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'queued' END,
+            error = CASE WHEN attempts >= %s THEN 'Worker stopped responding' ELSE error END,
+            finished_at = CASE WHEN attempts >= %s THEN CURRENT_TIMESTAMP ELSE finished_at END,
+            worker = NULL
+        WHERE status = 'running' AND heartbeat_at < {STALE_BEFORE[conn.dialect]}
+        RETURNING id, status
+    ''', (max_attempts, max_attempts, max_attempts, lease_seconds))
+    for job in cursor.fetchall():
+        print(f"♻️  Job {job['id']} lost its worker: {job['status']}")
+    conn.commit()
+
+
+def claim_job(conn, worker_name, lease_seconds=120, max_attempts=3):
+    """Atomically claim the oldest queued job, or return None"""
+    requeue_stale_jobs(conn, lease_seconds, max_attempts)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        UPDATE jobs SET status = 'running', started_at = CURRENT_TIMESTAMP, worker = %s,
+            heartbeat_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE status = 'queued'
+            ORDER BY created_at
+            {CLAIM_LOCK[conn.dialect]}
+            LIMIT 1
+        )
+        RETURNING *
+    ''', (worker_name,))
+    job = cursor.fetchone()
+    conn.commit()
+    return job
+
+
+def set_progress(conn, job_id, progress):
+    """Record job progress (0-100)"""
+    cursor = conn.cursor()
+    cursor.execute('UPDATE jobs SET progress = %s WHERE id = %s', (int(progress), job_id))
+    conn.commit()
+
+
+def finish_job(conn, job_id, artifact=None, error=None, result=None):
+    """Mark a job as done or failed"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE jobs
+        SET status = %s, progress = CASE WHEN %s IS NULL THEN 100 ELSE progress END,
+            artifact = %s, error = %s, result = %s, finished_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+    ''', ('failed' if error else 'done', error, artifact, error,
+          json.dumps(result) if result is not None else None, job_id))
+    conn.commit()
+
+
+def artifact_path(filename):
+    """Absolute path of a file in the artifact store"""
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    return os.path.join(os.path.abspath(ARTIFACT_DIR), os.path.basename(filename))
+
+
+def publish_artifact(conn, filename, keep_local=True):
+    """
+    Share a file just written to artifact_path with the other services (caller commits).
+    keep_local=False drops this host's copy once it is in the database.
+    """
+    if ARTIFACT_STORE != 'database':
+        return
+    path = artifact_path(filename)
+    with open(path, 'rb') as f:
+        body = f.read()
+    conn.cursor().execute('''
+        INSERT INTO job_artifacts (filename, body) VALUES (%s, %s)
+        ON CONFLICT (filename) DO UPDATE SET body = EXCLUDED.body
+    ''', (os.path.basename(filename), body))
+    if not keep_local:
+        os.remove(path)
+
+
+def fetch_artifact(conn, filename):
+    """Local path of an artifact, copied down from the database if another host wrote it"""
+    path = artifact_path(filename)
+    if ARTIFACT_STORE == 'database' and not os.path.exists(path):
+        cursor = conn.cursor()
+        cursor.execute('SELECT body FROM job_artifacts WHERE filename = %s', (os.path.basename(filename),))
+        row = cursor.fetchone()
+        if row is None:
+            raise FileNotFoundError(f"Artifact {filename} is not in the database")
+        # Write under a temporary name so a concurrent reader never sees half a file
+        partial = f"{path}.{os.getpid()}.part"
+        with open(partial, 'wb') as f:
+            f.write(row['body'])
+        os.replace(partial, path)
+    return path
+
+
+def discard_artifact(conn, filename):
+    """Delete an artifact locally and from the database (caller commits)"""
+    path = artifact_path(filename)
+    if os.path.exists(path):
+        os.remove(path)
+    if ARTIFACT_STORE == 'database':
+        conn.cursor().execute('DELETE FROM job_artifacts WHERE filename = %s', (os.path.basename(filename),))
+
+
+def heartbeat(get_db, job_id, interval, stop):
+    """Keep a running job's heartbeat fresh until stop is set"""
+    while not stop.wait(interval):
+        conn = get_db()
+        try:
+            conn.cursor().execute('''
+                UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND status = 'running'
+            ''', (job_id,))
+            conn.commit()
+        except Exception as e:
+            print(f"⚠️  Heartbeat for job {job_id} failed: {e}")
+        finally:
+            conn.close()
+
+
+def run_job(get_db, job, lease_seconds=120):
+    """Run one claimed job through its handler"""
+    conn = get_db()
+    # Several beats per lease, so one slow write doesn't get the job requeued
+    stop = threading.Event()
+    threading.Thread(target=heartbeat, args=(get_db, job['id'], lease_seconds / 4, stop),
+                     daemon=True).start()
+    try:
+        handler = JOB_HANDLERS.get(job['type'])
+        if handler is None:
+            finish_job(conn, job['id'], error=f"Unknown job type: {job['type']}")
+            return
+
+        last_reported = [0]
+
+        def progress(pct):
+            # Only write when progress moves, to avoid an UPDATE per row
+            pct = int(pct)
+            if pct > last_reported[0]:
+                last_reported[0] = pct
+                set_progress(conn, job['id'], pct)
+
+        outcome = handler(job, progress)
+        if isinstance(outcome, dict):
+            finish_job(conn, job['id'], artifact=outcome.get('artifact'), result=outcome.get('result'))
+        else:
+            finish_job(conn, job['id'], artifact=outcome)
+        print(f"✅ Job {job['id']} ({job['type']}) finished")
+    except Exception as e:
+        conn.rollback()
+        finish_job(conn, job['id'], error=f"{e}\n{traceback.format_exc()}")
+        print(f"❌ Job {job['id']} ({job['type']}) failed: {e}")
+    finally:
+        stop.set()
+        conn.close()
+
+
+def run_worker(get_db, poll_interval=5.0, lease_seconds=120, max_attempts=3):
+    """Worker loop: claim and run jobs forever (run one per process)"""
+    import select
+
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+    listen_conn = get_db()
+    if listen_conn.dialect == 'sqlite':
+        listen_conn.close()
+        listen_conn = None
+    else:
+        listen_conn.autocommit = True
+        listen_conn.cursor().execute('LISTEN jobs_queued')
+
+    print(f"👷 Job worker {worker_name} started")
+    while True:
+        conn = get_db()
+        try:
+            job = claim_job(conn, worker_name, lease_seconds, max_attempts)
+        finally:
+            conn.close()
+
+        if job:
+            run_job(get_db, job, lease_seconds)
+            continue
+
+        # Queue is empty: sleep until NOTIFY or the poll interval elapses
+        if listen_conn is None:
+            time.sleep(poll_interval)
+        elif select.select([listen_conn], [], [], poll_interval) != ([], [], []):
+            listen_conn.poll()
+            listen_conn.notifies.clear()
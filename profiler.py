@@ -0,0 +1,220 @@
+"""
+On-demand request profiler
+An admin adds ?_profile=1 (or an X-Profile: 1 header) to any request, or a
+configured fraction of requests is picked at random. While a profiled request
+runs, one background thread samples its stack every few milliseconds and every
+SQL statement it sends is timed. The result is stored as folded stacks (the
+input format of flamegraph.pl and speedscope) in a small table that keeps only
+the newest profiles, so profiles from every worker process show up in /admin.
+
+When no request is being profiled the sampler thread is parked and the only
+cost is one dict lookup per SQL statement.
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+import psycopg2.extras
+from flask import g, request, session
+
+from storage import SQLiteCursor
+
+# Stop collecting after this many samples / statements (long streamed exports)
+MAX_SAMPLES = 20000
+MAX_STATEMENTS = 2000
+
+# Profiles currently running: thread id -> RequestProfile
+_active = {}
+
+
+def init_profiler_table(cursor):
+    """Create the table profiles are kept in"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS request_profiles (
+            id SERIAL PRIMARY KEY,
+            team_id INTEGER REFERENCES teams(id),
+            method VARCHAR(10) NOT NULL,
+            endpoint VARCHAR(255) NOT NULL,
+            status INTEGER,
+            duration_ms REAL NOT NULL,
+            sql_ms REAL NOT NULL,
+            sql_count INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            trigger VARCHAR(20) NOT NULL,
+            folded TEXT NOT NULL,
+            statements JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+class RequestProfile:
+    def __init__(self, trigger):
+        self.trigger = trigger
+        self.started = time.perf_counter()
+        self.stacks = Counter()
+        self.samples = 0
+        self.statements = []
+        self.sql_seconds = 0.0
+        self.sql_count = 0
+
+    def add_sql(self, query, seconds):
+        self.sql_seconds += seconds
+        self.sql_count += 1
+        if len(self.statements) < MAX_STATEMENTS:
+            self.statements.append((' '.join(str(query).split()), seconds))
+
+
+def _frame_name(code):
+    # Parent directory too: flask/app.py and our app.py are different files
+    path = os.path.join(os.path.basename(os.path.dirname(code.co_filename)), os.path.basename(code.co_filename))
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+def _fold(frame):
+    """Stack as 'root;...;leaf'"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler:
+    """One daemon thread sampling every profiled thread; idle when there are none"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id, profile):
+        with self._lock:
+            _active[thread_id] = profile
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def stop(self, thread_id):
+        return _active.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            if not _active:
+                self._wake.clear()
+                self._wake.wait()
+                continue
+            frames = sys._current_frames()
+            for thread_id, profile in list(_active.items()):
+                frame = frames.get(thread_id)
+                if frame is not None and profile.samples < MAX_SAMPLES:
+                    profile.stacks[_fold(frame)] += 1
+                    profile.samples += 1
+            del frames
+            time.sleep(self.interval)
+
+
+def _timed(execute, query, vars):
+    profile = _active.get(threading.get_ident())
+    if profile is None:
+        return execute(query, vars)
+    started = time.perf_counter()
+    try:
+        return execute(query, vars)
+    finally:
+        profile.add_sql(query, time.perf_counter() - started)
+
+
+class ProfilingCursor(psycopg2.extras.DictCursor):
+    """DictCursor that times statements while its thread is being profiled"""
+
+    def execute(self, query, vars=None):
+        return _timed(super().execute, query, vars)
+
+
+class SQLiteProfilingCursor(SQLiteCursor):
+    """The same for the embedded SQLite backend"""
+
+    def execute(self, query, vars=None):
+        return _timed(super().execute, query, vars)
+
+
+def save_profile(cursor, profile, method, endpoint, status, team_id, keep):
+    """Store a finished profile and drop the oldest beyond `keep`"""
+    duration = time.perf_counter() - profile.started
+    folded = '\n'.join(f"{stack} {count}" for stack, count in profile.stacks.most_common())
+    cursor.execute('''
+        INSERT INTO request_profiles
+            (team_id, method, endpoint, status, duration_ms, sql_ms, sql_count, samples, trigger,
+             folded, statements)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING id
+    ''', (team_id, method, endpoint, status, duration * 1000, profile.sql_seconds * 1000,
+          profile.sql_count, profile.samples, profile.trigger, folded,
+          json.dumps([[sql, round(seconds * 1000, 3)] for sql, seconds in profile.statements])))
+    profile_id = cursor.fetchone()['id']
+    cursor.execute('DELETE FROM request_profiles WHERE id <= %s', (profile_id - keep,))
+    return profile_id
+
+
+def init_profiler(app, get_db, sample_rate=0.0, interval=0.005, keep=50):
+    """Install the request hooks; profiles are written with connections from get_db"""
+    sampler = Sampler(interval)
+
+    @app.before_request
+    def start_profile():
+        if request.endpoint == 'static':
+            return
+        if request.args.get('_profile') or request.headers.get('X-Profile'):
+            # On demand only for admins: profiling costs the request some time
+            if not session.get('is_admin'):
+                return
+            trigger = 'on demand'
+        elif sample_rate and random.random() < sample_rate:
+            trigger = 'sampled'
+        else:
+            return
+        g.profile = RequestProfile(trigger)
+        g.profile_team_id = session.get('team_id')
+        sampler.start(threading.get_ident(), g.profile)
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        # The route rule, not the path: paths can carry secrets (calendar tokens)
+        endpoint = request.url_rule.rule if request.url_rule else request.path
+        details = (request.method, endpoint, response.status_code, g.pop('profile_team_id', None))
+        thread_id = threading.get_ident()
+
+        def finish():
+            sampler.stop(thread_id)
+            conn = get_db()
+            try:
+                save_profile(conn.cursor(), profile, *details, keep=keep)
+                conn.commit()
+            except Exception as e:
+                print(f"⚠️  Could not save request profile: {e}")
+            finally:
+                conn.close()
+
+        # Streamed responses do their work after this hook: finish when the stream closes
+        if response.is_streamed:
+            response.call_on_close(finish)
+        else:
+            finish()
+        return response
+
+    @app.teardown_request
+    def discard_profile(exc):
+        # A request that died before after_request must not stay in the sampler
+        if g.pop('profile', None) is not None:
+            sampler.stop(threading.get_ident())
@@ -0,0 +1,207 @@
+"""
+Token-bucket rate limiting shared by every worker process
+Buckets live in an UNLOGGED Postgres table, so all gunicorn workers (and
+hosts) see the same counts without Redis or another service. Each limited
+request refills and takes a token from all of its buckets (per route and IP,
+per route and signed-in user, per route and account being logged into) in one
+upsert: a single round trip, no lock held across statements. Over an IP or user
+limit the request gets 429 with Retry-After. Over an account limit it is only
+slowed down by account_delay seconds: anyone can type someone else's email, so
+refusing would let strangers lock the real user out. On the embedded SQLite
+backend the buckets are an ordinary table in the same file.
+
+Limits are configured per endpoint as "N/period", e.g. "10/minute": a bucket
+holds N tokens and refills N per period. Only state-changing methods count.
+"""
+
+import math
+import time
+
+from flask import jsonify, request, session
+from werkzeug.exceptions import TooManyRequests
+
+from storage import DatabaseError
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+LIMITED_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+# Forgotten buckets are full anyway; sweep them this often per process
+SWEEP_INTERVAL = 600
+
+# Refill since the last hit, capped at capacity (times are epoch seconds from Postgres)
+_REFILL = 'LEAST(EXCLUDED.capacity, b.tokens + (EXCLUDED.updated_at - b.updated_at) * EXCLUDED.rate)'
+
+HIT_SQL = f'''
+    INSERT INTO rate_limit_buckets AS b (key, capacity, rate, tokens, updated_at, allowed)
+    SELECT key, capacity, rate, capacity - 1, EXTRACT(EPOCH FROM clock_timestamp()), TRUE
+    FROM unnest(%s::text[], %s::float8[], %s::float8[]) AS r(key, capacity, rate)
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = {_REFILL} - CASE WHEN {_REFILL} >= 1 THEN 1 ELSE 0 END,
+        allowed = {_REFILL} >= 1,
+        capacity = EXCLUDED.capacity,
+        rate = EXCLUDED.rate,
+        updated_at = EXCLUDED.updated_at
+    RETURNING key, allowed, tokens, rate
+'''
+
+# SQLite: buckets arrive as one JSON array of [key, capacity, rate]; the WHERE
+# keeps the parser from reading ON CONFLICT as a join constraint
+_SQLITE_NOW = "(julianday('now') - 2440587.5) * 86400.0"
+_SQLITE_REFILL = 'MIN(EXCLUDED.capacity, b.tokens + (EXCLUDED.updated_at - b.updated_at) * EXCLUDED.rate)'
+
+SQLITE_HIT_SQL = f'''
+    INSERT INTO rate_limit_buckets AS b (key, capacity, rate, tokens, updated_at, allowed)
+    SELECT value ->> 0, value ->> 1, value ->> 2, (value ->> 1) - 1, {_SQLITE_NOW}, TRUE
+    FROM json_each(%s) WHERE TRUE
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = {_SQLITE_REFILL} - CASE WHEN {_SQLITE_REFILL} >= 1 THEN 1 ELSE 0 END,
+        allowed = {_SQLITE_REFILL} >= 1,
+        capacity = EXCLUDED.capacity,
+        rate = EXCLUDED.rate,
+        updated_at = EXCLUDED.updated_at
+    RETURNING key, allowed, tokens, rate
+'''
+
+SWEEP_SQL = {
+    'postgresql': '''
+        DELETE FROM rate_limit_buckets
+        WHERE updated_at + capacity / rate < EXTRACT(EPOCH FROM clock_timestamp())
+    ''',
+    'sqlite': f'''
+        DELETE FROM rate_limit_buckets
+        WHERE updated_at + capacity / rate < {_SQLITE_NOW}
+    ''',
+}
+
+
+def init_rate_limit_table(cursor):
+    """Create the bucket table (unlogged: losing it in a crash just resets the limits)"""
+    cursor.execute('''
+        CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+            key TEXT PRIMARY KEY,
+            capacity DOUBLE PRECISION NOT NULL,
+            rate DOUBLE PRECISION NOT NULL,
+            tokens DOUBLE PRECISION NOT NULL,
+            updated_at DOUBLE PRECISION NOT NULL,
+            allowed BOOLEAN NOT NULL
+        )
+    ''')
+
+
+def parse_rate(limit):
+    """'10/minute' -> (capacity, tokens per second)"""
+    count, _, period = limit.partition('/')
+    seconds = PERIODS[period.strip().rstrip('s')]
+    capacity = float(count)
+    return capacity, capacity / seconds
+
+
+class RateLimiter:
+    def __init__(self, get_db, routes, proxy_hops=0, enabled=True, account_delay=2.0):
+        self.get_db = get_db
+        self.proxy_hops = proxy_hops
+        self.enabled = enabled
+        self.account_delay = account_delay
+        # endpoint -> {'ip': (capacity, rate), 'user': (capacity, rate), 'account': (capacity, rate)}
+        self.routes = {}
+        for endpoint, rules in routes.items():
+            self.routes[endpoint] = {scope: parse_rate(rules[f'per_{scope}'])
+                                     for scope in ('ip', 'user', 'account') if rules.get(f'per_{scope}')}
+        self.last_sweep = time.monotonic()
+
+    def client_ip(self):
+        """The caller's address, read from X-Forwarded-For only behind known proxies"""
+        if self.proxy_hops:
+            forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',')
+                         if part.strip()]
+            if len(forwarded) >= self.proxy_hops:
+                return forwarded[-self.proxy_hops]
+        return request.remote_addr or 'unknown'
+
+    def client_user(self):
+        """Id of the signed-in user, if any"""
+        return str(session['user_id']) if session.get('user_id') else None
+
+    def client_account(self):
+        """The account a login form names, from whichever IP"""
+        # Longest valid address; keeps junk input from making oversized keys
+        email = (request.form.get('email') or '').strip().lower()[:254]
+        return email or None
+
+    def buckets_for_request(self):
+        rules = self.routes.get(request.endpoint)
+        if not rules or request.method not in LIMITED_METHODS:
+            return []
+        buckets = []
+        if 'ip' in rules:
+            buckets.append((f"{request.endpoint}:ip:{self.client_ip()}", *rules['ip']))
+        user = self.client_user()
+        if 'user' in rules and user:
+            buckets.append((f"{request.endpoint}:user:{user}", *rules['user']))
+        account = self.client_account()
+        if 'account' in rules and account:
+            buckets.append((f"{request.endpoint}:account:{account}", *rules['account']))
+        return buckets
+
+    def hit(self, buckets):
+        """Take a token from each bucket; {key: seconds until it refills} for those that were empty"""
+        # Same key order everywhere, so concurrent upserts can't deadlock
+        buckets = sorted(buckets)
+        conn = self.get_db()
+        try:
+            # A single statement needs no BEGIN/COMMIT: one round trip per request
+            conn.autocommit = True
+            cursor = conn.cursor()
+            if conn.dialect == 'sqlite':
+                cursor.execute(SQLITE_HIT_SQL, ([list(bucket) for bucket in buckets],))
+            else:
+                keys, capacities, rates = zip(*buckets)
+                cursor.execute(HIT_SQL, (list(keys), list(capacities), list(rates)))
+            rows = cursor.fetchall()
+            if time.monotonic() - self.last_sweep > SWEEP_INTERVAL:
+                self.last_sweep = time.monotonic()
+                cursor.execute(SWEEP_SQL[conn.dialect])
+        finally:
+            # Back to normal before it returns to the pool
+            conn.autocommit = False
+            conn.close()
+        return {row['key']: (1 - row['tokens']) / row['rate'] for row in rows if not row['allowed']}
+
+    def check(self):
+        """before_request hook: None to continue, or a 429 response"""
+        if not self.enabled:
+            return None
+        buckets = self.buckets_for_request()
+        if not buckets:
+            return None
+        try:
+            empty = self.hit(buckets)
+        except DatabaseError as e:
+            # Fail open: the route itself will report a database that is down
+            print(f"⚠️  Rate limiter unavailable: {e}")
+            return None
+        refused = [wait for key, wait in empty.items() if ':account:' not in key]
+        if not refused:
+            if empty:
+                # Guessing at one account from many IPs: slow it down, but let the owner in
+                time.sleep(self.account_delay)
+            return None
+        retry_after = max(1, math.ceil(max(refused)))
+
+        message = f"Too many requests. Please try again in {retry_after} seconds."
+        if request.accept_mimetypes.best == 'application/json':
+            response = jsonify({'success': False, 'message': message})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        raise TooManyRequests(message, retry_after=retry_after)
+
+
+def init_rate_limiter(app, get_db, settings):
+    """Install the limiter from the rate_limits config section"""
+    limiter = RateLimiter(get_db, settings.get('routes', {}),
+                          proxy_hops=settings.get('proxy_hops', 0),
+                          enabled=settings.get('enabled', True),
+                          account_delay=settings.get('account_delay', 2.0))
+    app.before_request(limiter.check)
+    return limiter
@@ -0,0 +1,109 @@
+"""
+Best-office-day recommender
+Scores (day, office) candidates for a group by expected co-attendance and
+remaining capacity. Everyone's habits are a users x weekdays x locations
+tensor built from their history, so scoring is a handful of NumPy operations
+regardless of group size.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+
+
+def weekday_patterns(history, user_index, location_index, smoothing=0.5):
+    """Per-user weekday location probabilities from (user_id, weekday, location_id, count) rows"""
+    counts = np.zeros((len(user_index), 7, len(location_index)), dtype=np.float32)
+    # Totals include days spent at locations outside the index (WFH, Day Off)
+    totals = np.zeros((len(user_index), 7, 1), dtype=np.float32)
+    for user_id, weekday, location_id, count in history:
+        u = user_index.get(user_id)
+        if u is None:
+            continue
+        totals[u, int(weekday), 0] += count
+        l = location_index.get(location_id)
+        if l is not None:
+            counts[u, int(weekday), l] += count
+
+    # Additive smoothing so sparse history doesn't turn one visit into certainty;
+    # users with no history at all contribute nothing
+    probs = (counts + smoothing) / (totals + smoothing * (counts.shape[2] + 1))
+    probs[np.broadcast_to(totals == 0, probs.shape)] = 0.0
+    return probs
+
+
+def recommend_days(history, plans, booked, capacities, user_ids, location_ids, days, top=5):
+    """
+    Rank (day, location) candidates for a group.
+
+    history:    [(user_id, weekday 0-6, location_id, count)] past responses
+    plans:      [(user_id, date, location_id)] responses already set in the window
+    booked:     {(date, location_id): people} already booked there from outside the group
+    capacities: {location_id: seats or None for unlimited}
+    """
+    if not user_ids or not location_ids or not days:
+        return []
+
+    user_index = {user_id: i for i, user_id in enumerate(user_ids)}
+    location_index = {location_id: i for i, location_id in enumerate(location_ids)}
+    day_index = {day: i for i, day in enumerate(days)}
+
+    # users x weekdays x locations -> users x days x locations
+    probs = weekday_patterns(history, user_index, location_index)
+    weekdays = np.array([day.weekday() for day in days])
+    presence = probs[:, weekdays, :]
+
+    # Plans already made replace the guess for that user and day
+    planned = np.zeros((len(user_ids), len(days)), dtype=bool)
+    planned_at = np.zeros_like(presence)
+    for user_id, day, location_id in plans:
+        u, d = user_index.get(user_id), day_index.get(day)
+        if u is None or d is None:
+            continue
+        planned[u, d] = True
+        l = location_index.get(location_id)
+        if l is not None:
+            planned_at[u, d, l] = 1.0
+    presence = np.where(planned[:, :, None], planned_at, presence)
+
+    # Expected group members per (day, location)
+    expected = presence.sum(axis=0)
+
+    capacity = np.array([np.inf if capacities.get(l) is None else capacities[l] for l in location_ids],
+                        dtype=np.float64)
+    outside = np.zeros((len(days), len(location_ids)))
+    for (day, location_id), people in booked.items():
+        d, l = day_index.get(day), location_index.get(location_id)
+        if d is not None and l is not None:
+            outside[d, l] = people
+    remaining = np.maximum(capacity[None, :] - outside, 0)
+
+    # Co-attendance, discounted by the share of the group that would still get a seat
+    fits = np.minimum(1.0, remaining / np.maximum(expected, 1.0))
+    score = expected * fits
+
+    best = np.argsort(score, axis=None)[::-1][:top]
+    results = []
+    for flat in best:
+        d, l = np.unravel_index(flat, score.shape)
+        if score[d, l] <= 0:
+            break
+        results.append({
+            'date': days[d],
+            'location_id': location_ids[l],
+            'expected_attendance': round(float(expected[d, l]), 1),
+            'remaining_capacity': None if np.isinf(remaining[d, l]) else int(remaining[d, l]),
+            'score': round(float(score[d, l]), 2)
+        })
+    return results
+
+
+def candidate_days(start, end, skip_weekends=True):
+    """Dates in start..end, optionally weekdays only"""
+    days = []
+    day = start
+    while day <= end:
+        if not skip_weekends or day.weekday() < 5:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
@@ -0,0 +1,798 @@
+"""
+Repositories: every query the routes and batch jobs run, grouped by table
+Routes ask for data (`repos.responses.day_summary(team_id, day)`) instead of
+embedding SQL, so the same code runs on PostgreSQL and the embedded SQLite
+backend (storage.py). Most queries are plain SQL both understand; where the
+syntax differs (arrays, weekday extraction, sequences, string aggregation) the
+SQLite text is declared next to the Postgres one.
+
+Hot queries are registered statements (db.py), prepared once per Postgres
+connection. A repository set wraps one cursor, so everything done through it
+shares the caller's transaction; the caller commits.
+"""
+
+import psycopg2.extras
+
+from db import statement, run
+from storage import is_unique_violation, DatabaseError
+
+
+class Conflict(Exception):
+    """A write lost a race against a unique constraint (e.g. two people booking one desk)"""
+
+
+# Hot queries, declared once and executed by name (see db.py)
+USER_ROLE = statement('user_role', 'SELECT is_admin, team_id FROM users WHERE id = %s')
+USER_DAY_LOCATION = statement('user_day_location', '''
+    SELECT l.id, l.name, l.emoji, l.color, d.label as desk_label
+    FROM responses r
+    JOIN locations l ON r.location_id = l.id
+    LEFT JOIN desks d ON r.desk_id = d.id
+    WHERE r.user_id = %s AND r.date = %s
+''')
+ACTIVE_LOCATIONS = statement('active_locations', '''
+    SELECT id, name, emoji, color, capacity FROM locations WHERE is_active = TRUE
+''')
+TEAM_DAY_SUMMARY = statement('team_day_summary', '''
+    SELECT l.name, l.emoji, l.color, COUNT(*) as count
+    FROM responses r
+    JOIN locations l ON r.location_id = l.id
+    WHERE r.team_id = %s AND r.date = %s
+    GROUP BY l.id
+    ORDER BY count DESC
+''')
+TEAM_DAY_MEMBERS = statement('team_day_members', '''
+    SELECT u.name as user_name, l.name as location_name, l.emoji, l.color
+    FROM responses r
+    JOIN users u ON r.user_id = u.id
+    JOIN locations l ON r.location_id = l.id
+    WHERE r.team_id = %s AND r.date = %s AND u.is_active = TRUE
+    ORDER BY l.name, u.name
+''')
+TEAM_DAY_MISSING = statement('team_day_missing', '''
+    SELECT u.name
+    FROM users u
+    WHERE u.team_id = %s AND u.is_active = TRUE
+    AND u.id NOT IN (
+        SELECT user_id FROM responses WHERE team_id = %s AND date = %s
+    )
+    ORDER BY u.name
+''')
+TEAM_DAY_VERSION = statement('team_day_version', '''
+    SELECT COALESCE(MAX(change_seq), 0) as version,
+           (SELECT roster_version FROM teams WHERE id = %s) as roster_version
+    FROM responses
+    WHERE team_id = %s AND date = %s
+''')
+# A team's roster_version moves whenever what its day summaries show changes
+# other than through responses: members joining, leaving or being renamed, and
+# locations (shared by every team) being added or removed
+BUMP_ROSTER_VERSION = 'UPDATE teams SET roster_version = roster_version + 1 WHERE id = %s'
+BUMP_ALL_ROSTER_VERSIONS = 'UPDATE teams SET roster_version = roster_version + 1'
+UPSERT_RESPONSE = statement('upsert_response', '''
+    INSERT INTO responses (user_id, location_id, date, team_id, desk_id)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT(user_id, date)
+    DO UPDATE SET location_id = EXCLUDED.location_id, team_id = EXCLUDED.team_id, desk_id = EXCLUDED.desk_id,
+                  timestamp = CURRENT_TIMESTAMP, change_seq = nextval('responses_change_seq'),
+                  change_txid = txid_current()
+    RETURNING change_seq
+''', sqlite='''
+    INSERT INTO responses (user_id, location_id, date, team_id, desk_id, change_seq)
+    VALUES (%s, %s, %s, %s, %s, (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM responses))
+    ON CONFLICT(user_id, date)
+    DO UPDATE SET location_id = EXCLUDED.location_id, team_id = EXCLUDED.team_id, desk_id = EXCLUDED.desk_id,
+                  timestamp = CURRENT_TIMESTAMP, change_seq = EXCLUDED.change_seq
+    RETURNING change_seq
+''')
+# Outbox row for the team's webhooks, only if it has any; delivered after commit by the worker
+EMIT_LOCATION_EVENT = statement('emit_location_event', '''
+    WITH event AS (
+        INSERT INTO webhook_outbox (team_id, event_type, payload)
+        SELECT r.team_id, 'location.updated', json_build_object(
+            'change_seq', r.change_seq, 'date', r.date, 'user_id', u.id, 'user_email', u.email,
+            'user_name', u.name, 'location_id', l.id, 'location_name', l.name, 'desk_id', r.desk_id)
+        FROM responses r
+        JOIN users u ON r.user_id = u.id
+        JOIN locations l ON r.location_id = l.id
+        WHERE r.user_id = %s AND r.date = %s
+        AND EXISTS (
+            SELECT 1 FROM webhook_subscriptions s WHERE s.team_id = r.team_id AND s.is_active = TRUE
+        )
+        RETURNING id
+    )
+    SELECT pg_notify('webhook_events', '') FROM event
+''')
+SET_CALENDAR_VERSION = statement('set_calendar_version',
+                                 'UPDATE users SET calendar_version = %s WHERE id = %s')
+TEAMMATE_DESKS = statement('teammate_desks', '''
+    SELECT desk_id FROM responses
+    WHERE team_id = %s AND date = %s AND location_id = %s
+    AND desk_id IS NOT NULL AND user_id != %s
+''')
+TEAM_MEMBER_IDS = statement('team_member_ids', 'SELECT id FROM users WHERE team_id = %s AND is_active = TRUE')
+OFFICE_CAPACITIES = statement('office_capacities', '''
+    SELECT id, capacity FROM locations WHERE is_active = TRUE AND NOT (name = ANY(%s))
+''', sqlite='''
+    SELECT id, capacity FROM locations WHERE is_active = TRUE AND name NOT IN (SELECT value FROM json_each(%s))
+''')
+WEEKDAY_HISTORY = statement('weekday_history', '''
+    SELECT user_id, EXTRACT(ISODOW FROM date)::int - 1 as weekday, location_id, COUNT(*) as count
+    FROM responses
+    WHERE team_id = %s AND user_id = ANY(%s) AND date BETWEEN %s AND %s
+    GROUP BY user_id, weekday, location_id
+''', sqlite='''
+    SELECT user_id, (CAST(strftime('%%w', date) AS INTEGER) + 6) %% 7 as weekday, location_id, COUNT(*) as count
+    FROM responses
+    WHERE team_id = %s AND user_id IN (SELECT value FROM json_each(%s)) AND date BETWEEN %s AND %s
+    GROUP BY user_id, weekday, location_id
+''')
+GROUP_PLANS = statement('group_plans', '''
+    SELECT user_id, date, location_id
+    FROM responses
+    WHERE team_id = %s AND user_id = ANY(%s) AND date BETWEEN %s AND %s
+''', sqlite='''
+    SELECT user_id, date, location_id
+    FROM responses
+    WHERE team_id = %s AND user_id IN (SELECT value FROM json_each(%s)) AND date BETWEEN %s AND %s
+''')
+OUTSIDE_BOOKINGS = statement('outside_bookings', '''
+    SELECT date, location_id, COUNT(*) as people
+    FROM responses
+    WHERE date BETWEEN %s AND %s AND location_id = ANY(%s) AND NOT (user_id = ANY(%s))
+    GROUP BY date, location_id
+''', sqlite='''
+    SELECT date, location_id, COUNT(*) as people
+    FROM responses
+    WHERE date BETWEEN %s AND %s AND location_id IN (SELECT value FROM json_each(%s))
+    AND user_id NOT IN (SELECT value FROM json_each(%s))
+    GROUP BY date, location_id
+''')
+LOCATIONS_BY_ID = statement('locations_by_id', 'SELECT id, name, emoji, color FROM locations WHERE id = ANY(%s)',
+                            sqlite='''
+    SELECT id, name, emoji, color FROM locations WHERE id IN (SELECT value FROM json_each(%s))
+''')
+USER_CALENDAR = statement('user_calendar', '''
+    SELECT r.user_id, r.date, l.name, l.emoji, l.color, d.label as desk_label
+    FROM responses r
+    JOIN locations l ON r.location_id = l.id
+    LEFT JOIN desks d ON r.desk_id = d.id
+    WHERE r.user_id = %s AND r.date BETWEEN %s AND %s
+    ORDER BY r.date
+''')
+
+EXPORT_QUERY = '''
+    SELECT
+        r.date,
+        u.name as user_name,
+        u.email as user_email,
+        l.name as location_name,
+        l.emoji as location_emoji
+    FROM responses r
+    JOIN users u ON r.user_id = u.id
+    JOIN locations l ON r.location_id = l.id
+    WHERE r.team_id = %s AND r.date BETWEEN %s AND %s
+    ORDER BY r.date DESC, u.name
+'''
+
+
+def normalize_email(email):
+    """Emails are stored and looked up trimmed and lowercased"""
+    return (email or '').strip().lower()
+
+
+class Repository:
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.sqlite = cursor.connection.dialect == 'sqlite'
+
+    def fetch_one(self, sql, params=()):
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchone()
+
+    def fetch_all(self, sql, params=()):
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
+
+    def in_list(self, column):
+        """`column` matches any element of a list parameter"""
+        return f'{column} IN (SELECT value FROM json_each(%s))' if self.sqlite else f'{column} = ANY(%s)'
+
+
+class TeamRepository(Repository):
+    def ids(self):
+        return [row['id'] for row in self.fetch_all('SELECT id FROM teams ORDER BY id')]
+
+    def get(self, team_id):
+        return self.fetch_one('SELECT id FROM teams WHERE id = %s', (team_id,))
+
+    def by_name(self, name):
+        return self.fetch_one('SELECT id FROM teams WHERE name = %s', (name,))
+
+    def create(self, name):
+        """True if the team was created, False if the name is taken"""
+        self.cursor.execute('''
+            INSERT INTO teams (name) VALUES (%s)
+            ON CONFLICT (name) DO NOTHING
+        ''', (name,))
+        return self.cursor.rowcount > 0
+
+    def ensure(self, name):
+        """Id of the named team, creating it if needed"""
+        self.create(name)
+        return self.by_name(name)['id']
+
+    def feed_token_set(self, team_id):
+        row = self.fetch_one('SELECT feed_token_hash FROM teams WHERE id = %s', (team_id,))
+        return bool(row and row['feed_token_hash'])
+
+    def set_feed_token(self, team_id, token_hash):
+        self.cursor.execute('UPDATE teams SET feed_token_hash = %s WHERE id = %s', (token_hash, team_id))
+
+    def by_feed_token(self, token_hash):
+        return self.fetch_one('SELECT id FROM teams WHERE feed_token_hash = %s', (token_hash,))
+
+    def bump_roster_version(self, team_id):
+        self.cursor.execute(BUMP_ROSTER_VERSION, (team_id,))
+
+
+class UserRepository(Repository):
+    def role(self, user_id):
+        return run(self.cursor, USER_ROLE, (user_id,)).fetchone()
+
+    def active_by_email(self, email):
+        return self.fetch_one('SELECT * FROM users WHERE email = %s AND is_active = TRUE',
+                              (normalize_email(email),))
+
+    def email_exists(self, email):
+        return self.fetch_one('SELECT id FROM users WHERE email = %s', (normalize_email(email),)) is not None
+
+    def create(self, email, name, password_hash, team_id, is_admin=False, invite_token_hash=None,
+               invite_expires_at=None):
+        self.cursor.execute('''
+            INSERT INTO users (email, name, password_hash, is_admin, team_id, invite_token_hash, invite_expires_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ''', (normalize_email(email), name, password_hash, is_admin, team_id, invite_token_hash,
+              invite_expires_at))
+        self.cursor.execute(BUMP_ROSTER_VERSION, (team_id,))
+
+    def lowercase_emails(self):
+        """Lowercase emails stored as typed by older versions; returns those that would collide"""
+        self.cursor.execute('''
+            UPDATE users SET email = LOWER(email)
+            WHERE email <> LOWER(email)
+            AND NOT EXISTS (SELECT 1 FROM users other WHERE other.email = LOWER(users.email))
+        ''')
+        return [row['email'] for row in self.fetch_all('SELECT email FROM users WHERE email <> LOWER(email)')]
+
+    def by_invite(self, token_hash, now):
+        return self.fetch_one('''
+            SELECT id, name, email, is_admin, team_id FROM users
+            WHERE invite_token_hash = %s AND invite_expires_at > %s AND is_active = TRUE
+        ''', (token_hash, now))
+
+    def set_invite(self, user_id, team_id, token_hash, expires_at):
+        """Replace the pending invite of a user who hasn't chosen a password yet"""
+        return self.fetch_one('''
+            UPDATE users SET invite_token_hash = %s, invite_expires_at = %s
+            WHERE id = %s AND team_id = %s AND invite_token_hash IS NOT NULL
+            RETURNING email
+        ''', (token_hash, expires_at, user_id, team_id))
+
+    def accept_invite(self, user_id, token_hash, password_hash):
+        """Set the password and use up the invite; False if it was already used"""
+        return self.fetch_one('''
+            UPDATE users SET password_hash = %s, invite_token_hash = NULL, invite_expires_at = NULL
+            WHERE id = %s AND invite_token_hash = %s
+            RETURNING id
+        ''', (password_hash, user_id, token_hash)) is not None
+
+    def password_hash(self, user_id):
+        row = self.fetch_one('SELECT password_hash FROM users WHERE id = %s', (user_id,))
+        return row['password_hash'] if row else None
+
+    def set_password(self, user_id, password_hash):
+        self.cursor.execute('UPDATE users SET password_hash = %s WHERE id = %s', (password_hash, user_id))
+
+    def calendar_settings(self, user_id):
+        return self.fetch_one('SELECT calendar_token, is_admin, is_team_lead, morning_digest FROM users WHERE id = %s',
+                        (user_id,))
+
+    def set_calendar_token(self, user_id, token):
+        self.cursor.execute('UPDATE users SET calendar_token = %s WHERE id = %s', (token, user_id))
+
+    def set_calendar_version(self, user_id, version):
+        run(self.cursor, SET_CALENDAR_VERSION, (version, user_id))
+
+    def by_calendar_token(self, token):
+        return self.fetch_one('''
+            SELECT id, name, calendar_version
+            FROM users
+            WHERE calendar_token = %s AND is_active = TRUE
+        ''', (token,))
+
+    def toggle_morning_digest(self, user_id):
+        """Flip the subscription; returns whether the user is now subscribed"""
+        return self.fetch_one('UPDATE users SET morning_digest = NOT morning_digest WHERE id = %s RETURNING morning_digest',
+                        (user_id,))['morning_digest']
+
+    def team(self, team_id):
+        return self.fetch_all('''
+            SELECT id, email, name, is_admin, is_team_lead, is_active, created_at,
+                   invite_token_hash IS NOT NULL as invite_pending
+            FROM users
+            WHERE team_id = %s
+            ORDER BY name
+        ''', (team_id,))
+
+    def count_active(self, team_id):
+        return self.fetch_one('SELECT COUNT(*) as total FROM users WHERE team_id = %s AND is_active = TRUE',
+                        (team_id,))['total']
+
+    def toggle_active(self, user_id, team_id):
+        self.cursor.execute('UPDATE users SET is_active = NOT is_active WHERE id = %s AND team_id = %s',
+                            (user_id, team_id))
+        self.cursor.execute(BUMP_ROSTER_VERSION, (team_id,))
+
+    def toggle_team_lead(self, user_id, team_id):
+        self.cursor.execute('UPDATE users SET is_team_lead = NOT is_team_lead WHERE id = %s AND team_id = %s',
+                            (user_id, team_id))
+
+    def active_ids(self, team_id):
+        """Active user ids in a team"""
+        return [row['id'] for row in run(self.cursor, TEAM_MEMBER_IDS, (team_id,)).fetchall()]
+
+    def active_members(self, team_id, user_ids):
+        """Which of user_ids are active members of the team"""
+        return [row['id'] for row in self.fetch_all(f'''
+            SELECT id FROM users WHERE team_id = %s AND {self.in_list('id')} AND is_active = TRUE
+        ''', (team_id, list(user_ids)))]
+
+    def members(self, team_id, user_ids):
+        """Id and name of those of user_ids in the team"""
+        return self.fetch_all(f"SELECT id, name FROM users WHERE team_id = %s AND {self.in_list('id')}",
+                        (team_id, list(user_ids)))
+
+    def active_names(self, user_ids):
+        return {row['id']: row['name'] for row in self.fetch_all(f'''
+            SELECT id, name FROM users WHERE {self.in_list('id')} AND is_active = TRUE
+        ''', (list(user_ids),))}
+
+    def without_response(self, team_id, day):
+        """Active team members who haven't set a location for the day"""
+        return self.fetch_all('''
+            SELECT u.id, u.name, u.email
+            FROM users u
+            WHERE u.team_id = %s AND u.is_active = TRUE
+            AND u.id NOT IN (
+                SELECT user_id FROM responses WHERE team_id = %s AND date = %s
+            )
+            ORDER BY u.name
+        ''', (team_id, team_id, day))
+
+    def digest_recipients(self, team_id=None):
+        """Subscribed admins and team leads (of one team, or all), with their team name"""
+        return self.fetch_all('''
+            SELECT u.id, u.email, u.name, u.team_id, t.name as team_name
+            FROM users u
+            JOIN teams t ON u.team_id = t.id
+            WHERE u.is_active = TRUE AND u.morning_digest = TRUE
+            AND (u.is_admin = TRUE OR u.is_team_lead = TRUE)
+            AND (%s IS NULL OR u.team_id = %s)
+            ORDER BY u.team_id, u.id
+        ''', (team_id, team_id))
+
+    def active_counts(self, team_ids):
+        """Team id -> active members"""
+        return {row['team_id']: row['members'] for row in self.fetch_all(f'''
+            SELECT team_id, COUNT(*) as members
+            FROM users
+            WHERE {self.in_list('team_id')} AND is_active = TRUE
+            GROUP BY team_id
+        ''', (list(team_ids),))}
+
+    def assign_team(self, team_id):
+        """Give users created before teams existed a team"""
+        self.cursor.execute('UPDATE users SET team_id = %s WHERE team_id IS NULL', (team_id,))
+        if self.cursor.rowcount > 0:
+            self.cursor.execute(BUMP_ROSTER_VERSION, (team_id,))
+
+
+class LocationRepository(Repository):
+    def active(self):
+        return run(self.cursor, ACTIVE_LOCATIONS).fetchall()
+
+    def active_details(self):
+        return self.fetch_all('SELECT * FROM locations WHERE is_active = TRUE')
+
+    def all(self):
+        return self.fetch_all('SELECT * FROM locations ORDER BY name')
+
+    def by_ids(self, location_ids):
+        """Location id -> row"""
+        return {row['id']: row for row in run(self.cursor, LOCATIONS_BY_ID, (list(location_ids),)).fetchall()}
+
+    def office_capacities(self, non_office_names):
+        """Office location id -> seat limit (None for unlimited)"""
+        run(self.cursor, OFFICE_CAPACITIES, (list(non_office_names),))
+        return {row['id']: row['capacity'] for row in self.cursor.fetchall()}
+
+    def ensure(self, name, emoji, color):
+        self.cursor.execute('''
+            INSERT INTO locations (name, emoji, color)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (name) DO NOTHING
+        ''', (name, emoji, color))
+        if self.cursor.rowcount > 0:
+            self.cursor.execute(BUMP_ALL_ROSTER_VERSIONS)
+
+    def set_capacity(self, name, capacity):
+        self.cursor.execute('UPDATE locations SET capacity = %s WHERE name = %s', (capacity, name))
+
+    def remove_duplicates(self):
+        """Delete all but the first location of each name; returns the names cleaned up"""
+        duplicates = self.fetch_all('''
+            SELECT name, MIN(id) as keep_id
+            FROM locations
+            GROUP BY name
+            HAVING COUNT(*) > 1
+        ''')
+        for dup in duplicates:
+            self.cursor.execute('''
+                DELETE FROM locations
+                WHERE name = %s AND id != %s
+            ''', (dup['name'], dup['keep_id']))
+        if duplicates:
+            self.cursor.execute(BUMP_ALL_ROSTER_VERSIONS)
+        return [dup['name'] for dup in duplicates]
+
+
+class ResponseRepository(Repository):
+    def for_user_day(self, user_id, day):
+        """Where a user will be on a day (with their desk), or None"""
+        return run(self.cursor, USER_DAY_LOCATION, (user_id, day)).fetchone()
+
+    def day_summary(self, team_id, day):
+        """People per location, busiest first"""
+        return run(self.cursor, TEAM_DAY_SUMMARY, (team_id, day)).fetchall()
+
+    def day_members(self, team_id, day):
+        """Who is where, by location then name"""
+        return run(self.cursor, TEAM_DAY_MEMBERS, (team_id, day)).fetchall()
+
+    def day_missing(self, team_id, day):
+        """Names of active members who haven't answered"""
+        return run(self.cursor, TEAM_DAY_MISSING, (team_id, team_id, day)).fetchall()
+
+    def day_version(self, team_id, day):
+        """(team roster_version, latest change_seq among the team's responses for the day or 0)"""
+        row = run(self.cursor, TEAM_DAY_VERSION, (team_id, team_id, day)).fetchone()
+        return row['roster_version'], row['version']
+
+    def upsert(self, user_id, location_id, day, team_id, desk_id=None):
+        """Set a user's location for a day; returns the new change_seq"""
+        try:
+            run(self.cursor, UPSERT_RESPONSE, (user_id, location_id, day, team_id, desk_id))
+        except DatabaseError as e:
+            if is_unique_violation(e):
+                raise Conflict(str(e)) from e
+            raise
+        return self.cursor.fetchone()['change_seq']
+
+    def calendar(self, user_id, start, end):
+        """A user's responses with location details, oldest first"""
+        return run(self.cursor, USER_CALENDAR, (user_id, start, end)).fetchall()
+
+    def count_for_day(self, team_id, day):
+        return self.fetch_one('SELECT COUNT(*) as total FROM responses WHERE team_id = %s AND date = %s',
+                        (team_id, day))['total']
+
+    def count_between(self, team_id, start, end):
+        return self.fetch_one('SELECT COUNT(*) as total FROM responses WHERE team_id = %s AND date BETWEEN %s AND %s',
+                        (team_id, start, end))['total']
+
+    def day_roster(self, team_id, day):
+        """Every active member's response for a day, with user and location details"""
+        return self.fetch_all('''
+            SELECT
+                r.date,
+                u.name as user_name,
+                u.email as user_email,
+                l.name as location_name,
+                l.emoji as location_emoji,
+                l.color as location_color
+            FROM responses r
+            JOIN users u ON r.user_id = u.id
+            JOIN locations l ON r.location_id = l.id
+            WHERE r.team_id = %s AND r.date = %s AND u.is_active = TRUE
+            ORDER BY l.name, u.name
+        ''', (team_id, day))
+
+    def day_location_counts(self, team_id, day):
+        """Active members per location, busiest first"""
+        return self.fetch_all('''
+            SELECT
+                l.name as name,
+                l.emoji as emoji,
+                l.color as color,
+                COUNT(*) as count
+            FROM responses r
+            JOIN locations l ON r.location_id = l.id
+            JOIN users u ON r.user_id = u.id
+            WHERE r.team_id = %s AND r.date = %s AND u.is_active = TRUE
+            GROUP BY l.id
+            ORDER BY count DESC, l.name
+        ''', (team_id, day))
+
+    def day_location_names(self, team_id, day):
+        """Per location: count and the comma-separated names of who is there"""
+        names = "GROUP_CONCAT(u.name, ', ')" if self.sqlite else "STRING_AGG(u.name, ', ')"
+        return self.fetch_all(f'''
+            SELECT l.name, l.emoji, l.color, COUNT(*) as count,
+                   {names} as users
+            FROM responses r
+            JOIN users u ON r.user_id = u.id
+            JOIN locations l ON r.location_id = l.id
+            WHERE r.team_id = %s AND r.date = %s AND u.is_active = TRUE
+            GROUP BY l.id
+        ''', (team_id, day))
+
+    def rosters(self, team_ids, day):
+        """One pass over a day's responses for several teams, by team, location and name"""
+        return self.fetch_all(f'''
+            SELECT r.team_id, l.name, l.emoji, l.color, u.name as user_name
+            FROM responses r
+            JOIN users u ON r.user_id = u.id
+            JOIN locations l ON r.location_id = l.id
+            WHERE {self.in_list('r.team_id')} AND r.date = %s AND u.is_active = TRUE
+            ORDER BY r.team_id, l.name, u.name
+        ''', (list(team_ids), day))
+
+    def export(self, team_id, start, end, stream=None):
+        """
+        Export rows, newest day first. With a `stream` name the rows come from a
+        server-side cursor (iterate it, then close it) instead of being loaded at once.
+        """
+        if stream is None:
+            return self.fetch_all(EXPORT_QUERY, (team_id, start, end))
+        rows = self.cursor.connection.cursor(name=stream)
+        rows.itersize = 5000
+        rows.execute(EXPORT_QUERY, (team_id, start, end))
+        return rows
+
+    def changes(self, team_id, after_txid, after_seq, limit):
+        """
+        Responses changed after a (change_txid, change_seq) cursor, oldest first.
+        Keyset paging on (team_id, change_txid, change_seq) - one index range scan
+        per page. On Postgres only changes of transactions older than every running
+        one are read, so a change can't commit behind the cursor later; SQLite
+        writers are serialised (change_txid stays 0) and commit in change_seq order.
+        """
+        visible = '' if self.sqlite else 'AND r.change_txid < txid_snapshot_xmin(txid_current_snapshot())'
+        return self.fetch_all(f'''
+            SELECT r.change_txid, r.change_seq, r.date, r.timestamp, r.user_id, u.email as user_email,
+                   r.location_id, l.name as location_name
+            FROM responses r
+            JOIN users u ON r.user_id = u.id
+            JOIN locations l ON r.location_id = l.id
+            WHERE r.team_id = %s AND (r.change_txid, r.change_seq) > (%s, %s)
+            {visible}
+            ORDER BY r.change_txid, r.change_seq
+            LIMIT %s
+        ''', (team_id, after_txid, after_seq, limit))
+
+    def feed_position(self):
+        """
+        Cursor to follow the feed from, taken just before a full load: every change
+        behind it has committed, so the load already contains it
+        """
+        if self.sqlite:
+            return 0, self.fetch_one('SELECT COALESCE(MAX(change_seq), 0) as seq FROM responses')['seq']
+        return self.fetch_one('SELECT txid_snapshot_xmin(txid_current_snapshot()) as txid')['txid'], 0
+
+    def changed_since(self, after_txid, after_seq, since, team_id=None):
+        """
+        Current state of responses dated `since` onwards that changed after a cursor,
+        in feed order (all teams unless team_id). Same visibility rule as changes().
+        """
+        visible = '' if self.sqlite else 'AND change_txid < txid_snapshot_xmin(txid_current_snapshot())'
+        team = 'team_id = %s AND' if team_id is not None else ''
+        params = ((team_id,) if team_id is not None else ()) + (after_txid, after_seq, since)
+        return self.fetch_all(f'''
+            SELECT user_id, location_id, date, desk_id, change_txid, change_seq
+            FROM responses
+            WHERE {team} (change_txid, change_seq) > (%s, %s) AND date >= %s
+            {visible}
+            ORDER BY change_txid, change_seq
+        ''', params)
+
+    def team_days(self, team_id, since):
+        """Every plan of a team dated `since` onwards, for a full attendance load"""
+        return self.fetch_all('''
+            SELECT user_id, location_id, date FROM responses
+            WHERE team_id = %s AND date >= %s
+        ''', (team_id, since))
+
+    def teammate_desks(self, team_id, day, location_id, user_id):
+        """Desks booked by the user's teammates at a location on a day"""
+        run(self.cursor, TEAMMATE_DESKS, (team_id, day, location_id, user_id))
+        return [row['desk_id'] for row in self.cursor.fetchall()]
+
+    def weekday_history(self, team_id, user_ids, start, end):
+        """(user_id, weekday, location_id, count): habits aggregated in SQL, Monday = 0"""
+        run(self.cursor, WEEKDAY_HISTORY, (team_id, list(user_ids), start, end))
+        return [(row['user_id'], row['weekday'], row['location_id'], row['count'])
+                for row in self.cursor.fetchall()]
+
+    def group_plans(self, team_id, user_ids, start, end):
+        """(user_id, date, location_id) already planned by the group"""
+        run(self.cursor, GROUP_PLANS, (team_id, list(user_ids), start, end))
+        return [(row['user_id'], row['date'], row['location_id']) for row in self.cursor.fetchall()]
+
+    def outside_bookings(self, start, end, location_ids, user_ids):
+        """(date, location_id) -> people booked there who aren't in the group (any team)"""
+        run(self.cursor, OUTSIDE_BOOKINGS, (start, end, list(location_ids), list(user_ids)))
+        return {(row['date'], row['location_id']): row['people'] for row in self.cursor.fetchall()}
+
+    def assign_teams(self):
+        """Give responses created before teams existed their user's team"""
+        self.cursor.execute('''
+            UPDATE responses SET team_id = (SELECT u.team_id FROM users u WHERE u.id = responses.user_id)
+            WHERE team_id IS NULL
+        ''')
+
+
+class NotificationRepository(Repository):
+    def log(self, user_id, notification_type):
+        self.cursor.execute('''
+            INSERT INTO notifications (user_id, type)
+            VALUES (%s, %s)
+        ''', (user_id, notification_type))
+
+    def log_many(self, user_ids, notification_type):
+        rows = [(user_id, notification_type) for user_id in user_ids]
+        if self.sqlite:
+            self.cursor.executemany('INSERT INTO notifications (user_id, type) VALUES (%s, %s)', rows)
+        else:
+            psycopg2.extras.execute_values(self.cursor, '''
+                INSERT INTO notifications (user_id, type) VALUES %s
+            ''', rows)
+
+    def log_run(self, notification_type, duration_ms, recipients):
+        """A batch run: how long it took and how many it reached"""
+        self.cursor.execute('''
+            INSERT INTO notifications (user_id, type, duration_ms, recipients)
+            VALUES (NULL, %s, %s, %s)
+        ''', (notification_type, duration_ms, recipients))
+
+    def last_run(self, notification_type):
+        return self.fetch_one('''
+            SELECT sent_at, duration_ms, recipients
+            FROM notifications
+            WHERE type = %s
+            ORDER BY sent_at DESC
+            LIMIT 1
+        ''', (notification_type,))
+
+
+class JobRepository(Repository):
+    def recent(self, team_id, limit=10):
+        return self.fetch_all('''
+            SELECT id, type, status, progress, artifact, result, created_at
+            FROM jobs
+            WHERE team_id = %s
+            ORDER BY created_at DESC
+            LIMIT %s
+        ''', (team_id, limit))
+
+    def get(self, job_id, team_id):
+        return self.fetch_one('SELECT * FROM jobs WHERE id = %s AND team_id = %s', (job_id, team_id))
+
+    def take_artifact(self, job_id):
+        """Detach a job's file so only one caller gets it; False if it was already taken"""
+        return self.fetch_one('''
+            UPDATE jobs SET artifact = NULL
+            WHERE id = %s AND artifact IS NOT NULL
+            RETURNING id
+        ''', (job_id,)) is not None
+
+    def lock(self, name):
+        """Serialise this transaction with any other taking the same named lock"""
+        if self.sqlite:
+            # One writer at a time anyway: take the write lock up front
+            self.cursor.execute('BEGIN IMMEDIATE')
+        else:
+            self.cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', (name,))
+
+    def scheduled_exists(self, job_type, day):
+        """Whether an all-teams job of this type was already queued for the day"""
+        return self.fetch_one('''
+            SELECT 1 FROM jobs
+            WHERE type = %s AND team_id IS NULL AND params->>'date' = %s
+        ''', (job_type, day)) is not None
+
+
+class ProfileRepository(Repository):
+    def recent(self, team_id, limit=10, include_unscoped=False):
+        """
+        Newest profiles of the team's requests. Anonymous requests (the login page)
+        have no team; their SQL may mention any tenant, so only include_unscoped shows them.
+        """
+        return self.fetch_all('''
+            SELECT id, method, endpoint, status, duration_ms, sql_ms, sql_count, trigger, created_at
+            FROM request_profiles
+            WHERE team_id = %s OR (%s AND team_id IS NULL)
+            ORDER BY id DESC
+            LIMIT %s
+        ''', (team_id, include_unscoped, limit))
+
+    def get(self, profile_id, team_id, include_unscoped=False):
+        return self.fetch_one('''
+            SELECT * FROM request_profiles
+            WHERE id = %s AND (team_id = %s OR (%s AND team_id IS NULL))
+        ''', (profile_id, team_id, include_unscoped))
+
+
+class WebhookRepository(Repository):
+    """Webhook subscriptions; delivery needs Postgres (txid snapshots, LISTEN), so not on SQLite"""
+
+    @property
+    def available(self):
+        return not self.sqlite
+
+    def team(self, team_id):
+        """Subscriptions with their backlog and dead letters"""
+        if self.sqlite:
+            return []
+        return self.fetch_all('''
+            SELECT s.id, s.url, s.secret, s.is_active, s.attempts, s.next_attempt_at, s.last_error,
+                   s.last_delivered_at,
+                   (SELECT COUNT(*) FROM webhook_outbox o
+                    WHERE o.team_id = s.team_id AND (o.txid, o.id) > (s.last_txid, s.last_event_id)) as pending,
+                   (SELECT COUNT(*) FROM webhook_dead_letters d WHERE d.subscription_id = s.id) as dead_letters
+            FROM webhook_subscriptions s
+            WHERE s.team_id = %s
+            ORDER BY s.id
+        ''', (team_id,))
+
+    def create(self, team_id, url, secret):
+        # Start at the current end of the outbox: only new changes are sent
+        self.cursor.execute('''
+            INSERT INTO webhook_subscriptions (team_id, url, secret, last_txid)
+            VALUES (%s, %s, %s, txid_snapshot_xmin(txid_current_snapshot()))
+        ''', (team_id, url, secret))
+
+    def toggle(self, webhook_id, team_id):
+        """Pause or resume; a resumed webhook skips what it missed while paused"""
+        self.cursor.execute('''
+            UPDATE webhook_subscriptions
+            SET is_active = NOT is_active, attempts = 0, last_error = NULL, next_attempt_at = CURRENT_TIMESTAMP,
+                last_txid = CASE WHEN is_active THEN last_txid
+                                 ELSE txid_snapshot_xmin(txid_current_snapshot()) END,
+                last_event_id = CASE WHEN is_active THEN last_event_id ELSE 0 END
+            WHERE id = %s AND team_id = %s
+        ''', (webhook_id, team_id))
+
+    def delete(self, webhook_id, team_id):
+        self.cursor.execute('DELETE FROM webhook_subscriptions WHERE id = %s AND team_id = %s',
+                            (webhook_id, team_id))
+
+    def emit_location_event(self, user_id, day):
+        """Queue the change for the team's webhooks; commits (or rolls back) with the response"""
+        if not self.sqlite:
+            run(self.cursor, EMIT_LOCATION_EVENT, (user_id, day))
+
+
+class Repositories:
+    """All repositories over one cursor: one connection, one transaction"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.teams = TeamRepository(cursor)
+        self.users = UserRepository(cursor)
+        self.locations = LocationRepository(cursor)
+        self.responses = ResponseRepository(cursor)
+        self.notifications = NotificationRepository(cursor)
+        self.jobs = JobRepository(cursor)
+        self.profiles = ProfileRepository(cursor)
+        self.webhooks = WebhookRepository(cursor)
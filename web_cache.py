@@ -0,0 +1,145 @@
+"""
+HTTP response compression, fingerprinted static assets and a rendered-fragment cache
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request, url_for
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/csv', 'text/plain', 'text/calendar',
+    'application/json', 'application/javascript', 'text/javascript',
+    'application/x-ndjson', 'image/svg+xml',
+}
+
+# Static responses with a query string carry a content hash, so they never change
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+class FragmentCache:
+    """Small thread-safe LRU cache for rendered HTML fragments, with a TTL"""
+
+    def __init__(self, max_entries=512, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()[:12]
+
+
+def init_web_cache(app, min_size=1024, level=6):
+    """Install the asset_url() template helper and the compression hook"""
+    digests = {}
+    # (filename, file digest, encoding) -> compressed bytes for static files
+    static_compressed = {}
+
+    def static_digest(filename):
+        digest = digests.get(filename)
+        if digest is None or app.debug:
+            digest = _file_digest(os.path.join(app.static_folder, filename))
+            digests[filename] = digest
+        return digest
+
+    def asset_url(filename):
+        """URL of a static file with its content hash appended"""
+        return url_for('static', filename=filename, v=static_digest(filename))
+
+    app.jinja_env.globals['asset_url'] = asset_url
+
+    def choose_encoding():
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+        return None
+
+    def compress(data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=5)
+        return gzip.compress(data, compresslevel=level, mtime=0)
+
+    @app.after_request
+    def optimize_response(response):
+        is_static = request.endpoint == 'static'
+        if is_static and request.query_string and response.status_code == 200:
+            response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+
+        if (response.status_code != 200 or (response.is_streamed and not is_static)
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding()
+        if encoding is None:
+            return response
+
+        if is_static:
+            # send_file streams from disk; compress each file once per encoding
+            filename = request.view_args.get('filename')
+            key = (filename, static_digest(filename), encoding)
+            body = static_compressed.get(key)
+            if body is not None:
+                close = getattr(response.response, 'close', None)
+                if close:
+                    close()
+            else:
+                response.direct_passthrough = False
+                data = response.get_data()
+                if len(data) < min_size:
+                    return response
+                body = compress(data, encoding)
+                static_compressed[key] = body
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            body = compress(data, encoding)
+
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        etag, _ = response.get_etag()
+        if etag:
+            # Same resource, different bytes: only a weak validator still holds
+            response.set_etag(etag, weak=True)
+        return response
+
+    return asset_url
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Local webhook receiver for trying out deliveries
+Prints every batch it gets, checks the signature when given the secret, and
+can fail on purpose to exercise retries and dead-lettering. Point a webhook at
+http://127.0.0.1:8099/hook from the admin panel, then run python worker.py.
+
+    python webhook_standin.py [--port 8099] [--secret SECRET] [--fail 3] [--status 503]
+"""
+
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from webhooks import sign
+
+
+def make_handler(args):
+    remaining_failures = [args.fail]
+
+    class Handler(BaseHTTPRequestHandler):
+        # HTTP/1.1 so the dispatcher's keep-alive connections are reused
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            client = f"{self.client_address[0]}:{self.client_address[1]}"
+
+            if remaining_failures[0] > 0:
+                remaining_failures[0] -= 1
+                print(f"💥 {client} {self.headers.get('X-Webhook-Id')}: answering {args.status}")
+                self.reply(args.status)
+                return
+
+            if args.secret and self.headers.get('X-Webhook-Signature') != sign(args.secret, body):
+                print(f"❌ {client} {self.headers.get('X-Webhook-Id')}: bad signature")
+                self.reply(401)
+                return
+
+            batch = json.loads(body)
+            print(f"📦 {client} {self.headers.get('X-Webhook-Id')}: {len(batch['events'])} events "
+                  f"({batch['first_event_id']}-{batch['last_event_id']})")
+            for event in batch['events']:
+                print(f"     {event['type']} {event['date']} {event['user_email']} -> {event['location_name']}")
+            self.reply(204)
+
+        def reply(self, status):
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local webhook receiver')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--secret', help='Signing secret from the admin panel')
+    parser.add_argument('--fail', type=int, default=0, help='Fail this many deliveries first')
+    parser.add_argument('--status', type=int, default=503, help='Status code for failed deliveries')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(args))
+    print(f"🎯 Webhook stand-in listening on http://127.0.0.1:{args.port}/hook")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,425 @@
+"""
+Outbound webhooks for location changes
+set_location() writes an event to webhook_outbox in the same transaction as
+the response, so an event exists exactly when the change was committed and the
+request never waits on a subscriber. A dispatcher thread in each job worker
+delivers the outbox to every subscription of the team:
+
+  - each subscription keeps its own cursor into the outbox. Outbox ids are
+    taken at insert but become visible at commit, so the cursor follows
+    (txid, id) and only reads rows older than every running transaction:
+    nothing can commit behind it later
+  - a burst of changes goes out as one batched POST, and repeated updates of
+    the same person and day within a batch collapse to the latest one
+  - keep-alive connections are pooled per endpoint
+  - failed batches are retried with exponential backoff and dead-lettered
+    after max_attempts, so one broken endpoint never blocks the others
+  - endpoints must resolve to public addresses, checked when subscribing and
+    again on every connect (so DNS rebinding can't reach internal hosts);
+    admins only see a short error category, never the raw socket error
+
+Delivery is at least once: receivers should dedupe on the X-Webhook-Id header.
+The cursor relies on Postgres transaction ids and LISTEN, so webhooks are only
+available on the PostgreSQL backend.
+"""
+
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import os
+import random
+import select
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# Rows for this event type are coalesced on (user, day)
+LOCATION_UPDATED = 'location.updated'
+
+
+def init_webhook_tables(cursor):
+    """Create the subscription, outbox and dead-letter tables"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_subscriptions (
+            id SERIAL PRIMARY KEY,
+            team_id INTEGER NOT NULL REFERENCES teams(id),
+            url TEXT NOT NULL,
+            secret VARCHAR(64) NOT NULL,
+            is_active BOOLEAN NOT NULL DEFAULT TRUE,
+            last_txid BIGINT NOT NULL DEFAULT 0,
+            last_event_id BIGINT NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            leased_until TIMESTAMP,
+            last_error TEXT,
+            last_delivered_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_webhook_subscriptions_team ON webhook_subscriptions(team_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            txid BIGINT NOT NULL DEFAULT txid_current(),
+            team_id INTEGER NOT NULL REFERENCES teams(id),
+            event_type VARCHAR(50) NOT NULL,
+            payload JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_webhook_outbox_team ON webhook_outbox(team_id, txid, id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_dead_letters (
+            id SERIAL PRIMARY KEY,
+            subscription_id INTEGER NOT NULL REFERENCES webhook_subscriptions(id) ON DELETE CASCADE,
+            first_event_id BIGINT NOT NULL,
+            last_event_id BIGINT NOT NULL,
+            body TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+class BlockedAddress(OSError):
+    """The endpoint resolves to a loopback, private, link-local or reserved address"""
+
+
+def public_address(host, port, allow_private=False):
+    """First address of host, refusing it if any of its addresses isn't public"""
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    addresses = [info[4][0] for info in infos]
+    if not allow_private:
+        for address in addresses:
+            ip = ipaddress.ip_address(address.split('%')[0])
+            if ip.version == 6 and ip.ipv4_mapped:
+                ip = ip.ipv4_mapped
+            if not ip.is_global or ip.is_multicast:
+                raise BlockedAddress(f"{host} resolves to non-public address {ip}")
+    return addresses[0]
+
+
+def delivery_error(e):
+    """What the admin panel shows for a failed POST (details stay in the worker log)"""
+    if isinstance(e, BlockedAddress):
+        return 'Blocked: host resolves to a private or reserved address'
+    if isinstance(e, socket.gaierror):
+        return 'Host not found'
+    if isinstance(e, TimeoutError):
+        return 'Timed out'
+    return 'Connection failed'
+
+
+def coalesce_events(rows):
+    """Keep only the latest location.updated per (user, day); other events pass through"""
+    latest = {}
+    for row in rows:
+        payload = row['payload']
+        if row['event_type'] == LOCATION_UPDATED:
+            key = (LOCATION_UPDATED, payload['user_id'], payload['date'])
+            # change_seq orders updates of the same response
+            if key in latest and latest[key]['payload']['change_seq'] > payload['change_seq']:
+                continue
+        else:
+            key = row['id']
+        latest.pop(key, None)
+        latest[key] = row
+    return [dict(row['payload'], id=row['id'], type=row['event_type'],
+                 created_at=row['created_at'].isoformat()) for row in latest.values()]
+
+
+def sign(secret, body):
+    return 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class EndpointPool:
+    """Keep-alive HTTP(S) connections per endpoint origin, shared by dispatcher threads"""
+
+    def __init__(self, timeout=10, max_idle=4, allow_private=False):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.allow_private = allow_private
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _checkout(self, origin):
+        with self._lock:
+            idle = self._idle.get(origin)
+            if idle:
+                return idle.pop()
+        scheme, host, port = origin
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        conn = connection_class(host, port, timeout=self.timeout)
+
+        # Connect to the address that passed the check; TLS still verifies the host name
+        def create_connection(address, timeout, source_address=None):
+            checked = public_address(address[0], address[1], self.allow_private)
+            return socket.create_connection((checked, address[1]), timeout, source_address)
+        conn._create_connection = create_connection
+        return conn
+
+    def _checkin(self, origin, conn):
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def post(self, url, body, headers):
+        """POST and return (status, Retry-After header)"""
+        parts = urlsplit(url)
+        origin = (parts.scheme, parts.hostname, parts.port)
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        for attempt in range(2):
+            conn = self._checkout(origin)
+            reused = conn.sock is not None
+            try:
+                conn.request('POST', path, body, headers)
+                response = conn.getresponse()
+                response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                # The endpoint may have dropped an idle keep-alive connection: retry on a fresh one
+                if reused and attempt == 0:
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._checkin(origin, conn)
+            return response.status, response.getheader('Retry-After')
+
+
+class Dispatcher:
+    """Delivers the outbox to subscriptions; any number can run against the same tables"""
+
+    def __init__(self, get_db, batch_size=100, linger=0.2, max_attempts=8, backoff=5.0,
+                 backoff_max=3600.0, timeout=10, concurrency=8, lease_seconds=60, allow_private_hosts=False):
+        self.get_db = get_db
+        self.batch_size = batch_size
+        self.linger = linger
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.concurrency = concurrency
+        self.lease_seconds = max(lease_seconds, timeout * 3)
+        self.endpoints = EndpointPool(timeout=timeout, allow_private=allow_private_hosts)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='webhook')
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.last_pruned = 0.0
+
+    def claim(self):
+        """Lease due subscriptions that have undelivered events"""
+        conn = self.get_db()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE webhook_subscriptions
+                SET leased_until = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                WHERE id IN (
+                    SELECT s.id FROM webhook_subscriptions s
+                    WHERE s.is_active = TRUE AND s.next_attempt_at <= CURRENT_TIMESTAMP
+                    AND (s.leased_until IS NULL OR s.leased_until < CURRENT_TIMESTAMP)
+                    AND EXISTS (
+                        SELECT 1 FROM webhook_outbox o
+                        WHERE o.team_id = s.team_id AND (o.txid, o.id) > (s.last_txid, s.last_event_id)
+                        AND o.txid < txid_snapshot_xmin(txid_current_snapshot())
+                    )
+                    ORDER BY s.next_attempt_at
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT %s
+                )
+                RETURNING *
+            ''', (self.lease_seconds, self.concurrency))
+            subscriptions = cursor.fetchall()
+            conn.commit()
+            return subscriptions
+        finally:
+            conn.close()
+
+    def deliver(self, subscription):
+        """Send one batch to one subscription and move its cursor; True if delivered"""
+        conn = self.get_db()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, txid, event_type, payload, created_at
+                FROM webhook_outbox
+                WHERE team_id = %s AND (txid, id) > (%s, %s)
+                AND txid < txid_snapshot_xmin(txid_current_snapshot())
+                ORDER BY txid, id
+                LIMIT %s
+            ''', (subscription['team_id'], subscription['last_txid'], subscription['last_event_id'],
+                  self.batch_size))
+            rows = cursor.fetchall()
+            conn.commit()
+            if not rows:
+                self._release(cursor, subscription)
+                return False
+
+            first_id, last_id = rows[0]['id'], rows[-1]['id']
+            position = (rows[-1]['txid'], last_id)
+            body = json.dumps({
+                'team_id': subscription['team_id'],
+                'events': coalesce_events(rows),
+                'first_event_id': first_id,
+                'last_event_id': last_id
+            }).encode()
+            headers = {
+                'Content-Type': 'application/json',
+                'User-Agent': 'OfficeTracker-Webhooks/1.0',
+                'X-Webhook-Id': f"{subscription['id']}-{last_id}",
+                'X-Webhook-Signature': sign(subscription['secret'], body)
+            }
+
+            error, retry_after, permanent = None, None, False
+            try:
+                status, retry_after = self.endpoints.post(subscription['url'], body, headers)
+                if not 200 <= status < 300:
+                    error = f"HTTP {status}"
+                    # Other client errors won't go away by resending the same batch
+                    permanent = 400 <= status < 500 and status not in (408, 429)
+            except (http.client.HTTPException, OSError, ValueError) as e:
+                print(f"⚠️  Webhook {subscription['id']} POST failed: {type(e).__name__}: {e}")
+                error = delivery_error(e)
+                # Resending won't make an internal address public
+                permanent = isinstance(e, BlockedAddress)
+
+            if error is None:
+                cursor.execute('''
+                    UPDATE webhook_subscriptions
+                    SET last_txid = %s, last_event_id = %s, attempts = 0, last_error = NULL, leased_until = NULL,
+                        next_attempt_at = CURRENT_TIMESTAMP, last_delivered_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                ''', (*position, subscription['id']))
+            else:
+                self._failed(cursor, subscription, first_id, position, body, error, retry_after, permanent)
+            conn.commit()
+            return error is None
+        finally:
+            conn.close()
+
+    def _failed(self, cursor, subscription, first_id, position, body, error, retry_after, permanent):
+        last_id = position[1]
+        attempts = subscription['attempts'] + 1
+        if permanent or attempts >= self.max_attempts:
+            # Park the batch and move on so later events still flow
+            cursor.execute('''
+                INSERT INTO webhook_dead_letters
+                    (subscription_id, first_event_id, last_event_id, body, attempts, error)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            ''', (subscription['id'], first_id, last_id, body.decode(), attempts, error))
+            cursor.execute('''
+                UPDATE webhook_subscriptions
+                SET last_txid = %s, last_event_id = %s, attempts = 0, last_error = %s, leased_until = NULL,
+                    next_attempt_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            ''', (*position, error, subscription['id']))
+            print(f"☠️  Webhook {subscription['id']} dead-lettered events {first_id}-{last_id}: {error}")
+            return
+
+        delay = min(self.backoff_max, self.backoff * 2 ** (attempts - 1))
+        delay *= random.uniform(0.8, 1.2)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(int(retry_after), self.backoff_max))
+        cursor.execute('''
+            UPDATE webhook_subscriptions
+            SET attempts = %s, last_error = %s, leased_until = NULL,
+                next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+            WHERE id = %s
+        ''', (attempts, error, delay, subscription['id']))
+        print(f"⚠️  Webhook {subscription['id']} failed ({error}); retry {attempts} in {delay:.0f}s")
+
+    def _release(self, cursor, subscription):
+        cursor.execute('UPDATE webhook_subscriptions SET leased_until = NULL WHERE id = %s',
+                       (subscription['id'],))
+        cursor.connection.commit()
+
+    def dispatch_once(self):
+        """Deliver one batch to every due subscription; returns (claimed, delivered)"""
+        subscriptions = self.claim()
+        if not subscriptions:
+            return 0, 0
+        delivered = sum(self.executor.map(self.deliver, subscriptions))
+        return len(subscriptions), delivered
+
+    def prune(self):
+        """Drop outbox rows every active subscription of the team has received"""
+        conn = self.get_db()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM webhook_outbox o
+                WHERE o.created_at < CURRENT_TIMESTAMP - INTERVAL '1 hour'
+                AND NOT EXISTS (
+                    SELECT 1 FROM webhook_subscriptions s
+                    WHERE s.team_id = o.team_id AND s.is_active = TRUE
+                    AND (s.last_txid, s.last_event_id) < (o.txid, o.id)
+                )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def run(self, poll_interval=5.0):
+        """Dispatcher loop: deliver whenever events are committed or retries fall due"""
+        listen_conn = self.get_db()
+        listen_conn.autocommit = True
+        listen_conn.cursor().execute('LISTEN webhook_events')
+
+        print(f"🔗 Webhook dispatcher {self.name} started")
+        while True:
+            try:
+                claimed, _ = self.dispatch_once()
+                if time.monotonic() - self.last_pruned > 60:
+                    self.prune()
+                    self.last_pruned = time.monotonic()
+            except Exception as e:
+                print(f"❌ Webhook dispatch failed: {e}")
+                claimed = 0
+            if claimed:
+                continue
+
+            # Nothing due: sleep until NOTIFY or the poll interval elapses
+            if select.select([listen_conn], [], [], poll_interval) != ([], [], []):
+                listen_conn.poll()
+                listen_conn.notifies.clear()
+                # Let the rest of a burst commit so it goes out as one batch
+                time.sleep(self.linger)
+
+
+def start_dispatcher(get_db, settings):
+    """Run a dispatcher in a daemon thread (config: webhooks section)"""
+    dispatcher = Dispatcher(
+        get_db,
+        batch_size=settings.get('batch_size', 100),
+        linger=settings.get('linger_ms', 200) / 1000,
+        max_attempts=settings.get('max_attempts', 8),
+        backoff=settings.get('backoff_seconds', 5),
+        backoff_max=settings.get('backoff_max_seconds', 3600),
+        timeout=settings.get('timeout', 10),
+        concurrency=settings.get('concurrency', 8),
+        allow_private_hosts=settings.get('allow_private_hosts', False)
+    )
+    thread = threading.Thread(target=dispatcher.run, args=(settings.get('poll_interval', 5),),
+                              name='webhook-dispatcher', daemon=True)
+    thread.start()
+    return dispatcher
+
+
+def is_valid_url(url, allow_private=False):
+    """Only absolute http(s) URLs of hosts with public addresses can be subscribed"""
+    try:
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            return False
+        public_address(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80), allow_private)
+    except (OSError, ValueError, UnicodeError):
+        return False
+    return True
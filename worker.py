@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Background job worker (also delivers outbound webhooks)
+Run any number of these alongside the web processes: python worker.py
+"""
+
+import os
+
+# The web processes own the scheduler; workers only run queued jobs
+os.environ.setdefault('DISABLE_SCHEDULER', '1')
+
+from app import get_db, config, store  # noqa: E402  (registers the job handlers)
+from jobs import run_worker  # noqa: E402
+from webhooks import start_dispatcher  # noqa: E402
+
+
+if __name__ == '__main__':
+    # Webhook deliveries run alongside jobs so a long export never delays them
+    # (they need Postgres; the embedded SQLite backend has no webhooks)
+    if store.dialect == 'postgresql':
+        start_dispatcher(get_db, config.get('webhooks', {}))
+    jobs_config = config.get('jobs', {})
+    run_worker(get_db, poll_interval=jobs_config.get('poll_interval', 5),
+               lease_seconds=jobs_config.get('lease_seconds', 120),
+               max_attempts=jobs_config.get('max_attempts', 3))